@@ -0,0 +1,135 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+"""Compares syncing several data directories one after another and concurrently in an event loop.
+
+Each data directory holds its own timewarrior database, with one interval added before every
+round of syncs. The longest time the event loop didn't get to run a ticking task while the
+syncs were running shows how much it was blocked.
+
+Usage:
+    python -m benchmarks.bench_async_sync [number of data directories] [number of rounds] [server latency ms]
+"""
+
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+from benchmarks.bench_wire_format import make_history
+from tests.sync_server import SyncServer
+from timewsync import auth, sync
+from timewsync.client import async_sync
+from timewsync.config import Configuration
+from timewsync.file_parser import as_file_strings
+from timewsync.interval import Interval
+from timewsync.io_handler import write_keys
+from timewsync.paths import TimewarriorPaths
+
+
+def add_interval(configs, hours: int) -> None:
+    """Add an interval starting the given number of hours after 2030 to every database."""
+    start = Interval.from_interval_str("inc 20300101T000000Z - 20300101T003000Z").start + timedelta(hours=hours)
+    file_name, data = next(iter(as_file_strings([Interval(start=start, end=start + timedelta(minutes=30))])[0].items()))
+    for config in configs:
+        os.makedirs(config.timew_paths.db_data_dir, exist_ok=True)
+        with open(os.path.join(config.timew_paths.db_data_dir, file_name), "a") as file:
+            file.write("\n" + data)
+
+
+async def measure_async(configs, rounds: int) -> (float, float):
+    """Return the median time of a round of concurrent syncs and the longest stall of the event loop, in ms."""
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.001)
+
+    times = []
+    for i in range(rounds):
+        add_interval(configs, i)
+        ticker = asyncio.ensure_future(tick())
+        start = time.perf_counter()
+        await asyncio.gather(*(async_sync(config) for config in configs))
+        times.append(time.perf_counter() - start)
+        ticker.cancel()
+    stall = max(b - a for a, b in zip(ticks, ticks[1:]))
+    return statistics.median(times) * 1000, stall * 1000
+
+
+def measure_sequential(configs, rounds: int) -> (float, float):
+    """Return the median time of a round of syncs one after another and the time the caller was blocked, in ms."""
+    times = []
+    for i in range(rounds):
+        add_interval(configs, i)
+        start = time.perf_counter()
+        for config in configs:
+            sync(config)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000, max(times) * 1000
+
+
+def main(directory_count: int, rounds: int, latency: float):
+    logging.disable(logging.WARNING)
+    intervals = make_history(200)
+    private_key_pem, _ = auth.generate_keys("ed25519")
+
+    results = {}
+    for mode in ("one after another", "async_sync()"):
+        server = SyncServer().start()
+        server.latency = latency
+        server.intervals = [i.asdict() for i in intervals]
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                configs = []
+                for n in range(directory_count):
+                    data_dir = os.path.join(directory, str(n), "timewsync")
+                    write_keys(data_dir, private_key_pem, b"")
+                    timew_paths = TimewarriorPaths(os.path.join(directory, str(n), "timewarrior"))
+                    configs.append(Configuration(data_dir, server.base_url, n + 1, timew_paths=timew_paths))
+                if mode == "async_sync()":
+                    results[mode] = asyncio.run(measure_async(configs, rounds))
+                else:
+                    results[mode] = measure_sequential(configs, rounds)
+        finally:
+            server.stop()
+
+    for mode, (duration, stall) in results.items():
+        print(f"{mode:>17}: {duration:.1f} ms per round, event loop blocked for up to {stall:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 8,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5,
+        (float(sys.argv[3]) if len(sys.argv) > 3 else 50) / 1000,
+    )
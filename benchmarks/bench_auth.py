@@ -0,0 +1,104 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+"""Measures the cost of authenticating a sync.
+
+For every supported key type, the key pair generation, the signing of a token with the key kept
+in memory and the server-side verification are timed. For an RSA key, signing a token from the
+PEM file and with the key kept in memory are compared to reusing a cached token from the data
+directory.
+
+Usage:
+    python -m benchmarks.bench_auth [number of tokens]
+"""
+
+import statistics
+import sys
+import tempfile
+import time
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+
+from timewsync import auth
+from timewsync.io_handler import read_token, write_token
+
+
+def measure(function, count: int) -> float:
+    """Return the median time of a call, in milliseconds."""
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def compare_key_types(count: int):
+    """Print the times of generating keys, signing and verifying tokens per key type."""
+    print(f"{'key type':>10} {'keygen ms':>10} {'sign ms':>8} {'verify ms':>10}")
+    for key_type in auth.KEY_TYPES:
+        keygen = measure(lambda: auth.generate_keys(key_type), max(1, count // 10) if key_type == "rsa" else count)
+        private_key_pem, public_key_pem = auth.generate_keys(key_type)
+        token = auth.generate_jwt(private_key_pem, 1)
+        sign = measure(lambda: auth.generate_jwt(private_key_pem, 1), count)
+        public_key = serialization.load_pem_public_key(public_key_pem)
+        verify = measure(lambda: jwt.decode(token, public_key, algorithms=auth.ALGORITHMS), count)
+        print(f"{key_type:>10} {keygen:>10.2f} {sign:>8.3f} {verify:>10.3f}")
+    print()
+
+
+def main(count: int):
+    compare_key_types(count)
+
+    private_key_pem, _ = auth.generate_keys()
+    digest = auth.key_digest(private_key_pem)
+
+    def sign_from_pem():
+        jwt.encode({"userID": 1}, private_key_pem, algorithm="RS256")
+
+    def sign_with_cached_key():
+        auth.generate_jwt(private_key_pem, 1)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_token(data_dir, auth.generate_jwt(private_key_pem, 1), digest)
+
+        def reuse_cached_token():
+            token, token_digest = read_token(data_dir)
+            assert token_digest == auth.key_digest(private_key_pem) and auth.is_reusable(token, 1)
+
+        results = {
+            "sign, parsing the PEM": measure(sign_from_pem, count),
+            "sign, key kept in memory": measure(sign_with_cached_key, count),
+            "reuse cached token": measure(reuse_cached_token, count),
+        }
+
+    for name, result in results.items():
+        print(f"{name:>25}: {result:.3f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,84 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+"""Compares syncs with several equivalent servers, always using the first one or the fastest healthy one.
+
+Three stand-in servers answer with different injected latencies, the first configured one being
+the slowest. A fourth, unreachable server is listed first in the failover setup, so every sync
+also pays for detecting it until it is recorded as unhealthy.
+
+Usage:
+    python -m benchmarks.bench_failover [number of syncs]
+"""
+
+import statistics
+import sys
+import tempfile
+import time
+
+from tests.sync_server import SyncServer
+from timewsync.config import Configuration
+from timewsync.dispatch import Dispatcher
+from timewsync.failover import FailoverDispatcher
+
+LATENCIES = [0.05, 0.02, 0.005]
+
+
+def measure(create_dispatcher, count: int) -> float:
+    """Return the median time of a sync through a new dispatcher, in milliseconds."""
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        with create_dispatcher() as dispatcher:
+            dispatcher.dispatch([], [], "token")
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main(count: int):
+    servers = [SyncServer().start() for _ in LATENCIES]
+    unreachable = SyncServer().start()
+    unreachable.stop()
+    try:
+        for server, latency in zip(servers, LATENCIES):
+            server.latency = latency
+        base_urls = [server.base_url for server in servers]
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            first = measure(lambda: Dispatcher(Configuration(data_dir, base_urls, 1)), count)
+            fastest = measure(
+                lambda: FailoverDispatcher(Configuration(data_dir, [unreachable.base_url] + base_urls, 1)), count
+            )
+    finally:
+        for server in servers:
+            server.stop()
+
+    print(f"first configured server: {first:.2f} ms per sync")
+    print(f"fastest healthy server:  {fastest:.2f} ms per sync")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,127 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+"""Measures the encoding and decoding throughput of the JSON codec.
+
+Every operation is timed for the old path, serializing Interval objects with strftime and json.dumps and
+parsing them with json.loads and strptime, and for the current path of json_converter.
+
+Usage:
+    python -m benchmarks.bench_json_codec [number of intervals ...]
+"""
+
+import json
+import sys
+import time
+from datetime import datetime
+
+from benchmarks.bench_wire_format import make_history
+from timewsync import json_converter
+from timewsync.interval import DATETIME_FORMAT, Interval
+
+
+def throughput(function, count: int) -> (float, float):
+    """Run the function once and return the duration in seconds and the intervals per second."""
+    start = time.perf_counter()
+    function()
+    duration = time.perf_counter() - start
+    return duration, count / duration
+
+
+def old_asdict(interval: Interval) -> dict:
+    """Return the interval as dictionary, formatting the dates with strftime."""
+    return {
+        "start": interval.start.strftime(DATETIME_FORMAT) if interval.start else "",
+        "end": interval.end.strftime(DATETIME_FORMAT) if interval.end else "",
+        "tags": interval.tags,
+        "annotation": interval.annotation if interval.annotation else "",
+    }
+
+
+def old_from_dict(start: str = None, end: str = None, tags: list = None, annotation: str = None) -> Interval:
+    """Return the interval of a dictionary, parsing the dates with strptime."""
+    return Interval(
+        start=datetime.strptime(start, DATETIME_FORMAT) if start else None,
+        end=datetime.strptime(end, DATETIME_FORMAT) if end else None,
+        tags=tags,
+        annotation=annotation,
+    )
+
+
+def old_encode_request(intervals) -> str:
+    """Return a sync request adding the intervals, encoded with json.dumps."""
+    return json.dumps({"userID": 1, "added": [old_asdict(i) for i in intervals], "removed": []})
+
+
+def old_encode_ndjson(intervals) -> bytes:
+    """Return an NDJSON sync request adding the intervals, encoded with json.dumps."""
+    lines = [json.dumps({"userID": 1})] + [json.dumps({"op": "added", **old_asdict(i)}) for i in intervals]
+    return "".join(line + "\n" for line in lines).encode("utf-8")
+
+
+def old_decode(response: str) -> list:
+    """Return the intervals of a sync response, decoded with json.loads."""
+    return [old_from_dict(**value) for value in json.loads(response)["intervals"]]
+
+
+def main(sizes):
+    print(f"JSON backend: {json_converter.JSON_BACKEND}")
+    print(f"{'intervals':>10} {'operation':>20} {'old s':>8} {'new s':>8} {'new intervals/s':>16} {'speedup':>8}")
+    for count in sizes:
+        intervals = make_history(count)
+        response = json.dumps({"conflictsOccurred": False, "intervals": [i.asdict() for i in intervals]})
+        chunks = [response[i : i + 64 * 1024] for i in range(0, len(response), 64 * 1024)]
+
+        operations = {
+            "encode request": (
+                lambda: old_encode_request(intervals),
+                lambda: json_converter.to_json_request(1, (intervals, [])),
+            ),
+            "encode ndjson": (
+                lambda: old_encode_ndjson(intervals),
+                lambda: b"".join(json_converter.iter_ndjson_request(1, (intervals, []))),
+            ),
+            "decode streaming": (
+                lambda: old_decode(response),
+                lambda: list(json_converter.ResponseParser(chunks)),
+            ),
+            "decode document": (
+                lambda: old_decode(response),
+                lambda: json_converter.from_json_response(response),
+            ),
+        }
+        for name, (old, new) in operations.items():
+            old_duration, _ = throughput(old, count)
+            new_duration, rate = throughput(new, count)
+            print(
+                f"{count:>10} {name:>20} {old_duration:>8.2f} {new_duration:>8.2f} {rate:>16.0f}"
+                f" {old_duration / new_duration:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000])
@@ -0,0 +1,89 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+"""Compares a full sync response with a months response after one month changed on the server.
+
+The client has never told the server its state, so the server can't answer with a delta.
+With month digests, the server only sends the intervals of the month that differs.
+Comparing the timewarrior data with the snapshot takes the same time for both, so the
+diff is computed once up front and left out of the measurement.
+
+Usage:
+    python -m benchmarks.bench_month_digests [number of intervals]
+"""
+
+import importlib
+import sys
+import time
+
+from benchmarks.bench_wire_format import make_history
+from tests.sync_server import SyncServer
+from timewsync.config import Configuration
+from timewsync.dispatch import MONTHS_CONTENT_TYPE, Delta, Dispatcher, generate_diff
+
+# The package exports the dispatch function under the same name as the module
+dispatch_module = importlib.import_module("timewsync.dispatch")
+
+
+def main(count: int):
+    intervals = make_history(count)
+    years = intervals[-1].start.year - intervals[0].start.year + 1
+    diff = generate_diff(intervals, intervals)
+    dispatch_module.generate_diff = lambda *_: diff
+    print(f"{count} intervals in {years} years, one changed month")
+    print(f"{'response':>9} {'intervals':>10} {'bytes':>9} {'seconds':>8}")
+
+    changed = intervals[count // 2].asdict()
+    changed["annotation"] = "changed on the server"
+
+    for name, response_types in [("full", []), ("months", [MONTHS_CONTENT_TYPE])]:
+        server = SyncServer().start()
+        server.intervals = [i.asdict() for i in intervals]
+        server.intervals[count // 2] = changed
+        server.states.clear()
+        server.response_types = response_types
+        try:
+            with Dispatcher(Configuration("", server.base_url, 1)) as dispatcher:
+                sizes = []
+                request = dispatcher.transport.request
+
+                def record_size(*args, **kwargs):
+                    response = request(*args, **kwargs)
+                    sizes.append(int(response.headers["Content-Length"]))
+                    return response
+
+                dispatcher.transport.request = record_size
+                start = time.perf_counter()
+                result, _ = dispatcher.dispatch(intervals, intervals, "token", accept_delta=True)
+                elapsed = time.perf_counter() - start
+            received = sum(map(len, result)) if isinstance(result, Delta) else len(result)
+            print(f"{name:>9} {received:>10} {sizes[-1]:>9} {elapsed:>8.2f}")
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 12000)
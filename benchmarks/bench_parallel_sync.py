@@ -0,0 +1,70 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+"""Measures the wall-clock time of a sync sharded by month at increasing concurrency.
+
+The stand-in server of the tests answers every request after an artificial latency,
+like a server on the other side of the world.
+
+Usage:
+    python -m benchmarks.bench_parallel_sync [latency in seconds] [number of intervals]
+"""
+
+import sys
+import time
+
+from benchmarks.bench_wire_format import make_history
+from tests.sync_server import SyncServer
+from timewsync.config import Configuration
+from timewsync.dispatch import Dispatcher
+
+
+def main(latency: float, count: int):
+    intervals = make_history(count)
+    months = len({(i.start.year, i.start.month) for i in intervals})
+    print(f"{count} intervals in {months} months, {latency * 1000:.0f} ms latency per request")
+    print(f"{'concurrency':>12} {'requests':>9} {'seconds':>8}")
+
+    for concurrency in [1, 2, 4, 8, 16]:
+        server = SyncServer().start()
+        server.latency = latency
+        try:
+            config = Configuration(
+                "", server.base_url, 1, pool_maxsize=concurrency, shard_by="month", parallel_requests=concurrency
+            )
+            with Dispatcher(config) as dispatcher:
+                start = time.perf_counter()
+                result, _ = dispatcher.dispatch(intervals, [], "token")
+                elapsed = time.perf_counter() - start
+            assert len(result) == count
+            print(f"{concurrency:>12} {len(server.requests):>9} {elapsed:>8.2f}")
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.1, int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
@@ -0,0 +1,126 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+"""Compares the wall time of syncs signing the token and connecting before or while parsing the data.
+
+The stand-in server runs locally, so the TCP and TLS handshakes of a distant server are
+simulated by a delay when connecting. The sequential variant runs the background tasks of
+the sync in the calling thread, as soon as they are submitted.
+
+Usage:
+    python -m benchmarks.bench_pipelined_sync [number of syncs] [number of intervals] [handshake ms]
+"""
+
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import Future
+
+from benchmarks.bench_wire_format import make_history
+from tests.sync_server import SyncServer
+from timewsync import auth, client, sync
+from timewsync.config import Configuration
+from timewsync.file_parser import as_file_strings
+from timewsync.io_handler import write_keys, write_snapshot
+from timewsync.paths import TimewarriorPaths
+from timewsync.transport import HTTPClientTransport
+
+
+class InlineExecutor:
+    """Runs submitted functions immediately in the calling thread."""
+
+    def __init__(self, max_workers: int = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def submit(self, function, *args):
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+
+def measure(config: Configuration, count: int) -> float:
+    """Return the median wall time of a sync without changes, in milliseconds."""
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        sync(config)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main(count: int, interval_count: int, handshake: float):
+    logging.disable(logging.WARNING)
+    intervals = make_history(interval_count)
+    monthly_data = as_file_strings(intervals)[0]
+    private_key_pem, _ = auth.generate_keys()
+
+    connect = HTTPClientTransport._connect
+
+    def slow_connect(connection, timeout):
+        time.sleep(handshake)
+        connect(connection, timeout)
+
+    HTTPClientTransport._connect = staticmethod(slow_connect)
+
+    server = SyncServer().start()
+    server.intervals = [i.asdict() for i in intervals]
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            timew_paths = TimewarriorPaths(os.path.join(directory, "timewarrior"))
+            data_dir = os.path.join(directory, "timewsync")
+            os.makedirs(timew_paths.db_data_dir)
+            for file_name, data in monthly_data.items():
+                with open(os.path.join(timew_paths.db_data_dir, file_name), "w") as file:
+                    file.write(data)
+            write_keys(data_dir, private_key_pem, b"")
+            write_snapshot(data_dir, monthly_data)
+            config = Configuration(data_dir, server.base_url, 1, timew_paths=timew_paths)
+
+            pipelined = measure(config, count)
+            client.ThreadPoolExecutor = InlineExecutor
+            sequential = measure(config, count)
+    finally:
+        server.stop()
+
+    print(f"sequential: {sequential:.1f} ms per sync")
+    print(f" pipelined: {pipelined:.1f} ms per sync")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 2000,
+        (float(sys.argv[3]) if len(sys.argv) > 3 else 150) / 1000,
+    )
@@ -0,0 +1,125 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+"""Compares mirroring the data to a backup server by separate invocations and by replicated syncs.
+
+Before every sync, one interval is added to a timewarrior database holding a longer history.
+Separate invocations sync with the primary and the backup server one after another, each with
+its own data directory, parsing and diffing the data twice. A replicated sync lists the backup
+server as replica and sends the same diff to both servers concurrently.
+
+Usage:
+    python -m benchmarks.bench_replicas [number of syncs] [number of intervals] [server latency ms]
+"""
+
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+from benchmarks.bench_wire_format import make_history
+from tests.sync_server import SyncServer
+from timewsync import auth, sync
+from timewsync.config import Configuration
+from timewsync.file_parser import as_file_strings
+from timewsync.interval import Interval
+from timewsync.io_handler import write_keys
+from timewsync.paths import TimewarriorPaths
+
+
+def measure(configs, intervals, count: int) -> float:
+    """Return the median time of syncing all configurations after adding an interval, in milliseconds."""
+    with tempfile.TemporaryDirectory() as db_dir:
+        timew_paths = TimewarriorPaths(db_dir)
+        for config in configs:
+            config.timew_paths = timew_paths
+            sync(config)
+
+        times = []
+        end = intervals[-1].end
+        for i in range(count):
+            new_interval = Interval(start=end + timedelta(hours=i), end=end + timedelta(hours=i, minutes=30))
+            file_name, data = next(iter(as_file_strings([new_interval])[0].items()))
+            # Like timewarrior, which ends every line with a newline
+            path = os.path.join(timew_paths.db_data_dir, file_name)
+            with open(path, "a+") as file:
+                file.seek(0)
+                content = file.read()
+                if content and not content.endswith("\n"):
+                    data = "\n" + data
+                file.write(data + "\n")
+
+            start = time.perf_counter()
+            for config in configs:
+                sync(config)
+            times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main(count: int, interval_count: int, latency: float):
+    logging.disable(logging.WARNING)
+    intervals = make_history(interval_count)
+    private_key_pem, _ = auth.generate_keys()
+
+    results = {}
+    for mode in ("separate invocations", "replicated sync"):
+        primary, backup = SyncServer().start(), SyncServer().start()
+        for server in (primary, backup):
+            server.latency = latency
+            server.intervals = [i.asdict() for i in intervals]
+        try:
+            with tempfile.TemporaryDirectory() as data_dir:
+                configs = []
+                for name in ("primary", "backup"):
+                    os.makedirs(os.path.join(data_dir, name))
+                    write_keys(os.path.join(data_dir, name), private_key_pem, b"")
+                if mode == "replicated sync":
+                    config = Configuration(os.path.join(data_dir, "primary"), primary.base_url, 1)
+                    config.replica_base_urls = [backup.base_url]
+                    configs = [config]
+                else:
+                    configs = [
+                        Configuration(os.path.join(data_dir, "primary"), primary.base_url, 1),
+                        Configuration(os.path.join(data_dir, "backup"), backup.base_url, 1),
+                    ]
+                results[mode] = measure(configs, intervals, count)
+        finally:
+            primary.stop()
+            backup.stop()
+
+    for mode, result in results.items():
+        print(f"{mode:>20}: {result:.1f} ms per sync")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 2000,
+        (float(sys.argv[3]) if len(sys.argv) > 3 else 20) / 1000,
+    )
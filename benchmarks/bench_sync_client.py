@@ -0,0 +1,117 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+"""Compares repeated syncs by timewsync processes, by separate sync() calls and by one SyncClient.
+
+Before every sync, one interval is added to a timewarrior database holding a longer history.
+A process pays for starting the interpreter and importing timewsync on every sync. Every sync()
+call reads the private key, opens new connections and parses all interval files, while a
+SyncClient keeps the key, the token, the connections and the intervals of unchanged files
+between syncs.
+
+Usage:
+    python -m benchmarks.bench_sync_client [number of syncs] [number of intervals]
+"""
+
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+from benchmarks.bench_wire_format import make_history
+from tests.sync_server import SyncServer
+from timewsync import auth, sync
+from timewsync.client import SyncClient
+from timewsync.config import CONFIGURATION_FILE_NAME, Configuration
+from timewsync.file_parser import as_file_strings
+from timewsync.interval import Interval
+from timewsync.io_handler import write_keys
+from timewsync.paths import TimewarriorPaths
+
+
+def measure(sync_once, config, intervals, count: int) -> float:
+    """Return the median time of a sync after adding an interval, in milliseconds."""
+    sync_once()
+
+    times = []
+    end = intervals[-1].end
+    for i in range(count):
+        new_interval = Interval(start=end + timedelta(hours=i), end=end + timedelta(hours=i, minutes=30))
+        file_name, data = next(iter(as_file_strings([new_interval])[0].items()))
+        with open(os.path.join(config.timew_paths.db_data_dir, file_name), "a") as file:
+            file.write("\n" + data)
+
+        start = time.perf_counter()
+        sync_once()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main(count: int, interval_count: int):
+    logging.disable(logging.WARNING)
+    intervals = make_history(interval_count)
+    private_key_pem, _ = auth.generate_keys("ed25519")
+
+    results = {}
+    for mode in ("processes", "sync() calls", "SyncClient"):
+        server = SyncServer().start()
+        server.intervals = [i.asdict() for i in intervals]
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                data_dir = os.path.join(directory, "timewsync")
+                write_keys(data_dir, private_key_pem, b"")
+                timew_paths = TimewarriorPaths(os.path.join(directory, "timewarrior"))
+                config = Configuration(data_dir, server.base_url, 1, timew_paths=timew_paths)
+                with open(os.path.join(data_dir, CONFIGURATION_FILE_NAME), "w") as file:
+                    file.write(f"[Server]\nBaseURL = {server.base_url}\n[Client]\nUserID = 1\n")
+                    file.write(f"TimewarriorDB = {timew_paths.timewarriordb}\n")
+                command = [sys.executable, "-m", "timewsync", "--data-dir", data_dir]
+                if mode == "processes":
+                    results[mode] = measure(
+                        lambda: subprocess.run(command, check=True, stderr=subprocess.DEVNULL), config, intervals, count
+                    )
+                elif mode == "SyncClient":
+                    with SyncClient(config) as sync_client:
+                        results[mode] = measure(sync_client.sync, config, intervals, count)
+                else:
+                    results[mode] = measure(lambda: sync(config), config, intervals, count)
+        finally:
+            server.stop()
+
+    for mode, result in results.items():
+        print(f"{mode:>12}: {result:.1f} ms per sync")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+    )
@@ -0,0 +1,91 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+"""Compares the transports by their startup cost and by the latency of a sync request.
+
+The startup cost is measured in a fresh interpreter for each transport. It is the time
+spent creating the transport, including importing the HTTP library it depends on.
+The latency is the median time of a sync without changes against the stand-in server
+of the tests, over a connection kept open.
+
+Usage:
+    python -m benchmarks.bench_transport [number of requests]
+"""
+
+import statistics
+import subprocess
+import sys
+import time
+
+from tests.sync_server import SyncServer
+from timewsync.config import Configuration
+from timewsync.dispatch import Dispatcher
+from timewsync.transport import TRANSPORTS, FakeTransport
+
+STARTUP_CODE = """
+import time
+from timewsync.transport import FakeTransport, create_transport
+start = time.perf_counter()
+transport = FakeTransport(None) if {name!r} == "fake" else create_transport({name!r})
+print(time.perf_counter() - start)
+"""
+
+
+def measure_startup(name: str, repeat: int = 5) -> float:
+    """Return the best time out of several fresh interpreters for creating the transport, in milliseconds."""
+    times = [
+        float(subprocess.run([sys.executable, "-c", STARTUP_CODE.format(name=name)], capture_output=True).stdout)
+        for _ in range(repeat)
+    ]
+    return min(times) * 1000
+
+
+def measure_latency(name: str, count: int) -> float:
+    """Return the median time of a sync request using the transport, in milliseconds."""
+    server = SyncServer().start()
+    try:
+        config = Configuration("", server.base_url, 1, transport=None if name == "fake" else name)
+        transport = FakeTransport(server.handle) if name == "fake" else None
+        with Dispatcher(config, transport) as dispatcher:
+            dispatcher.dispatch([], [], "token")
+            times = []
+            for _ in range(count):
+                start = time.perf_counter()
+                dispatcher.dispatch([], [], "token")
+                times.append(time.perf_counter() - start)
+    finally:
+        server.stop()
+    return statistics.median(times) * 1000
+
+
+def main(count: int):
+    print(f"{'transport':>12} {'startup ms':>11} {'request ms':>11}")
+    for name in list(TRANSPORTS) + ["fake"]:
+        print(f"{name:>12} {measure_startup(name):>11.1f} {measure_latency(name, count):>11.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,90 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+"""Compares the latency of syncs with a local server over loopback TCP and over a Unix domain socket.
+
+Two kinds of syncs are measured against the stand-in server of the tests, over a connection
+kept open: one without any changes, and one receiving a larger history.
+
+Usage:
+    python -m benchmarks.bench_unix_socket [number of requests] [number of intervals]
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_wire_format import make_history
+from tests.sync_server import SyncServer
+from timewsync.config import Configuration
+from timewsync.dispatch import Dispatcher
+
+
+def measure(server: SyncServer, count: int, intervals) -> (float, float):
+    """Return the median times of a sync without changes and of a sync receiving the intervals, in milliseconds."""
+    server.intervals = []
+    with Dispatcher(Configuration("", server.base_url, 1)) as dispatcher:
+        dispatcher.dispatch([], [], "token")
+        idle = []
+        for _ in range(count):
+            start = time.perf_counter()
+            dispatcher.dispatch([], [], "token")
+            idle.append(time.perf_counter() - start)
+
+        server.intervals = [i.asdict() for i in intervals]
+        full = []
+        for _ in range(max(1, count // 50)):
+            start = time.perf_counter()
+            dispatcher.dispatch([], [], "token")
+            full.append(time.perf_counter() - start)
+    return statistics.median(idle) * 1000, statistics.median(full) * 1000
+
+
+def main(count: int, interval_count: int):
+    intervals = make_history(interval_count)
+    print(f"{'connection':>12} {'idle sync ms':>13} {f'{interval_count} intervals ms':>18}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        servers = [
+            ("loopback TCP", SyncServer()),
+            ("Unix socket", SyncServer(unix_socket=os.path.join(directory, "sync.sock"))),
+        ]
+        for name, server in servers:
+            server.start()
+            try:
+                idle, full = measure(server, count, intervals)
+            finally:
+                server.stop()
+            print(f"{name:>12} {idle:>13.3f} {full:>18.2f}")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5000,
+    )
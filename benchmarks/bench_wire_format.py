@@ -0,0 +1,89 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+"""Compares encoding and decoding time and size of the JSON and MessagePack wire formats.
+
+Usage:
+    python -m benchmarks.bench_wire_format [number of intervals ...]
+"""
+
+import json
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from timewsync import json_converter, msgpack_converter
+from timewsync.interval import Interval
+
+
+def make_history(count: int, seed: int = 0):
+    """Generate a history of consecutive intervals with a realistic set of tags."""
+    rng = random.Random(seed)
+    tags = [f"project-{i}" for i in range(30)] + ["meeting", "review", "support", "travel"]
+    start = datetime(2015, 1, 1)
+    intervals = []
+    for _ in range(count):
+        start += timedelta(minutes=rng.randint(5, 600))
+        end = start + timedelta(minutes=rng.randint(5, 240))
+        annotation = rng.choice(["", "", "", "follow-up", "call with customer"])
+        intervals.append(
+            Interval(start=start, end=end, tags=rng.sample(tags, rng.randint(0, 3)), annotation=annotation)
+        )
+        start = end
+    return intervals
+
+
+def measure(function, repeat: int = 3) -> float:
+    """Return the best time out of several runs, in milliseconds."""
+    return min(timeit.repeat(function, number=1, repeat=repeat)) * 1000
+
+
+def main(sizes):
+    print(f"{'intervals':>10} {'format':>8} {'bytes':>12} {'encode ms':>10} {'decode ms':>10}")
+    for count in sizes:
+        intervals = make_history(count)
+        json_response = json.dumps({"conflictsOccurred": False, "intervals": [i.asdict() for i in intervals]}).encode(
+            "utf-8"
+        )
+
+        encode_ms = measure(lambda: json_converter.to_json_request(1, (intervals, [])))
+        decode_ms = measure(lambda: list(json_converter.ResponseParser([json_response.decode("utf-8")])))
+        print(f"{count:>10} {'json':>8} {len(json_response):>12} {encode_ms:>10.1f} {decode_ms:>10.1f}")
+
+        if not msgpack_converter.is_available():
+            print(f"{count:>10} {'msgpack':>8} {'(msgpack is not installed)':>34}")
+            continue
+
+        msgpack_response = msgpack_converter.to_msgpack_response(intervals, False)
+        encode_ms = measure(lambda: msgpack_converter.to_msgpack_request(1, (intervals, [])))
+        decode_ms = measure(lambda: list(msgpack_converter.ResponseParser([msgpack_response])))
+        print(f"{count:>10} {'msgpack':>8} {len(msgpack_response):>12} {encode_ms:>10.1f} {decode_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,67 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+import os
+import tempfile
+
+import pytest
+
+from tests.sync_server import SyncServer
+from timewsync import auth
+
+
+@pytest.fixture(autouse=True)
+def timewarriordb(tmp_path, monkeypatch):
+    """Keeps syncs without explicitly given timewarrior paths away from the user's database."""
+    monkeypatch.setenv("TIMEWARRIORDB", str(tmp_path / "timewarriordb"))
+
+
+@pytest.fixture
+def sync_server():
+    server = SyncServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope="session")
+def key_pairs():
+    return {key_type: auth.generate_keys(key_type) for key_type in auth.KEY_TYPES}
+
+
+@pytest.fixture(scope="session")
+def private_key_pem(key_pairs):
+    private_key_pem, _ = key_pairs["rsa"]
+    return private_key_pem
+
+
+@pytest.fixture
+def unix_sync_server():
+    # The paths of Unix domain sockets are limited to about 100 characters, too few for tmp_path
+    with tempfile.TemporaryDirectory() as directory:
+        server = SyncServer(unix_socket=os.path.join(directory, "sync.sock")).start()
+        yield server
+        server.stop()
@@ -0,0 +1,494 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+"""An in-memory stand-in for the timewarrior synchronization server, used by the tests.
+
+It implements the sync and verify endpoints like the real server does, apart from conflict resolution,
+and records every request it receives so tests can inspect what was sent over the wire.
+"""
+
+import gzip
+import http.client
+import io
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+import zlib
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import quote, urlsplit
+
+import jwt
+
+from timewsync import auth, msgpack_converter
+from timewsync.digest import MerkleTree, month_digests, state_digest
+from timewsync.interval import Interval, format_datetime
+from timewsync.transport import ConnectionFailedError
+
+SYNC_ENDPOINT = "/api/sync"
+VERIFY_ENDPOINT = "/api/verify"
+DELTA_CONTENT_TYPE = "application/vnd.timewsync.delta+json"
+MONTHS_CONTENT_TYPE = "application/vnd.timewsync.months+json"
+
+
+class Request(NamedTuple):
+    """A request received by the stand-in server.
+
+    For clients of a Unix domain socket, client_port identifies their connection instead of a port.
+    """
+
+    method: str
+    path: str
+    headers: dict
+    body: bytes
+    client_port: int
+
+
+class Fault(NamedTuple):
+    """A fault injected into the handling of the next PUT or POST request.
+
+    Attributes:
+        status: Respond with this status code and a non-JSON body instead of handling the request
+        retry_after: The value of the Retry-After header sent along with the status
+        delay: Seconds to wait before responding
+        drop: Close the connection without responding
+        drop_after_apply: Apply the diff, then close the connection without responding
+    """
+
+    status: Optional[int] = None
+    retry_after: Optional[str] = None
+    delay: float = 0.0
+    drop: bool = False
+    drop_after_apply: bool = False
+
+
+class SyncServer:
+    """Holds the state of a stand-in server and runs it in a background thread.
+
+    Attributes:
+        accept_put: The content types accepted as sync request body
+        accept_encoding: The content encodings accepted for the sync request body
+        compress_responses: Whether responses are compressed if the client accepts it
+        intervals: The intervals stored on the server, in the JSON representation of the protocol
+        conflicts: The value reported as 'conflictsOccurred'
+        requests: All received requests
+        faults: Faults injected into the handling of the next requests, in order
+        applied_keys: The idempotency keys of all applied sync requests
+        max_request_intervals: Reject sync requests with more intervals than this as too large
+        latency: Seconds to wait before answering any PUT or POST request, like a distant server
+        features: The protocol extensions advertised, e.g. "modified"
+        states: The states sent to clients by their digest, for answering with deltas
+        response_types: The partial response types the server answers with, if accepted by the client
+        unix_socket: The path of the Unix domain socket the server listens on, instead of a TCP port
+        path_prefix: The path the endpoints are served under, e.g. "/relay"
+        minimal_responses: Whether sync requests preferring "return=minimal" are answered with the conflict flag only
+        public_key: The public key in PEM format the tokens of PUT and POST requests are verified with, if any
+    """
+
+    def __init__(self, accept_put: List[str] = None, accept_encoding: List[str] = None, unix_socket: str = None):
+        if accept_put is None:
+            accept_put = ["application/json"]
+        if accept_encoding is None:
+            accept_encoding = []
+        self.accept_put: List[str] = accept_put
+        self.accept_encoding: List[str] = accept_encoding
+        self.compress_responses: bool = False
+        self.intervals: List[dict] = []
+        self.conflicts: bool = False
+        self.requests: List[Request] = []
+        self.faults: List[Fault] = []
+        self.applied_keys: List[str] = []
+        self.max_request_intervals: Optional[int] = None
+        self.latency: float = 0.0
+        self.features: List[str] = []
+        self.states: Dict[str, List[dict]] = {state_digest([]): []}
+        self.response_types: List[str] = [DELTA_CONTENT_TYPE, MONTHS_CONTENT_TYPE]
+        self.lock = threading.Lock()
+        self.unix_socket: Optional[str] = unix_socket
+        self.path_prefix: str = ""
+        self.minimal_responses: bool = True
+        self.public_key: Optional[bytes] = None
+        if unix_socket is None:
+            self._httpd = _HTTPServer(("127.0.0.1", 0), _make_handler(self))
+        else:
+            handler = _make_handler(self)
+            handler.disable_nagle_algorithm = False
+            self._httpd = _UnixHTTPServer(unix_socket, handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, args=(0.05,), daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        if self.unix_socket is not None:
+            return f"http+unix://{quote(self.unix_socket, safe='')}"
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "SyncServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self.unix_socket is not None and os.path.exists(self.unix_socket):
+            os.remove(self.unix_socket)
+
+    def handle(self, method: str, url: str, headers: Dict[str, str], body: bytes) -> (int, Dict[str, str], bytes):
+        """Handle a request in the same process, without a network connection, as the handler of a FakeTransport."""
+        parts = urlsplit(url)
+        target = parts.path + (f"?{parts.query}" if parts.query else "")
+        if headers.get("Transfer-Encoding") == "chunked":
+            body = (b"%x\r\n%s\r\n" % (len(body), body) if body else b"") + b"0\r\n\r\n"
+        else:
+            headers = {**headers, "Content-Length": str(len(body))}
+        head = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+
+        handler_class = self._httpd.RequestHandlerClass
+        handler = handler_class.__new__(handler_class)
+        handler.rfile = io.BytesIO(f"{method} {target} HTTP/1.1\r\n{head}\r\n".encode("latin-1") + body)
+        handler.wfile = io.BytesIO()
+        handler.client_address = ("127.0.0.1", 0)
+        handler.server = self._httpd
+        handler.handle_one_request()
+
+        if not handler.wfile.getvalue():
+            raise ConnectionFailedError("The server closed the connection without responding")
+        response = http.client.HTTPResponse(_InProcessSocket(handler.wfile.getvalue()), method=method)
+        response.begin()
+        return response.status, dict(response.getheaders()), response.read()
+
+    def inject(self, *faults: Fault) -> None:
+        """Inject faults into the handling of the next requests."""
+        with self.lock:
+            self.faults += faults
+
+    def next_fault(self) -> Fault:
+        with self.lock:
+            return self.faults.pop(0) if self.faults else Fault()
+
+    def apply(
+        self, added: List[dict], removed: List[dict], modified: List[dict] = (), idempotency_key: str = None
+    ) -> None:
+        """Apply a diff to the stored intervals, unless a request with the same idempotency key was applied."""
+        with self.lock:
+            if idempotency_key:
+                if idempotency_key in self.applied_keys:
+                    return
+                self.applied_keys.append(idempotency_key)
+            self.intervals = apply_ops(self.intervals, added, removed, modified)
+
+    def remember(self, intervals: List[dict]) -> str:
+        """Remember a state sent to a client, so later deltas can be computed against it."""
+        digest = state_digest(Interval.from_dict(**i) for i in intervals)
+        with self.lock:
+            self.states[digest] = [dict(i) for i in intervals]
+        return digest
+
+
+def apply_ops(intervals: List[dict], added: List[dict], removed: List[dict], modified: List[dict] = ()) -> List[dict]:
+    """Return the intervals with the operations of a sync request applied."""
+    intervals = [dict(i) for i in intervals if i not in removed]
+    intervals += [i for i in added if i not in intervals]
+    for modification in modified:
+        for interval in intervals:
+            if (interval["start"], interval["end"]) == (modification["start"], modification["end"]):
+                interval.update(modification["changes"])
+    return intervals
+
+
+def parse_request(content_type: str, body: bytes) -> (List[dict], List[dict], List[dict], Dict[str, str]):
+    """Decode a sync request body into the lists of added and removed intervals, modifications and month digests."""
+    if content_type == "application/x-ndjson":
+        ops = {"added": [], "removed": [], "modified": []}
+        lines = body.decode("utf-8").splitlines()
+        header = json.loads(lines[0])
+        for line in lines[1:]:
+            interval = json.loads(line)
+            ops[interval.pop("op")].append(interval)
+        return ops["added"], ops["removed"], ops["modified"], header.get("monthDigests")
+
+    if content_type == msgpack_converter.CONTENT_TYPE:
+        request = msgpack_converter.msgpack.unpackb(body, raw=False)
+        tags = request["tags"]
+        added = [i.asdict() for i in msgpack_converter.decode_intervals(request["added"], tags)]
+        removed = [i.asdict() for i in msgpack_converter.decode_intervals(request["removed"], tags)]
+        modified = [_decode_modification(m, tags) for m in request.get("modified", [])]
+        return added, removed, modified, request.get("monthDigests")
+
+    request = json.loads(body)
+    return request["added"], request["removed"], request.get("modified", []), request.get("monthDigests")
+
+
+def _decode_modification(encoded: list, tags: List[str]) -> dict:
+    """Decode a MessagePack modification into its JSON representation."""
+
+    def timestamp(seconds):
+        return format_datetime(msgpack_converter.EPOCH + timedelta(seconds=seconds))
+
+    start, end, changes = encoded
+    if "start" in changes:
+        changes["start"] = timestamp(changes["start"])
+    if "end" in changes:
+        changes["end"] = timestamp(changes["end"])
+    if "tags" in changes:
+        changes["tags"] = [tags[tag_id] for tag_id in changes["tags"]]
+    if "annotation" in changes:
+        changes["annotation"] = changes["annotation"] or ""
+    return {"start": timestamp(start), "end": timestamp(end), "changes": changes}
+
+
+def _split(header: str) -> List[str]:
+    """Return the media types listed in an Accept header, without parameters."""
+    return [value.split(";")[0].strip() for value in header.split(",") if value.strip()]
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients giving up on a request are expected when injecting faults
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _InProcessSocket:
+    """The socket a response is parsed from when handling a request in the same process."""
+
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def makefile(self, mode: str) -> io.BytesIO:
+        return io.BytesIO(self._data)
+
+
+def _make_handler(server: SyncServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Like most servers, send small writes right away instead of waiting for the client's ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_OPTIONS(self):
+            self._record(b"")
+            self.send_response(204)
+            self.send_header("Accept-Put", ", ".join(server.accept_put))
+            if server.accept_encoding:
+                self.send_header("Accept-Encoding", ", ".join(server.accept_encoding))
+            if server.features:
+                self.send_header("Sync-Features", ", ".join(server.features))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_PUT(self):
+            body = self._read_body()
+            self._record(body)
+
+            fault = server.next_fault()
+            if self._inject(fault) or not self._authorize():
+                return
+
+            if self.path != server.path_prefix + SYNC_ENDPOINT:
+                return self._send_error(404, "Not found")
+
+            content_type = self.headers.get("Content-Type", "application/json")
+            if content_type not in server.accept_put:
+                return self._send_error(415, "Unsupported content type")
+
+            content_encoding = self.headers.get("Content-Encoding")
+            if content_encoding and content_encoding not in server.accept_encoding:
+                return self._send_error(415, "Unsupported content encoding")
+
+            try:
+                if content_encoding == "gzip":
+                    body = gzip.decompress(body)
+                elif content_encoding == "deflate":
+                    body = zlib.decompress(body)
+                added, removed, modified, client_months = parse_request(content_type, body)
+            except (ValueError, KeyError, OSError, zlib.error) as e:
+                return self._send_error(400, "Bad request", str(e))
+
+            request_intervals = len(added) + len(removed) + len(modified)
+            if server.max_request_intervals is not None and request_intervals > server.max_request_intervals:
+                return self._send_error(413, "Request too large")
+
+            server.apply(added, removed, modified, self.headers.get("Idempotency-Key"))
+            if fault.drop_after_apply:
+                self.close_connection = True
+                return
+
+            with server.lock:
+                response = {"conflictsOccurred": server.conflicts, "intervals": server.intervals}
+                base = server.states.get(self.headers.get("Sync-Base"))
+            etag = f'"{server.remember(response["intervals"])}"'
+
+            if not request_intervals and self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+
+            if server.minimal_responses and "return=minimal" in _split(self.headers.get("Prefer", "")):
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Preference-Applied", "return=minimal")
+                body = {"conflictsOccurred": response["conflictsOccurred"]}
+                return self._send_body("application/json", json.dumps(body).encode("utf-8"))
+
+            accept = _split(self.headers.get("Accept", ""))
+            if DELTA_CONTENT_TYPE in accept and DELTA_CONTENT_TYPE in server.response_types and base is not None:
+                client_state = apply_ops(base, added, removed, modified)
+                delta = {
+                    "conflictsOccurred": response["conflictsOccurred"],
+                    "added": [i for i in response["intervals"] if i not in client_state],
+                    "removed": [i for i in client_state if i not in response["intervals"]],
+                }
+                return self._send(200, DELTA_CONTENT_TYPE, json.dumps(delta).encode("utf-8"), etag)
+            if MONTHS_CONTENT_TYPE in accept and MONTHS_CONTENT_TYPE in server.response_types and client_months:
+                months = {}
+                for interval in response["intervals"]:
+                    months.setdefault(interval["start"][:4] + "-" + interval["start"][4:6], []).append(interval)
+                server_months = month_digests(Interval.from_dict(**i) for i in response["intervals"])
+                divergent = {
+                    m for m in set(server_months) | set(client_months) if server_months.get(m) != client_months.get(m)
+                }
+                body = {
+                    "conflictsOccurred": response["conflictsOccurred"],
+                    "months": {m: months.get(m, []) for m in sorted(divergent)},
+                }
+                return self._send(200, MONTHS_CONTENT_TYPE, json.dumps(body).encode("utf-8"), etag)
+            if msgpack_converter.CONTENT_TYPE in server.accept_put and msgpack_converter.CONTENT_TYPE in accept:
+                intervals = [Interval.from_dict(**i) for i in response["intervals"]]
+                body = msgpack_converter.to_msgpack_response(intervals, response["conflictsOccurred"])
+                self._send(200, msgpack_converter.CONTENT_TYPE, body, etag)
+            else:
+                self._send(200, "application/json", json.dumps(response).encode("utf-8"), etag)
+
+        def do_POST(self):
+            body = self._read_body()
+            self._record(body)
+            if self._inject(server.next_fault()) or not self._authorize():
+                return
+
+            if self.path != server.path_prefix + VERIFY_ENDPOINT:
+                return self._send_error(404, "Not found")
+
+            try:
+                buckets = json.loads(body)["buckets"]
+            except (ValueError, KeyError) as e:
+                return self._send_error(400, "Bad request", str(e))
+
+            with server.lock:
+                tree = MerkleTree(Interval.from_dict(**i) for i in server.intervals)
+            self._send_json(200, {"root": tree.root, "buckets": tree.children(buckets)})
+
+        def _inject(self, fault: Fault) -> bool:
+            """Wait for the latency and inject the fault, returning whether the request was answered by it."""
+            time.sleep(server.latency + fault.delay)
+            if fault.drop:
+                self.close_connection = True
+                return True
+            if fault.status:
+                self.send_response(fault.status)
+                if fault.retry_after is not None:
+                    self.send_header("Retry-After", fault.retry_after)
+                self._send_body("text/html", b"<html><body>Service Unavailable</body></html>")
+                return True
+            return False
+
+        def _authorize(self) -> bool:
+            """Verify the token if a public key is set, answering 401 and returning False if it is invalid."""
+            if server.public_key is None:
+                return True
+            token = self.headers.get("Authorization", "").partition("Bearer ")[2]
+            try:
+                claims = jwt.decode(token, server.public_key, algorithms=auth.ALGORITHMS)
+            except jwt.PyJWTError as e:
+                self._send_error(401, "Unauthorized", str(e))
+                return False
+            if "userID" not in claims:
+                self._send_error(401, "Unauthorized", "Missing user ID")
+                return False
+            return True
+
+        def _record(self, body: bytes):
+            with server.lock:
+                server.requests.append(Request(self.command, self.path, dict(self.headers), body, self._client_port()))
+
+        def _client_port(self) -> int:
+            # Clients of a Unix domain socket have no port, the descriptor identifies their connection as well
+            if isinstance(self.client_address, tuple):
+                return self.client_address[1]
+            return self.connection.fileno()
+
+        def _read_body(self) -> bytes:
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0], 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        return b"".join(chunks)
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def _send_error(self, status: int, message: str, details: str = ""):
+            self._send_json(status, {"message": message, "details": details})
+
+        def _send_json(self, status: int, content: dict):
+            self._send(status, "application/json", json.dumps(content).encode("utf-8"))
+
+        def _send(self, status: int, content_type: str, body: bytes, etag: str = None):
+            self.send_response(status)
+            if etag:
+                self.send_header("ETag", etag)
+            self._send_body(content_type, body)
+
+        def _send_body(self, content_type: str, body: bytes):
+            self.send_header("Content-Type", content_type)
+            if server.compress_responses and "gzip" in self.headers.get("Accept-Encoding", ""):
+                body = gzip.compress(body)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
@@ -25,6 +25,7 @@
 ###############################################################################
 
 
+import pytest
 from jwcrypto import jwk
 import jwt
 
@@ -58,3 +59,55 @@ def test_generate_jwt():
     assert claims["userID"] == 42
     assert header["alg"] == "RS256"
     assert header["typ"] == "JWT"
+
+
+def test_expiry_claims():
+    keys = jwk.JWK.generate(kty="RSA", size=2048)
+    priv_pem = keys.export_to_pem(private_key=True, password=None)
+
+    token = auth.generate_jwt(priv_pem, 42, now=1000)
+
+    claims = jwt.decode(token, keys.export_to_pem(), ["RS256"], options={"verify_exp": False})
+    assert claims["iat"] == 1000
+    assert claims["exp"] == 1000 + auth.TOKEN_LIFETIME
+
+
+def test_private_key_parsed_once():
+    keys = jwk.JWK.generate(kty="RSA", size=2048)
+    priv_pem = keys.export_to_pem(private_key=True, password=None)
+    auth._load_private_key.cache_clear()
+
+    auth.generate_jwt(priv_pem, 42)
+    auth.generate_jwt(priv_pem, 42)
+
+    assert auth._load_private_key.cache_info().misses == 1
+
+
+def test_is_reusable():
+    keys = jwk.JWK.generate(kty="RSA", size=2048)
+    token = auth.generate_jwt(keys.export_to_pem(private_key=True, password=None), 42, now=1000)
+
+    assert auth.is_reusable(token, 42, now=1000)
+    assert not auth.is_reusable(token, 43, now=1000)
+    assert not auth.is_reusable(token, 42, now=1000 + auth.TOKEN_LIFETIME - auth.TOKEN_RENEWAL_MARGIN)
+    assert not auth.is_reusable("not a token", 42)
+
+
+@pytest.mark.parametrize("key_type, algorithm", [("ed25519", "EdDSA"), ("es256", "ES256")])
+def test_algorithm_from_key_type(key_type, algorithm):
+    priv_pem, pub_pem = auth.generate_keys(key_type)
+
+    token = auth.generate_jwt(priv_pem, 42)
+
+    decoded = jwt.api_jwt.decode_complete(token, pub_pem, auth.ALGORITHMS)
+    assert decoded["header"]["alg"] == algorithm
+    assert decoded["payload"]["userID"] == 42
+
+
+def test_unsupported_key_type():
+    with pytest.raises(ValueError):
+        auth.generate_keys("dsa")
+
+    keys = jwk.JWK.generate(kty="EC", crv="P-384")
+    with pytest.raises(ValueError):
+        auth.generate_jwt(keys.export_to_pem(private_key=True, password=None), 42)
@@ -41,9 +41,25 @@ def test_generate_key_arg():
     parser = timewsync.make_parser()
     args = parser.parse_args(["generate-key"])
     assert args.subcommand == "generate-key"
+    assert args.key_type == "rsa"
+    assert parser.parse_args(["generate-key", "--type", "ed25519"]).key_type == "ed25519"
+
+
+def test_verify_arg():
+    parser = timewsync.make_parser()
+    args = parser.parse_args(["verify"])
+    assert args.subcommand == "verify"
+    assert not args.offline
+    assert parser.parse_args(["verify", "--offline"]).offline
 
 
 def test_config_file():
     parser = timewsync.make_parser()
     args = parser.parse_args(["--data-dir", "~/.customdir"])
     assert args.data_dir == "~/.customdir"
+
+
+def test_deadline():
+    parser = timewsync.make_parser()
+    assert parser.parse_args([]).deadline is None
+    assert parser.parse_args(["--deadline", "2.5"]).deadline == 2.5
@@ -0,0 +1,171 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+import os
+
+import pytest
+
+from timewsync.config import (
+    Configuration,
+    InvalidConfigurationError,
+    MissingConfigurationError,
+    MissingSectionError,
+    NoConfigurationFileError,
+    create_example_configuration,
+)
+
+
+def write_config(data_dir, content):
+    with open(os.path.join(data_dir, "timewsync.conf"), "w") as file:
+        file.write(content)
+
+
+def test_no_configuration_file(tmp_path):
+    with pytest.raises(NoConfigurationFileError):
+        Configuration.read(str(tmp_path))
+
+
+def test_example_configuration_incomplete(tmp_path):
+    create_example_configuration(str(tmp_path))
+    with pytest.raises(MissingConfigurationError) as e:
+        Configuration.read(str(tmp_path))
+    assert (e.value.section, e.value.name) == ("Server", "BaseURL")
+
+
+def test_missing_section(tmp_path):
+    write_config(tmp_path, "[Server]\nBaseURL = http://localhost:8080\n")
+    with pytest.raises(MissingSectionError) as e:
+        Configuration.read(str(tmp_path))
+    assert e.value.section == "Client"
+
+
+def test_defaults(tmp_path):
+    write_config(tmp_path, "[Server]\nBaseURL = http://localhost:8080\n[Client]\nUserID = 42\n")
+    config = Configuration.read(str(tmp_path))
+    assert config.server_base_url == "http://localhost:8080"
+    assert config.server_base_urls == ["http://localhost:8080"]
+    assert config.user_id == 42
+    assert config.pool_connections == 1
+    assert config.pool_maxsize == 4
+    assert config.keep_alive is True
+    assert config.connect_timeout == 10
+    assert config.read_timeout == 60
+    assert config.retries == 3
+    assert config.shard_by is None
+    assert config.parallel_requests == 4
+    assert config.transport is None
+    assert config.replica_base_urls == []
+    assert config.timew_paths.timewarriordb is None
+
+
+def test_timewarrior_database(tmp_path):
+    write_config(
+        tmp_path, f"[Server]\nBaseURL = http://a:8080\n[Client]\nUserID = 42\nTimewarriorDB = {tmp_path}/timew\n"
+    )
+    config = Configuration.read(str(tmp_path))
+    assert config.timew_paths.db_data_dir == str(tmp_path / "timew" / "data")
+    assert config.timew_paths.config_file == str(tmp_path / "timew" / "timewarrior.cfg")
+
+
+def test_several_servers(tmp_path):
+    write_config(
+        tmp_path, "[Server]\nBaseURL = http://a:8080, http://b:8080,\n  unix:///run/c.sock\n[Client]\nUserID = 42\n"
+    )
+    config = Configuration.read(str(tmp_path))
+    assert config.server_base_url == "http://a:8080"
+    assert config.server_base_urls == ["http://a:8080", "http://b:8080", "unix:///run/c.sock"]
+
+
+def test_replicas(tmp_path):
+    write_config(
+        tmp_path, "[Server]\nBaseURL = http://a:8080\nReplicas = http://b:8080, http://c:8080\n[Client]\nUserID = 42\n"
+    )
+    config = Configuration.read(str(tmp_path))
+    assert config.server_base_urls == ["http://a:8080"]
+    assert config.replica_base_urls == ["http://b:8080", "http://c:8080"]
+
+
+def test_connection_options(tmp_path):
+    write_config(
+        tmp_path,
+        "[Server]\nBaseURL = http://localhost:8080\nPoolConnections = 2\nPoolMaxSize = 8\nKeepAlive = no\n"
+        "[Client]\nUserID = 42\n",
+    )
+    config = Configuration.read(str(tmp_path))
+    assert config.pool_connections == 2
+    assert config.pool_maxsize == 8
+    assert config.keep_alive is False
+
+
+def test_timeout_options(tmp_path):
+    write_config(
+        tmp_path,
+        "[Server]\nBaseURL = http://localhost:8080\nConnectTimeout = 2.5\nReadTimeout = 5\nRetries = 0\n"
+        "[Client]\nUserID = 42\n",
+    )
+    config = Configuration.read(str(tmp_path))
+    assert config.connect_timeout == 2.5
+    assert config.read_timeout == 5
+    assert config.retries == 0
+
+
+def test_shard_options(tmp_path):
+    write_config(
+        tmp_path,
+        "[Server]\nBaseURL = http://localhost:8080\nShardBy = year\nParallelRequests = 2\n[Client]\nUserID = 42\n",
+    )
+    config = Configuration.read(str(tmp_path))
+    assert config.shard_by == "year"
+    assert config.parallel_requests == 2
+
+
+def test_invalid_shard_option(tmp_path):
+    write_config(tmp_path, "[Server]\nBaseURL = http://localhost:8080\nShardBy = week\n[Client]\nUserID = 42\n")
+    with pytest.raises(InvalidConfigurationError) as e:
+        Configuration.read(str(tmp_path))
+    assert (e.value.name, e.value.value) == ("ShardBy", "week")
+
+
+def test_transport_option(tmp_path):
+    write_config(tmp_path, "[Server]\nBaseURL = http://localhost:8080\nTransport = requests\n[Client]\nUserID = 42\n")
+    assert Configuration.read(str(tmp_path)).transport == "requests"
+
+
+def test_invalid_transport_option(tmp_path):
+    write_config(tmp_path, "[Server]\nBaseURL = http://localhost:8080\nTransport = curl\n[Client]\nUserID = 42\n")
+    with pytest.raises(InvalidConfigurationError) as e:
+        Configuration.read(str(tmp_path))
+    assert (e.value.name, e.value.value) == ("Transport", "curl")
+
+
+def test_unix_socket_transport(tmp_path):
+    write_config(
+        tmp_path, "[Server]\nBaseURL = unix:///run/timewsync.sock\nTransport = requests\n[Client]\nUserID = 42\n"
+    )
+    with pytest.raises(InvalidConfigurationError) as e:
+        Configuration.read(str(tmp_path))
+    assert (e.value.name, e.value.value) == ("Transport", "requests")
@@ -0,0 +1,82 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+import threading
+import time
+
+import pytest
+
+from timewsync.deadline import Deadline, DeadlineExceededError, OperationCancelledError
+
+
+def test_unlimited():
+    deadline = Deadline()
+    assert deadline.remaining() is None
+    assert deadline.timeout(30) == 30
+    deadline.check()
+
+
+def test_timeout_limited_to_remaining():
+    deadline = Deadline(10)
+    assert deadline.timeout(5) == 5
+    assert 9 < deadline.timeout(60) <= 10
+
+
+def test_expired():
+    deadline = Deadline(0.01)
+    time.sleep(0.02)
+    assert deadline.remaining() == 0
+    with pytest.raises(DeadlineExceededError) as e:
+        deadline.check()
+    assert e.value.seconds == 0.01
+    with pytest.raises(DeadlineExceededError):
+        deadline.timeout(5)
+
+
+def test_sleep_beyond_deadline():
+    deadline = Deadline(10)
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceededError):
+        deadline.sleep(20)
+    assert time.monotonic() - start < 1
+
+
+def test_cancelled():
+    deadline = Deadline(10)
+    deadline.cancel()
+    assert deadline.cancelled
+    with pytest.raises(OperationCancelledError):
+        deadline.timeout(5)
+
+
+def test_sleep_interrupted_by_cancel():
+    deadline = Deadline()
+    threading.Timer(0.05, deadline.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(OperationCancelledError):
+        deadline.sleep(10)
+    assert time.monotonic() - start < 1
@@ -0,0 +1,109 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+from datetime import datetime
+
+from timewsync.digest import Divergence, MerkleTree, compare_trees, month_digests, state_digest
+from timewsync.interval import Interval
+
+JANUARY = Interval(start=datetime(2021, 1, 5, 10), end=datetime(2021, 1, 5, 11), tags=["foo"], annotation="")
+FEBRUARY = Interval(start=datetime(2021, 2, 5, 10), end=datetime(2021, 2, 5, 11), tags=["bar"], annotation="")
+
+
+class TestStateDigest:
+    def test_order_independent(self):
+        assert state_digest([JANUARY, FEBRUARY]) == state_digest([FEBRUARY, JANUARY])
+
+    def test_changes_with_content(self):
+        assert state_digest([JANUARY]) != state_digest([JANUARY, FEBRUARY])
+
+
+class TestMonthDigests:
+    def test_empty(self):
+        assert month_digests([]) == {}
+
+    def test_sorted_by_month(self):
+        digests = month_digests([FEBRUARY, JANUARY])
+        assert list(digests) == ["2021-01", "2021-02"]
+        assert all(len(digest) == 32 for digest in digests.values())
+
+    def test_only_changed_month_differs(self):
+        moved = Interval(start=datetime(2021, 2, 6, 10), end=datetime(2021, 2, 6, 11), tags=["bar"], annotation="")
+        before, after = month_digests([JANUARY, FEBRUARY]), month_digests([JANUARY, moved])
+        assert before["2021-01"] == after["2021-01"]
+        assert before["2021-02"] != after["2021-02"]
+
+
+class TestMerkleTree:
+    def test_buckets(self):
+        tree = MerkleTree([JANUARY, FEBRUARY])
+        assert list(tree.children([""])[""]) == ["2021"]
+        assert list(tree.children(["2021"])["2021"]) == ["2021-01", "2021-02"]
+        assert list(tree.children(["2021-01"])["2021-01"]) == ["2021-01-05"]
+        assert tree.children(["2021-01-05", "2022"]) == {"2021-01-05": {}, "2022": {}}
+
+    def test_order_independent(self):
+        assert MerkleTree([JANUARY, FEBRUARY]).root == MerkleTree([FEBRUARY, JANUARY]).root
+
+    def test_empty(self):
+        assert MerkleTree([]).root == state_digest([])
+
+
+class TestCompareTrees:
+    @staticmethod
+    def compare(local, remote):
+        requests = []
+
+        def children(buckets):
+            requests.append(buckets)
+            return remote.children(buckets)
+
+        return compare_trees(local, remote.root, children), requests
+
+    def test_equal(self):
+        divergences, requests = self.compare(MerkleTree([JANUARY]), MerkleTree([JANUARY]))
+        assert divergences == []
+        assert requests == []
+
+    def test_differing_day(self):
+        moved = Interval(start=datetime(2021, 2, 5, 12), end=datetime(2021, 2, 5, 13), tags=["bar"], annotation="")
+        local, remote = MerkleTree([JANUARY, FEBRUARY]), MerkleTree([JANUARY, moved])
+
+        divergences, requests = self.compare(local, remote)
+
+        assert [d.bucket for d in divergences] == ["2021-02-05"]
+        assert requests == [[""], ["2021"], ["2021-02"]]
+
+    def test_bucket_on_one_side(self):
+        later = Interval(start=datetime(2022, 3, 1, 10), end=datetime(2022, 3, 1, 11), tags=[], annotation="")
+        local, remote = MerkleTree([JANUARY, FEBRUARY]), MerkleTree([JANUARY, later])
+
+        divergences, _ = self.compare(local, remote)
+
+        assert divergences == [
+            Divergence("2021-02", local.children(["2021"])["2021"]["2021-02"], None),
+            Divergence("2022", None, remote.children([""])[""]["2022"]),
+        ]
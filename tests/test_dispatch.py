@@ -25,8 +25,43 @@
 ###############################################################################
 
 
-from timewsync.dispatch import generate_diff
+import gzip
+import io
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import timewsync.dispatch as dispatch_module
+from tests.intervals import make_intervals
+from tests.sync_server import Fault
+from timewsync.config import Configuration
+from timewsync.deadline import Deadline, DeadlineExceededError
+from timewsync.digest import MerkleTree, state_digest
+from timewsync.dispatch import (
+    Delta,
+    Dispatcher,
+    ServerError,
+    apply_diff,
+    as_delta,
+    dispatch,
+    generate_diff,
+    merge_deltas,
+    pair_modifications,
+)
 from timewsync.interval import Interval
+from timewsync.transport import FakeTransport, RequestTimeoutError, Response
+
+
+def make_days_apart(count):
+    start = datetime(2021, 1, 1)
+    return [
+        Interval(start=start + timedelta(days=10 * i), end=start + timedelta(days=10 * i, hours=1), annotation="")
+        for i in range(count)
+    ]
 
 
 class TestGenerateDiff:
@@ -60,3 +95,838 @@ class TestGenerateDiff:
             [added_interval],
             [removed_interval],
         )
+
+
+def retag(intervals):
+    return [Interval(i.start, i.end, i.tags + ["retagged"], i.annotation) for i in intervals]
+
+
+class TestPairModifications:
+    def test_same_start(self):
+        old = make_intervals(3)
+        new = retag(old)
+        assert pair_modifications(new, old) == ([], [], list(zip(old, new)))
+
+    def test_moved_start(self):
+        old = make_intervals(1)[0]
+        new = Interval(old.start - timedelta(minutes=5), old.end, old.tags, old.annotation)
+        assert pair_modifications([new], [old]) == ([], [], [(old, new)])
+
+    def test_unrelated(self):
+        added, removed = make_intervals(2)[:1], make_intervals(2)[1:]
+        assert pair_modifications(added, removed) == (added, removed, [])
+
+    def test_ambiguous_start(self):
+        old = make_intervals(1)[0]
+        new = [Interval(old.start, old.end, ["a"]), Interval(old.start, old.end, ["b"])]
+        assert pair_modifications(new, [old]) == (new, [old], [])
+
+
+class TestApplyDiff:
+    def test_apply_diff(self):
+        intervals = make_intervals(5)
+        assert apply_diff(intervals[:3], (intervals[3:], intervals[:1], [])) == intervals[1:]
+
+    def test_already_applied(self):
+        intervals = make_intervals(3)
+        assert apply_diff(intervals, (intervals[2:], [], [])) == intervals
+
+    def test_modified(self):
+        intervals = make_intervals(3)
+        new = retag(intervals[1:2])[0]
+        assert apply_diff(intervals, ([], [], [(intervals[1], new)])) == [intervals[0], intervals[2], new]
+
+    def test_slice_diff(self):
+        added, removed = make_intervals(4), make_intervals(3)
+        modified = list(zip(removed, added))[:2]
+        assert dispatch_module._slice_diff((added, removed, []), 0, 2) == ([], removed[:2], [])
+        assert dispatch_module._slice_diff((added, removed, []), 2, 2) == (added[:1], removed[2:], [])
+        assert dispatch_module._slice_diff((added, removed, []), 6, 2) == (added[3:], [], [])
+        assert dispatch_module._slice_diff((added, removed, modified), 2, 2) == ([], removed[2:], modified[:1])
+        assert dispatch_module._slice_diff((added, removed, modified), 4, 2) == (added[:1], [], modified[1:])
+
+
+class TestReconcile:
+    def test_as_delta(self):
+        intervals = make_intervals(4)
+        assert as_delta(None, intervals) == Delta([], [])
+        assert as_delta(Delta(intervals[:1], []), intervals) == Delta(intervals[:1], [])
+        assert as_delta(intervals[1:] + make_intervals(5)[4:], intervals) == Delta(make_intervals(5)[4:], intervals[:1])
+
+    def test_merge_deltas(self):
+        intervals = make_intervals(4)
+        merged = merge_deltas([Delta(intervals[:2], intervals[3:]), Delta(make_intervals(2)[1:], intervals[2:3])])
+        assert merged == Delta(intervals[:2], intervals[3:] + intervals[2:3])
+
+
+class TestDispatch:
+    def test_small_diff(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(3)
+
+        result, conflict_flag = dispatch(config, intervals, [], "token")
+
+        assert result == intervals
+        assert conflict_flag is False
+        assert [r[0] for r in sync_server.requests] == ["PUT"]
+        assert sync_server.requests[0][2]["Authorization"] == "Bearer token"
+        assert sync_server.requests[0][2]["Content-Type"] == "application/json"
+
+    def test_removed(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(3)
+        dispatch(config, intervals, [], "token")
+
+        result, _ = dispatch(config, intervals[1:], intervals, "token")
+
+        assert result == intervals[1:]
+
+    def test_path_prefix(self, sync_server):
+        sync_server.path_prefix = "/timewsync"
+        config = Configuration("", sync_server.base_url + "/timewsync", 1)
+
+        result, _ = dispatch(config, make_intervals(3), [], "token")
+
+        assert result == make_intervals(3)
+        assert [r.path for r in sync_server.requests] == ["/timewsync/api/sync"]
+
+    def test_server_error(self, sync_server):
+        config = Configuration("", sync_server.base_url + "/", 1)
+        sync_server.accept_put = []
+
+        with pytest.raises(ServerError) as e:
+            dispatch(config, make_intervals(1), [], "token")
+
+        assert e.value.status_code == 415
+        assert e.value.message == "Unsupported content type"
+        assert len(sync_server.requests) == 1
+
+    def test_large_diff_streamed(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "NEGOTIATION_THRESHOLD", 10)
+        monkeypatch.setattr(dispatch_module, "STREAMING_THRESHOLD", 10)
+        monkeypatch.setattr(dispatch_module, "REQUEST_CHUNK_SIZE", 256)
+        sync_server.accept_put = ["application/x-ndjson", "application/json"]
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(50)
+
+        result, _ = dispatch(config, intervals, [], "token")
+
+        assert result == intervals
+        assert [r[0] for r in sync_server.requests] == ["OPTIONS", "PUT"]
+        headers = sync_server.requests[1][2]
+        assert headers["Content-Type"] == "application/x-ndjson"
+        assert headers["Transfer-Encoding"] == "chunked"
+
+    def test_large_diff_not_supported(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "NEGOTIATION_THRESHOLD", 10)
+        monkeypatch.setattr(dispatch_module, "STREAMING_THRESHOLD", 10)
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(50)
+
+        result, _ = dispatch(config, intervals, [], "token")
+
+        assert result == intervals
+        assert [r[0] for r in sync_server.requests] == ["OPTIONS", "PUT"]
+        assert sync_server.requests[1][2]["Content-Type"] == "application/json"
+
+    def test_compressed_request(self, sync_server, monkeypatch, caplog):
+        monkeypatch.setattr(dispatch_module, "NEGOTIATION_THRESHOLD", 10)
+        sync_server.accept_encoding = ["gzip"]
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(50)
+
+        with caplog.at_level(logging.DEBUG, logger="timewsync.dispatch"):
+            result, _ = dispatch(config, intervals, [], "token")
+
+        assert result == intervals
+        headers, body = sync_server.requests[1].headers, sync_server.requests[1].body
+        assert headers["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.decompress(body))["userID"] == 1
+        assert len(body) * 5 < len(gzip.decompress(body))
+        assert "Compressed request body using gzip" in caplog.text
+
+    def test_compressed_stream(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "NEGOTIATION_THRESHOLD", 10)
+        monkeypatch.setattr(dispatch_module, "STREAMING_THRESHOLD", 10)
+        sync_server.accept_put = ["application/x-ndjson"]
+        sync_server.accept_encoding = ["deflate", "gzip"]
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(50)
+
+        result, _ = dispatch(config, intervals, [], "token")
+
+        assert result == intervals
+        headers = sync_server.requests[1][2]
+        assert headers["Content-Encoding"] == "gzip"
+        assert headers["Transfer-Encoding"] == "chunked"
+
+    def test_small_body_not_compressed(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "NEGOTIATION_THRESHOLD", 1)
+        sync_server.accept_encoding = ["gzip"]
+        config = Configuration("", sync_server.base_url, 1)
+
+        dispatch(config, make_intervals(1), [], "token")
+
+        assert "Content-Encoding" not in sync_server.requests[1][2]
+
+    def test_no_compression_without_negotiation(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1)
+
+        dispatch(config, make_intervals(50), [], "token")
+
+        assert "Content-Encoding" not in sync_server.requests[0][2]
+
+    def test_compressed_response(self, sync_server, caplog):
+        sync_server.compress_responses = True
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(50)
+
+        with caplog.at_level(logging.DEBUG, logger="timewsync.dispatch"):
+            result, _ = dispatch(config, intervals, [], "token")
+
+        assert result == intervals
+        assert "Received response body using gzip" in caplog.text
+
+    def test_msgpack(self, sync_server, monkeypatch):
+        pytest.importorskip("msgpack")
+        monkeypatch.setattr(dispatch_module, "NEGOTIATION_THRESHOLD", 10)
+        sync_server.accept_put = ["application/vnd.msgpack", "application/json"]
+        sync_server.conflicts = True
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(50)
+
+        result, conflict_flag = dispatch(config, intervals, [], "token")
+
+        assert result == intervals
+        assert conflict_flag is True
+        assert sync_server.requests[1][2]["Content-Type"] == "application/vnd.msgpack"
+
+    def test_msgpack_not_installed(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "NEGOTIATION_THRESHOLD", 10)
+        monkeypatch.setattr(dispatch_module.msgpack_converter, "msgpack", None)
+        sync_server.accept_put = ["application/vnd.msgpack", "application/json"]
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(50)
+
+        result, _ = dispatch(config, intervals, [], "token")
+
+        assert result == intervals
+        assert sync_server.requests[1][2]["Content-Type"] == "application/json"
+        assert sync_server.requests[1][2]["Accept"] == "application/json"
+
+
+class TestModified:
+    @pytest.fixture(autouse=True)
+    def negotiate(self, monkeypatch, sync_server):
+        monkeypatch.setattr(dispatch_module, "NEGOTIATION_THRESHOLD", 10)
+        sync_server.features = ["modified"]
+
+    def sync_retagged(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(50)
+        dispatch(config, intervals, [], "token")
+        retagged = retag(intervals)
+        result, _ = dispatch(config, retagged, intervals, "token")
+        assert result == retagged
+        return sync_server.requests[-1]
+
+    def test_json(self, sync_server):
+        request = self.sync_retagged(sync_server)
+        modified = json.loads(request.body)["modified"]
+        assert len(modified) == 50
+        assert modified[0] == {
+            "start": "20210101T000000Z",
+            "end": "20210101T003000Z",
+            "changes": {"tags": ["tag0", "retagged"]},
+        }
+
+    def test_streamed(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "STREAMING_THRESHOLD", 10)
+        sync_server.accept_put = ["application/x-ndjson"]
+        request = self.sync_retagged(sync_server)
+        assert request.headers["Content-Type"] == "application/x-ndjson"
+
+    def test_msgpack(self, sync_server):
+        pytest.importorskip("msgpack")
+        sync_server.accept_put = ["application/json", "application/vnd.msgpack"]
+        request = self.sync_retagged(sync_server)
+        assert request.headers["Content-Type"] == "application/vnd.msgpack"
+
+    def test_payload_halved(self, sync_server):
+        modified_size = len(self.sync_retagged(sync_server).body)
+        sync_server.features = []
+        sync_server.intervals = []
+        sync_server.requests.clear()
+        unpaired_size = len(self.sync_retagged(sync_server).body)
+        assert modified_size < unpaired_size * 0.6
+
+    def test_not_supported(self, sync_server):
+        sync_server.features = []
+        request = self.sync_retagged(sync_server)
+        assert "modified" not in json.loads(request.body)
+
+
+class TestDelta:
+    def test_delta(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(5)
+        other = make_intervals(6)[5:]
+        sync_server.intervals = [other[0].asdict()]
+
+        result, _ = dispatch(config, intervals, [], "token", accept_delta=True)
+
+        assert result == Delta(other, [])
+        assert sync_server.requests[0].headers["Sync-Base"] == state_digest([])
+
+    def test_delta_after_batches(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "FAST_RESPONSE_TIME", 0)
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(50)
+        sync_server.intervals = [i.asdict() for i in intervals[:20]]
+        sync_server.remember(sync_server.intervals)
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.batch_size = 10
+            result, _ = dispatcher.dispatch(intervals[5:], intervals[:20], "token", accept_delta=True)
+
+        assert result == Delta([], [])
+        assert ["Sync-Base" in r.headers for r in sync_server.requests] == [False, False, False, True]
+
+    def test_unknown_base(self, sync_server):
+        sync_server.response_types = ["application/vnd.timewsync.delta+json"]
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(5)
+
+        result, _ = dispatch(config, intervals, intervals[:2], "token", accept_delta=True)
+
+        assert result == intervals[2:]
+
+    def test_not_accepted(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(5)
+
+        result, _ = dispatch(config, intervals, [], "token")
+
+        assert result == intervals
+        assert "Sync-Base" not in sync_server.requests[0].headers
+
+
+class TestMonths:
+    @pytest.fixture(autouse=True)
+    def months_only(self, sync_server):
+        sync_server.response_types = ["application/vnd.timewsync.months+json"]
+
+    def test_divergent_month(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_days_apart(10)
+        sync_server.intervals = [i.asdict() for i in intervals]
+        del sync_server.intervals[4]
+
+        result, _ = dispatch(config, intervals[1:], intervals, "token", accept_delta=True)
+
+        assert result == Delta([], [intervals[4]])
+        request = json.loads(sync_server.requests[0].body)
+        assert list(request["monthDigests"]) == ["2021-01", "2021-02", "2021-03", "2021-04"]
+
+    def test_month_only_on_server(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_days_apart(10)
+        sync_server.intervals = [i.asdict() for i in intervals]
+
+        result, _ = dispatch(config, intervals[:9], intervals[:9], "token", accept_delta=True)
+
+        assert result == Delta(intervals[9:], [])
+
+    def test_month_digests_streamed(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "NEGOTIATION_THRESHOLD", 10)
+        monkeypatch.setattr(dispatch_module, "STREAMING_THRESHOLD", 10)
+        sync_server.accept_put = ["application/x-ndjson"]
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_days_apart(20)
+
+        result, _ = dispatch(config, intervals, [], "token", accept_delta=True)
+
+        assert result == Delta([], [])
+        header = json.loads(sync_server.requests[1].body.split(b"\n")[0])
+        assert len(header["monthDigests"]) == 7
+
+    def test_no_intervals(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1)
+        sync_server.intervals = [i.asdict() for i in make_days_apart(3)]
+
+        result, _ = dispatch(config, [], [], "token", accept_delta=True)
+
+        assert result == make_days_apart(3)
+        assert "monthDigests" not in json.loads(sync_server.requests[0].body)
+
+
+class TestConditional:
+    def test_not_modified(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(5)
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.dispatch(intervals, [], "token")
+            etag = dispatcher.etag
+            result = dispatcher.dispatch(intervals, intervals, "token", etag=etag)
+
+        assert result == (None, False)
+        assert dispatcher.etag == etag
+        assert sync_server.requests[1].headers["If-None-Match"] == etag
+
+    def test_modified_on_server(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(5)
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.dispatch(intervals[:4], [], "token")
+            etag = dispatcher.etag
+            sync_server.apply([intervals[4].asdict()], [])
+            result, _ = dispatcher.dispatch(intervals[:4], intervals[:4], "token", etag=etag)
+
+        assert result == intervals
+        assert dispatcher.etag not in (None, etag)
+
+    def test_unconditional_with_changes(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(5)
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.dispatch(intervals[:4], [], "token")
+            result, _ = dispatcher.dispatch(intervals, intervals[:4], "token", etag=dispatcher.etag)
+
+        assert result == intervals
+        assert "If-None-Match" not in sync_server.requests[1].headers
+
+    def test_not_modified_without_digests(self, sync_server, monkeypatch):
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_days_apart(5)
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.dispatch(intervals, [], "token", accept_delta=True)
+            etag = dispatcher.etag
+            monkeypatch.setattr(dispatch_module, "month_digests", None)
+            monkeypatch.setattr(dispatch_module, "state_digest", None)
+            result = dispatcher.dispatch(intervals, intervals, "token", accept_delta=True, etag=etag)
+
+        assert result == (None, False)
+        assert "Sync-Base" not in sync_server.requests[1].headers
+        assert json.loads(sync_server.requests[1].body) == {"userID": 1, "added": [], "removed": []}
+
+    def test_modified_on_server_with_digests(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_days_apart(5)
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.dispatch(intervals[:4], [], "token", accept_delta=True)
+            etag = dispatcher.etag
+            sync_server.apply([intervals[4].asdict()], [])
+            result, _ = dispatcher.dispatch(intervals[:4], intervals[:4], "token", accept_delta=True, etag=etag)
+
+        assert result == Delta([intervals[4]], [])
+        assert [r.headers.get("If-None-Match") for r in sync_server.requests[1:]] == [etag, None]
+        assert "Sync-Base" in sync_server.requests[2].headers
+        assert "monthDigests" in json.loads(sync_server.requests[2].body)
+
+
+class TestDispatcher:
+    def test_reuses_connection(self, sync_server, caplog):
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(3)
+
+        with caplog.at_level(logging.DEBUG, logger="timewsync.dispatch"):
+            with Dispatcher(config) as dispatcher:
+                dispatcher.dispatch(intervals, [], "token")
+                result, _ = dispatcher.dispatch(intervals[1:], intervals, "token")
+
+        assert result == intervals[1:]
+        assert len({r.client_port for r in sync_server.requests}) == 1
+        assert "(request 2 of this session): status 200 after" in caplog.text
+
+    def test_without_keep_alive(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1, keep_alive=False)
+        intervals = make_intervals(3)
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.dispatch(intervals, [], "token")
+            dispatcher.dispatch(intervals, [], "token")
+
+        assert len({r.client_port for r in sync_server.requests}) == 2
+
+    def test_connect_ahead(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1)
+
+        with Dispatcher(config) as dispatcher:
+            assert dispatcher.connect()
+            result, _ = dispatcher.dispatch(make_intervals(3), [], "token")
+
+        assert result == make_intervals(3)
+
+    def test_connect_failed(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1, retries=0)
+        sync_server.stop()
+
+        with Dispatcher(config) as dispatcher:
+            assert not dispatcher.connect()
+
+    def test_capabilities_probed_once(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "NEGOTIATION_THRESHOLD", 10)
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(50)
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.dispatch(intervals, [], "token")
+            dispatcher.dispatch([], intervals, "token")
+
+        assert [r.method for r in sync_server.requests] == ["OPTIONS", "PUT", "PUT"]
+
+
+class TestTransports:
+    @pytest.mark.parametrize("name", ["http.client", "requests", "fake"])
+    def test_streamed_compressed_sync(self, name, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "NEGOTIATION_THRESHOLD", 10)
+        monkeypatch.setattr(dispatch_module, "STREAMING_THRESHOLD", 10)
+        sync_server.accept_put = ["application/x-ndjson"]
+        sync_server.accept_encoding = ["gzip"]
+        sync_server.compress_responses = True
+        config = Configuration("", sync_server.base_url, 1, transport=None if name == "fake" else name)
+        transport = FakeTransport(sync_server.handle) if name == "fake" else None
+        intervals = make_intervals(50)
+
+        with Dispatcher(config, transport) as dispatcher:
+            result, _ = dispatcher.dispatch(intervals, [], "token")
+
+        assert dispatcher.transport.name == name
+        assert result == intervals
+        assert sync_server.requests[1].headers["Content-Encoding"] == "gzip"
+
+
+class TestUnixSocket:
+    def test_sync(self, unix_sync_server):
+        config = Configuration("", unix_sync_server.base_url, 1)
+        intervals = make_intervals(3)
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.dispatch(intervals, [], "token")
+            result, _ = dispatcher.dispatch(intervals[1:], intervals, "token")
+
+        assert result == intervals[1:]
+        assert [r.path for r in unix_sync_server.requests] == ["/api/sync", "/api/sync"]
+        assert len({r.client_port for r in unix_sync_server.requests}) == 1
+
+    def test_unix_url(self, unix_sync_server):
+        config = Configuration("", f"unix://{unix_sync_server.unix_socket}", 1)
+
+        result, _ = dispatch(config, make_intervals(3), [], "token")
+
+        assert result == make_intervals(3)
+
+    def test_path_prefix(self, unix_sync_server):
+        unix_sync_server.path_prefix = "/relay"
+        config = Configuration("", unix_sync_server.base_url + "/relay", 1)
+
+        result, _ = dispatch(config, make_intervals(3), [], "token")
+
+        assert result == make_intervals(3)
+        assert [r.path for r in unix_sync_server.requests] == ["/relay/api/sync"]
+
+
+class TestTreeDigests:
+    def test_matches_local_tree(self, sync_server):
+        intervals = make_days_apart(5)
+        sync_server.intervals = [i.asdict() for i in intervals]
+        tree = MerkleTree(intervals)
+
+        with Dispatcher(Configuration("", sync_server.base_url, 1)) as dispatcher:
+            root, buckets = dispatcher.tree_digests(["", "2021-01"], "token")
+
+        assert root == tree.root
+        assert buckets == tree.children(["", "2021-01"])
+        assert sync_server.requests[0].path == "/api/verify"
+        assert sync_server.requests[0].headers["Authorization"] == "Bearer token"
+
+    def test_retried(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "BACKOFF_BASE", 0)
+        sync_server.latency = 0.3
+        config = Configuration("", sync_server.base_url, 1, read_timeout=0.1, retries=1)
+
+        with pytest.raises(RequestTimeoutError):
+            with Dispatcher(config) as dispatcher:
+                dispatcher.tree_digests([], "token")
+
+        assert len(sync_server.requests) == 2
+
+    def test_error(self, sync_server):
+        sync_server.inject(Fault(status=501))
+        config = Configuration("", sync_server.base_url, 1)
+
+        with pytest.raises(ServerError) as e:
+            with Dispatcher(config) as dispatcher:
+                dispatcher.tree_digests([], "token")
+
+        assert e.value.status_code == 501
+
+
+class TestBatches:
+    @pytest.fixture(autouse=True)
+    def small_batches(self, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "BACKOFF_BASE", 0.01)
+        monkeypatch.setattr(dispatch_module, "MIN_BATCH_SIZE", 5)
+
+    def test_batches(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "FAST_RESPONSE_TIME", 0)
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(50)
+        batches = []
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.batch_size = 10
+            result, _ = dispatcher.dispatch(intervals, [], "token", on_batch=batches.append)
+
+        assert result == intervals
+        assert len(sync_server.requests) == 5
+        assert [len(added) for added, _, _ in batches] == [10, 10, 10, 10]
+        assert len({r.headers["Idempotency-Key"] for r in sync_server.requests}) == 5
+
+    def test_intermediate_responses_minimal(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "FAST_RESPONSE_TIME", 0)
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(25)
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.batch_size = 10
+            result, _ = dispatcher.dispatch(intervals, [], "token")
+
+        assert result == intervals
+        assert [r.headers.get("Prefer") for r in sync_server.requests] == ["return=minimal"] * 2 + [None]
+
+    def test_intermediate_responses_not_decoded(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "FAST_RESPONSE_TIME", 0)
+        sync_server.minimal_responses = False
+        sync_server.conflicts = True
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(25)
+        decoded = []
+        from_dict = Interval.from_dict
+
+        def count_client_decoding(**kwargs):
+            # The stand-in server decodes intervals as well, in its own threads
+            if threading.current_thread() is threading.main_thread():
+                decoded.append(kwargs)
+            return from_dict(**kwargs)
+
+        monkeypatch.setattr(Interval, "from_dict", count_client_decoding)
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.batch_size = 10
+            result, conflict_flag = dispatcher.dispatch(intervals, [], "token")
+
+        assert result == intervals
+        assert conflict_flag is True
+        assert len(decoded) == 25
+
+    def test_batch_size_grows(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(50)
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.batch_size = 10
+            result, _ = dispatcher.dispatch(intervals, [], "token")
+
+        assert result == intervals
+        assert len(sync_server.requests) == 3
+        assert dispatcher.batch_size == 40
+
+    def test_request_too_large(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "FAST_RESPONSE_TIME", 0)
+        sync_server.max_request_intervals = 12
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(50)
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.batch_size = 50
+            result, _ = dispatcher.dispatch(intervals, [], "token")
+
+        assert result == intervals
+        assert dispatcher.batch_size == 12
+        assert len(sync_server.applied_keys) == 5
+
+    def test_request_too_large_at_minimum(self, sync_server):
+        sync_server.max_request_intervals = 2
+        config = Configuration("", sync_server.base_url, 1)
+
+        with pytest.raises(ServerError) as e:
+            dispatch(config, make_intervals(10), [], "token")
+
+        assert e.value.status_code == 413
+
+    def test_timeout_shrinks_batch(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "FAST_RESPONSE_TIME", 0)
+        # The timed out request is still applied once the delay passed
+        sync_server.inject(Fault(delay=0.5))
+        config = Configuration("", sync_server.base_url, 1, read_timeout=0.2)
+        intervals = make_intervals(30)
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.batch_size = 20
+            result, _ = dispatcher.dispatch(intervals, [], "token")
+        time.sleep(0.5)
+
+        assert result == intervals
+        assert dispatcher.batch_size == 10
+        keys = [r.headers["Idempotency-Key"] for r in sync_server.requests]
+        assert keys[0] == keys[1] != keys[2]
+        assert [len(json.loads(r.body)["added"]) for r in sync_server.requests] == [20, 20, 10]
+        assert len(sync_server.applied_keys) == 2
+        assert len(sync_server.intervals) == 30
+
+    def test_resume(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "FAST_RESPONSE_TIME", 0)
+        sync_server.inject(Fault(), Fault(), Fault(status=400))
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(50)
+        snapshot = []
+
+        def on_batch(batch):
+            nonlocal snapshot
+            snapshot = apply_diff(snapshot, batch)
+
+        with Dispatcher(config) as dispatcher:
+            dispatcher.batch_size = 10
+            with pytest.raises(ServerError):
+                dispatcher.dispatch(intervals, snapshot, "token", on_batch=on_batch)
+            assert snapshot == intervals[:20]
+
+            result, _ = dispatcher.dispatch(intervals, snapshot, "token", on_batch=on_batch)
+
+        assert result == intervals
+        assert len(sync_server.requests) == 6
+
+
+class TestShards:
+    def test_shard_by_month(self, sync_server):
+        server_interval = Interval(
+            start=datetime(2020, 6, 1), end=datetime(2020, 6, 1, 1), tags=["server"], annotation=""
+        )
+        sync_server.intervals = [server_interval.asdict()]
+        config = Configuration("", sync_server.base_url, 1, shard_by="month")
+        intervals = make_days_apart(10)
+        batches = []
+
+        result, conflict_flag = dispatch(config, intervals, [], "token", on_batch=batches.append)
+
+        assert result == [server_interval] + intervals
+        assert not conflict_flag
+        assert len(sync_server.requests) == 4
+        assert sorted(len(added) for added, _, _ in batches) == [1, 2, 3, 4]
+
+    def test_shard_by_year(self, sync_server):
+        config = Configuration("", sync_server.base_url, 1, shard_by="year")
+        intervals = make_days_apart(40)
+
+        result, _ = dispatch(config, intervals, intervals[:5], "token")
+
+        assert result == intervals[5:]
+        assert [r.method for r in sync_server.requests] == ["PUT", "PUT"]
+
+    def test_shard_fails(self, sync_server):
+        sync_server.inject(Fault(), Fault(status=400))
+        config = Configuration("", sync_server.base_url, 1, shard_by="month", parallel_requests=1)
+
+        with pytest.raises(ServerError):
+            dispatch(config, make_days_apart(10), [], "token")
+
+
+class TestRetries:
+    @pytest.fixture(autouse=True)
+    def fast_backoff(self, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "BACKOFF_BASE", 0.01)
+
+    def test_retry_temporary_error(self, sync_server):
+        sync_server.inject(Fault(status=503, retry_after="0"), Fault(status=502))
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(3)
+
+        result, _ = dispatch(config, intervals, [], "token")
+
+        assert result == intervals
+        assert len(sync_server.requests) == 3
+        assert len({r.headers["Idempotency-Key"] for r in sync_server.requests}) == 1
+
+    def test_retry_dropped_connection(self, sync_server):
+        sync_server.inject(Fault(drop=True), Fault(drop_after_apply=True))
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(3)
+
+        result, _ = dispatch(config, intervals, [], "token")
+
+        assert result == intervals
+        assert len(sync_server.requests) == 3
+        assert len(sync_server.applied_keys) == 1
+
+    def test_retry_streamed_body(self, sync_server, monkeypatch):
+        monkeypatch.setattr(dispatch_module, "NEGOTIATION_THRESHOLD", 10)
+        monkeypatch.setattr(dispatch_module, "STREAMING_THRESHOLD", 10)
+        sync_server.accept_put = ["application/x-ndjson"]
+        sync_server.inject(Fault(status=503))
+        config = Configuration("", sync_server.base_url, 1)
+        intervals = make_intervals(50)
+
+        result, _ = dispatch(config, intervals, [], "token")
+
+        assert result == intervals
+        assert sync_server.requests[1].body == sync_server.requests[2].body
+
+    def test_give_up(self, sync_server):
+        sync_server.inject(*[Fault(status=503)] * 3)
+        config = Configuration("", sync_server.base_url, 1, retries=2)
+
+        with pytest.raises(ServerError) as e:
+            dispatch(config, make_intervals(3), [], "token")
+
+        assert e.value.status_code == 503
+        assert e.value.message == "Service Unavailable"
+        assert len(sync_server.requests) == 3
+
+    def test_no_retry_client_error(self, sync_server):
+        sync_server.inject(Fault(status=400))
+        config = Configuration("", sync_server.base_url, 1)
+
+        with pytest.raises(ServerError):
+            dispatch(config, make_intervals(3), [], "token")
+
+        assert len(sync_server.requests) == 1
+
+    def test_read_timeout(self, sync_server):
+        sync_server.inject(Fault(delay=0.5))
+        config = Configuration("", sync_server.base_url, 1, read_timeout=0.1, retries=0)
+
+        with pytest.raises(RequestTimeoutError):
+            dispatch(config, make_intervals(3), [], "token")
+
+    def test_deadline_retry_after(self, sync_server):
+        sync_server.inject(Fault(status=503, retry_after="60"))
+        config = Configuration("", sync_server.base_url, 1)
+
+        with pytest.raises(DeadlineExceededError):
+            dispatch(config, make_intervals(3), [], "token", Deadline(5))
+
+        assert len(sync_server.requests) == 1
+
+    def test_deadline_slow_server(self, sync_server):
+        sync_server.inject(Fault(delay=1))
+        config = Configuration("", sync_server.base_url, 1)
+        start = time.monotonic()
+
+        with pytest.raises(DeadlineExceededError):
+            dispatch(config, make_intervals(3), [], "token", Deadline(0.3))
+
+        assert time.monotonic() - start < 0.9
+
+    def test_retry_after_date(self):
+        def response(retry_after):
+            return Response(503, "Service Unavailable", {"Retry-After": retry_after}, io.BytesIO().read, 0)
+
+        assert dispatch_module._parse_retry_after(response("Wed, 21 Oct 2015 07:28:00 GMT")) == 0
+        assert dispatch_module._parse_retry_after(response("120")) == 120
+        assert dispatch_module._parse_retry_after(response("soon")) is None
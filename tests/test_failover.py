@@ -0,0 +1,240 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+import json
+
+import pytest
+
+from tests.intervals import make_intervals
+from tests.sync_server import Fault, SyncServer
+from timewsync.config import Configuration
+from timewsync.digest import MerkleTree
+from timewsync.dispatch import ServerError
+from timewsync.failover import (
+    HEALTH_RETRY_AFTER,
+    HEALTH_RETRY_MAX,
+    EndpointRecord,
+    FailoverDispatcher,
+    order_endpoints,
+)
+from timewsync.io_handler import read_endpoints, write_endpoints
+from timewsync.transport import ConnectionFailedError
+
+
+@pytest.fixture
+def servers():
+    servers = [SyncServer().start() for _ in range(3)]
+    yield servers
+    for server in servers:
+        server.stop()
+
+
+def make_config(tmp_path, servers, retries=3):
+    return Configuration(str(tmp_path), [server.base_url for server in servers], 1, retries=retries)
+
+
+def served(servers):
+    return [len(server.requests) for server in servers]
+
+
+class TestEndpointRecord:
+    def test_unhealthy_after_failure(self):
+        record = EndpointRecord()
+        assert record.healthy(1000.0)
+
+        record.record_failure(1000.0)
+
+        assert not record.healthy(1000.0 + HEALTH_RETRY_AFTER - 1)
+        assert record.healthy(1000.0 + HEALTH_RETRY_AFTER)
+
+    def test_backoff_grows_with_failures(self):
+        record = EndpointRecord()
+        for _ in range(3):
+            record.record_failure(1000.0)
+
+        assert not record.healthy(1000.0 + 3 * HEALTH_RETRY_AFTER)
+        assert record.healthy(1000.0 + 4 * HEALTH_RETRY_AFTER)
+
+        for _ in range(20):
+            record.record_failure(1000.0)
+        assert record.healthy(1000.0 + HEALTH_RETRY_MAX)
+
+    def test_success_resets_failures(self):
+        record = EndpointRecord()
+        record.record_failure(1000.0)
+
+        record.record_success(0.1)
+
+        assert record.healthy(1000.0)
+        assert record.failures == 0
+
+    def test_latency_moving_average(self):
+        record = EndpointRecord()
+
+        record.record_success(0.1)
+        assert record.latency == 0.1
+
+        record.record_success(1.1)
+        assert record.latency == pytest.approx(0.4)
+
+    def test_round_trip(self):
+        record = EndpointRecord(0.25, 2, 1000.0)
+
+        restored = EndpointRecord.from_dict(json.loads(json.dumps(record.to_dict())))
+
+        assert (restored.latency, restored.failures, restored.failed_at) == (0.25, 2, 1000.0)
+
+
+class TestOrderEndpoints:
+    def test_configured_order_without_records(self):
+        assert order_endpoints(["a", "b", "c"], {}, 1000.0) == ["a", "b", "c"]
+
+    def test_fastest_first(self):
+        records = {"a": EndpointRecord(0.3), "b": EndpointRecord(0.1), "c": EndpointRecord(0.2)}
+
+        assert order_endpoints(["a", "b", "c"], records, 1000.0) == ["b", "c", "a"]
+
+    def test_unmeasured_before_measured(self):
+        records = {"a": EndpointRecord(0.3), "b": EndpointRecord(0.1)}
+
+        assert order_endpoints(["a", "b", "c"], records, 1000.0) == ["c", "b", "a"]
+
+    def test_failed_last(self):
+        records = {"a": EndpointRecord(0.1, 1, 990.0), "b": EndpointRecord(0.3)}
+
+        assert order_endpoints(["a", "b"], records, 1000.0) == ["b", "a"]
+        assert order_endpoints(["a", "b"], records, 990.0 + HEALTH_RETRY_AFTER) == ["a", "b"]
+
+
+class TestFailoverDispatcher:
+    def test_fastest_server_chosen(self, tmp_path, servers):
+        servers[0].latency = 0.2
+        servers[1].latency = 0.1
+        config = make_config(tmp_path, servers)
+
+        # Every server is measured once, unmeasured servers going first
+        for _ in range(3):
+            with FailoverDispatcher(config) as dispatcher:
+                dispatcher.dispatch(make_intervals(3), [], "token")
+        assert served(servers) == [1, 1, 1]
+
+        with FailoverDispatcher(config) as dispatcher:
+            result, _ = dispatcher.dispatch(make_intervals(3), [], "token")
+
+        assert result == make_intervals(3)
+        assert served(servers) == [1, 1, 2]
+        records = read_endpoints(str(tmp_path))
+        assert records[servers[0].base_url]["latency"] > records[servers[1].base_url]["latency"]
+        assert records[servers[1].base_url]["latency"] > records[servers[2].base_url]["latency"]
+
+    def test_fails_over_to_next_server(self, tmp_path, servers):
+        servers[0].stop()
+        config = make_config(tmp_path, servers)
+
+        with FailoverDispatcher(config) as dispatcher:
+            result, _ = dispatcher.dispatch(make_intervals(3), [], "token")
+
+        assert result == make_intervals(3)
+        assert served(servers) == [0, 1, 0]
+        records = read_endpoints(str(tmp_path))
+        assert records[servers[0].base_url]["failures"] == 1
+        assert records[servers[1].base_url]["failures"] == 0
+
+    def test_failed_server_skipped(self, tmp_path, servers):
+        config = make_config(tmp_path, servers)
+        write_endpoints(str(tmp_path), {servers[0].base_url: EndpointRecord(0.001, 1, 4102444800.0).to_dict()})
+
+        with FailoverDispatcher(config) as dispatcher:
+            dispatcher.dispatch(make_intervals(3), [], "token")
+
+        assert served(servers) == [0, 1, 0]
+
+    def test_failed_connection_ahead(self, tmp_path, servers):
+        servers[0].stop()
+        config = make_config(tmp_path, servers)
+
+        with FailoverDispatcher(config) as dispatcher:
+            assert not dispatcher.connect()
+            dispatcher.dispatch(make_intervals(3), [], "token")
+
+        assert served(servers) == [0, 1, 0]
+        assert read_endpoints(str(tmp_path))[servers[0].base_url]["failures"] == 1
+
+    def test_fails_over_on_temporary_error(self, tmp_path, servers):
+        servers[0].faults = [Fault(status=503)]
+        config = make_config(tmp_path, servers)
+
+        with FailoverDispatcher(config) as dispatcher:
+            result, _ = dispatcher.dispatch(make_intervals(3), [], "token")
+
+        assert result == make_intervals(3)
+        assert served(servers) == [1, 1, 0]
+
+    def test_client_error_not_failed_over(self, tmp_path, servers):
+        servers[0].faults = [Fault(status=400)]
+        config = make_config(tmp_path, servers)
+
+        with pytest.raises(ServerError):
+            with FailoverDispatcher(config) as dispatcher:
+                dispatcher.dispatch(make_intervals(3), [], "token")
+
+        assert served(servers) == [1, 0, 0]
+
+    def test_all_servers_failed(self, tmp_path, servers):
+        for server in servers:
+            server.stop()
+        config = make_config(tmp_path, servers, retries=1)
+
+        with pytest.raises(ConnectionFailedError):
+            with FailoverDispatcher(config) as dispatcher:
+                dispatcher.dispatch(make_intervals(3), [], "token")
+
+        records = read_endpoints(str(tmp_path))
+        assert [records[server.base_url]["failures"] for server in servers] == [2, 2, 2]
+
+    def test_single_server_keeps_no_records(self, tmp_path, sync_server):
+        config = Configuration(str(tmp_path), sync_server.base_url, 1)
+
+        with FailoverDispatcher(config) as dispatcher:
+            result, _ = dispatcher.dispatch(make_intervals(3), [], "token")
+
+        assert result == make_intervals(3)
+        assert not (tmp_path / "endpoints.json").exists()
+
+    def test_tree_digests_from_one_server(self, tmp_path, servers):
+        intervals = make_intervals(3)
+        for server in servers:
+            server.intervals = [i.asdict() for i in intervals]
+        servers[0].stop()
+        config = make_config(tmp_path, servers)
+
+        with FailoverDispatcher(config) as dispatcher:
+            root, _ = dispatcher.tree_digests([], "token")
+            _, buckets = dispatcher.tree_digests(["2021"], "token")
+
+        assert root == MerkleTree(intervals).root
+        assert buckets == MerkleTree(intervals).children(["2021"])
+        assert served(servers) == [0, 2, 0]
@@ -29,7 +29,14 @@ from datetime import datetime
 
 import pytest
 
-from timewsync.interval import Interval, _strip_double_quotes, _quote_tag_if_needed
+from timewsync.interval import (
+    DATETIME_FORMAT,
+    Interval,
+    format_datetime,
+    parse_datetime,
+    _strip_double_quotes,
+    _quote_tag_if_needed,
+)
 
 
 class TestIntervalFromDict:
@@ -272,6 +279,28 @@ class TestAsInterval:
             Interval.from_interval_str("inc 1")
 
 
+class TestDatetime:
+    def test_parse(self):
+        assert parse_datetime("20210124T020043Z") == datetime(2021, 1, 24, 2, 0, 43)
+        assert parse_datetime("00011231T235959Z") == datetime.strptime("00011231T235959Z", DATETIME_FORMAT)
+
+    def test_parse_invalid(self):
+        for string in [
+            "",
+            "20210124T020043",
+            "20210124 020043Z",
+            "2021-1-24T02043Z",
+            "20211324T020043Z",
+            "202101２4T020043Z",
+        ]:
+            with pytest.raises(ValueError):
+                parse_datetime(string)
+
+    def test_format(self):
+        for date in [datetime(2021, 1, 24, 2, 0, 43), datetime(1999, 12, 31, 23, 59, 59, 999)]:
+            assert format_datetime(date) == date.strftime(DATETIME_FORMAT)
+
+
 class TestStripDoubleQuotes:
     def test_empty_string(self):
         assert _strip_double_quotes("") == ""
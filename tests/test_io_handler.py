@@ -0,0 +1,130 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+import os
+import stat
+
+import pytest
+
+from timewsync.io_handler import (
+    copy_snapshot,
+    delete_snapshot,
+    read_endpoints,
+    read_etag,
+    read_snapshot,
+    read_token,
+    write_endpoints,
+    write_etag,
+    write_snapshot,
+    write_token,
+)
+
+
+class TestWriteSnapshot:
+    def test_round_trip(self, tmp_path):
+        monthly_data = {
+            "2021-01.data": "inc 20210101T100000Z - 20210101T110000Z # foo\n",
+            "2021-02.data": 'inc 20210201T100000Z - 20210201T110000Z # bär # "annotation"\n',
+        }
+
+        write_snapshot(str(tmp_path), monthly_data)
+
+        assert read_snapshot(str(tmp_path)) == monthly_data
+
+    def test_replaces_snapshot(self, tmp_path):
+        write_snapshot(str(tmp_path), {"2021-01.data": "inc 20210101T100000Z - 20210101T110000Z\n"})
+        write_snapshot(str(tmp_path), {})
+
+        assert read_snapshot(str(tmp_path)) == {}
+        assert os.listdir(tmp_path) == ["snapshot.tgz"]
+
+
+class TestCopySnapshot:
+    def test_copy(self, tmp_path):
+        monthly_data = {"2021-01.data": "inc 20210101T100000Z - 20210101T110000Z # foo\n"}
+        write_snapshot(str(tmp_path / "source"), monthly_data)
+        write_snapshot(str(tmp_path / "target"), {})
+        write_etag(str(tmp_path / "target"), '"v1"')
+
+        copy_snapshot(str(tmp_path / "source"), str(tmp_path / "target"))
+
+        assert read_snapshot(str(tmp_path / "target")) == monthly_data
+        assert read_etag(str(tmp_path / "target")) is None
+        assert os.listdir(tmp_path / "target") == ["snapshot.tgz"]
+
+    def test_missing_source(self, tmp_path):
+        write_snapshot(str(tmp_path / "target"), {"2021-01.data": "inc 20210101T100000Z - 20210101T110000Z\n"})
+
+        copy_snapshot(str(tmp_path / "source"), str(tmp_path / "target"))
+
+        assert read_snapshot(str(tmp_path / "target")) == {}
+
+
+class TestEndpoints:
+    def test_round_trip(self, tmp_path):
+        assert read_endpoints(str(tmp_path)) == {}
+        records = {"http://a:8080": {"latency": 0.1, "failures": 0, "failedAt": None}}
+        write_endpoints(str(tmp_path), records)
+        assert read_endpoints(str(tmp_path)) == records
+
+    def test_unreadable_ignored(self, tmp_path):
+        (tmp_path / "endpoints.json").write_text("{broken")
+        assert read_endpoints(str(tmp_path)) == {}
+
+
+class TestToken:
+    def test_round_trip(self, tmp_path):
+        assert read_token(str(tmp_path)) == (None, None)
+        write_token(str(tmp_path), "token", "digest")
+        assert read_token(str(tmp_path)) == ("token", "digest")
+        write_token(str(tmp_path), None)
+        assert read_token(str(tmp_path)) == (None, None)
+
+    @pytest.mark.skipif(os.name != "posix", reason="POSIX file permissions")
+    def test_only_readable_by_owner(self, tmp_path):
+        (tmp_path / "token.json").write_text("")
+        os.chmod(tmp_path / "token.json", 0o644)
+        write_token(str(tmp_path), "token", "digest")
+        assert stat.S_IMODE(os.stat(tmp_path / "token.json").st_mode) == 0o600
+
+
+class TestETag:
+    def test_round_trip(self, tmp_path):
+        assert read_etag(str(tmp_path)) is None
+        write_etag(str(tmp_path), '"abc"')
+        assert read_etag(str(tmp_path)) == '"abc"'
+        write_etag(str(tmp_path), None)
+        assert read_etag(str(tmp_path)) is None
+
+    def test_removed_with_snapshot(self, tmp_path):
+        write_etag(str(tmp_path), '"abc"')
+        write_snapshot(str(tmp_path), {})
+        assert read_etag(str(tmp_path)) is None
+
+        write_etag(str(tmp_path), '"abc"')
+        delete_snapshot(str(tmp_path))
+        assert read_etag(str(tmp_path)) is None
@@ -27,10 +27,57 @@
 
 import json
 
+import pytest
+
+from timewsync import json_converter
 from timewsync.interval import Interval
-from timewsync.json_converter import to_json_request, from_json_response, to_json_tags, from_json_error_response
+from timewsync.json_converter import (
+    to_json_request,
+    from_json_response,
+    to_json_tags,
+    from_json_error_response,
+    from_json_months_response,
+    from_json_verify_response,
+    ResponseParser,
+    iter_ndjson_request,
+    loads,
+    to_json_interval,
+    to_json_modification,
+    to_json_verify_request,
+)
+
+
+@pytest.fixture
+def stdlib_backend(monkeypatch):
+    monkeypatch.setattr(json_converter, "orjson", None)
+
 
+@pytest.fixture(params=["default", "json"])
+def backend(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(json_converter, "orjson", None)
+    return request.param
+
+
+class TestToJSONInterval:
+    def test_same_as_json_dumps(self):
+        test_intervals = [
+            Interval(),
+            Interval.from_dict("20210124T020043Z", "20210124T080130Z", ["foo", 'b"ar', "\\", "ü€"], 'ann\n"otation"'),
+            Interval.from_dict("20210124T020043Z", tags=[], annotation=None),
+        ]
+        for interval in test_intervals:
+            assert to_json_interval(interval) == json.dumps(interval.asdict())
 
+
+class TestLoads:
+    def test_backends(self, backend):
+        assert loads('{"a": [1, "ü", null]}') == {"a": [1, "ü", None]}
+        with pytest.raises(ValueError):
+            loads('{"a": ')
+
+
+@pytest.mark.usefixtures("stdlib_backend")
 class TestToJSONRequest:
     def test_empty_diff(self):
         expt_json = '{"userID": 1, "added": [], "removed": []}'
@@ -150,6 +197,84 @@ class TestToJSONRequest:
         assert result == expt_json
 
 
+class TestNDJSONRequest:
+    def test_empty_diff(self, stdlib_backend):
+        assert b"".join(iter_ndjson_request(1, ([], []))) == b'{"userID": 1}\n'
+
+    def test_both_filled(self):
+        test_interval = {
+            "start": "20210124T020043Z",
+            "end": "20210124T080130Z",
+            "tags": ["foo", "bar"],
+            "annotation": "this has been added/removed",
+        }
+        interval = Interval.from_dict(**test_interval)
+        lines = list(iter_ndjson_request(42, ([interval], [interval, Interval()])))
+        assert len(lines) == 4
+        assert all(line.endswith(b"\n") for line in lines)
+        assert json.loads(lines[0]) == {"userID": 42}
+        assert json.loads(lines[1]) == {"op": "added", **test_interval}
+        assert json.loads(lines[2]) == {"op": "removed", **test_interval}
+        assert json.loads(lines[3]) == {"op": "removed", **Interval().asdict()}
+
+    def test_modified(self):
+        old = Interval.from_dict("20210124T020043Z", "20210124T080130Z", ["foo"], "")
+        new = Interval.from_dict("20210124T020043Z", "20210124T090000Z", ["foo"], "moved")
+        lines = list(iter_ndjson_request(42, ([], [], [(old, new)])))
+        assert json.loads(lines[1]) == {
+            "op": "modified",
+            "start": "20210124T020043Z",
+            "end": "20210124T080130Z",
+            "changes": {"end": "20210124T090000Z", "annotation": "moved"},
+        }
+
+
+class TestBackends:
+    old = Interval.from_dict("20210124T020043Z", "20210124T080130Z", ["foo"], "")
+    new = Interval.from_dict("20210124T020043Z", "20210124T090000Z", ["foo", 'b"ar'], "ü€")
+    diffs = [([], []), ([old, new], [Interval()]), ([new], [], [(old, new)])]
+
+    @pytest.mark.parametrize("diff", diffs)
+    def test_same_request(self, diff, monkeypatch):
+        result = json.loads(to_json_request(7, diff, {"2021-01": "abc"}))
+        ndjson = [json.loads(line) for line in iter_ndjson_request(7, diff, {"2021-01": "abc"})]
+        monkeypatch.setattr(json_converter, "orjson", None)
+        assert result == json.loads(to_json_request(7, diff, {"2021-01": "abc"}))
+        assert ndjson == [json.loads(line) for line in iter_ndjson_request(7, diff, {"2021-01": "abc"})]
+
+
+class TestToJSONModification:
+    def test_only_changed_fields(self):
+        old = Interval.from_dict("20210124T020043Z", "20210124T080130Z", ["foo"], "")
+        new = Interval.from_dict("20210124T020043Z", "20210124T080130Z", ["foo", "bar"], "")
+        assert json.loads(to_json_modification(old, new)) == {
+            "start": "20210124T020043Z",
+            "end": "20210124T080130Z",
+            "changes": {"tags": ["foo", "bar"]},
+        }
+
+    def test_request_without_modifications(self):
+        assert "modified" not in json.loads(to_json_request(1, ([], [], [])))
+
+
+class TestMonthDigests:
+    def test_json_request(self):
+        request = json.loads(to_json_request(1, ([], []), {"2021-01": "ab"}))
+        assert request == {"userID": 1, "added": [], "removed": [], "monthDigests": {"2021-01": "ab"}}
+
+    def test_ndjson_header(self):
+        lines = list(iter_ndjson_request(1, ([], []), {"2021-01": "ab"}))
+        assert json.loads(lines[0]) == {"userID": 1, "monthDigests": {"2021-01": "ab"}}
+
+    def test_months_response(self):
+        interval = {"start": "20210124T020043Z", "end": "20210124T080130Z", "tags": ["foo"], "annotation": ""}
+        response = json.dumps({"conflictsOccurred": False, "months": {"2021-01": [interval], "2021-02": []}})
+        assert from_json_months_response(response) == (
+            {"2021-01": [Interval.from_dict(**interval)], "2021-02": []},
+            False,
+        )
+
+
 class TestFromJSONResponse:
     def test_conflict_flag_false(self):
         test_json = '{"conflictsOccurred": false, "intervals": []}'
@@ -198,6 +323,84 @@ class TestFromJSONResponse:
         assert result[0] == expt_intervals[0] and result[1] == expt_intervals[1]
 
 
+@pytest.mark.usefixtures("backend")
+class TestResponseParser:
+    test_intervals = [
+        {
+            "start": "20210124T020043Z",
+            "end": "20210124T080130Z",
+            "tags": ["foo", 'b\\"a,r]'],
+            "annotation": "this is an {annotation}",
+        },
+        {"start": "20210321T170613Z", "end": "20210321T203246Z", "tags": [], "annotation": ""},
+    ]
+
+    @staticmethod
+    def chunked(text, size):
+        return (text[i : i + size] for i in range(0, len(text), size))
+
+    def test_empty_response(self):
+        parser = ResponseParser(['{"conflictsOccurred": true, "intervals": []}'])
+        assert list(parser) == []
+        assert parser.conflict_flag is True
+
+    def test_matches_from_json_response(self):
+        test_json = json.dumps({"conflictsOccurred": True, "intervals": self.test_intervals}, indent=2)
+        expt_intervals, expt_flag = from_json_response(test_json)
+        for size in range(1, len(test_json) + 1):
+            parser = ResponseParser(self.chunked(test_json, size))
+            assert list(parser) == expt_intervals
+            assert parser.conflict_flag is expt_flag
+
+    def test_flag_after_intervals(self):
+        test_json = json.dumps({"intervals": self.test_intervals, "version": 12345, "conflictsOccurred": True})
+        parser = ResponseParser(self.chunked(test_json, 3))
+        assert len(list(parser)) == 2
+        assert parser.conflict_flag is True
+
+    def test_read_conflict_flag(self):
+        def chunks():
+            yield '{"conflictsOccurred": true, "intervals": ['
+            raise AssertionError("read beyond conflict flag")
+
+        assert ResponseParser(chunks()).read_conflict_flag() is True
+
+    def test_read_conflict_flag_after_intervals(self):
+        test_json = json.dumps({"intervals": self.test_intervals, "version": 12345, "conflictsOccurred": True})
+        for size in range(1, len(test_json) + 1):
+            assert ResponseParser(self.chunked(test_json, size)).read_conflict_flag() is True
+        assert ResponseParser(['{"intervals": []}']).read_conflict_flag() is False
+        assert ResponseParser(["{}"]).read_conflict_flag() is False
+
+    def test_yields_before_end_of_stream(self):
+        def chunks():
+            yield '{"intervals": [' + json.dumps(self.test_intervals[0]) + ","
+            raise AssertionError("read beyond first interval")
+
+        assert next(iter(ResponseParser(chunks()))) == Interval.from_dict(**self.test_intervals[0])
+
+    def test_trailing_data(self):
+        with pytest.raises(ValueError):
+            list(ResponseParser(['{"intervals": []} {}']))
+
+    def test_truncated_response(self):
+        test_json = '{"conflictsOccurred": false, "intervals": [' + json.dumps(self.test_intervals[0])
+        with pytest.raises(ValueError):
+            list(ResponseParser(self.chunked(test_json, 7)))
+
+    def test_many_intervals(self):
+        test_intervals = self.test_intervals * 50
+        test_json = json.dumps({"intervals": test_intervals, "conflictsOccurred": False})
+        for size in (1, 100, 4096, len(test_json)):
+            parser = ResponseParser(self.chunked(test_json, size))
+            assert list(parser) == [Interval.from_dict(**interval) for interval in test_intervals]
+
+    def test_invalid_interval(self):
+        test_json = '{"intervals": [' + json.dumps(self.test_intervals[0]) + ", {]}"
+        with pytest.raises(ValueError):
+            list(ResponseParser([test_json]))
+
+
 class TestToJSONTags:
     def test_empty_tags(self):
         test_json = to_json_tags({})
@@ -239,3 +442,12 @@ class TestFromJSONErrorResponse:
         message, details = from_json_error_response(test_json)
         assert message == "Houston, we have a problem"
         assert details == "We've had a Main B Bus Undervolt."
+
+
+class TestVerify:
+    def test_request(self):
+        assert json.loads(to_json_verify_request(1, ["", "2021"])) == {"userID": 1, "buckets": ["", "2021"]}
+
+    def test_response(self):
+        response = json.dumps({"root": "ab", "buckets": {"": {"2021": "cd"}}})
+        assert from_json_verify_response(response) == ("ab", {"": {"2021": "cd"}})
@@ -0,0 +1,154 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("msgpack")
+
+from timewsync.interval import Interval  # noqa: E402
+from timewsync.msgpack_converter import (  # noqa: E402
+    decode_intervals,
+    encode_intervals,
+    msgpack,
+    to_msgpack_request,
+    to_msgpack_response,
+    ResponseParser,
+)
+
+TEST_INTERVALS = [
+    Interval(
+        start=datetime(2021, 3, 21, 17, 6, 13),
+        end=datetime(2021, 3, 21, 20, 32, 46),
+        tags=["bar"],
+        annotation="",
+    ),
+    Interval(
+        start=datetime(2021, 1, 24, 2, 0, 43),
+        end=datetime(2021, 1, 24, 8, 1, 30),
+        tags=["foo", "bar"],
+        annotation="this is an annotation",
+    ),
+    Interval(start=datetime(2021, 3, 22, 9, 0, 0), tags=[], annotation=""),
+]
+
+
+def by_start(intervals):
+    return sorted(intervals, key=lambda i: i.start)
+
+
+class TestEncodeIntervals:
+    def test_empty(self):
+        tag_ids = {}
+        assert encode_intervals([], tag_ids) == []
+        assert tag_ids == {}
+
+    def test_tag_dictionary(self):
+        tag_ids = {}
+        encoded = encode_intervals(TEST_INTERVALS, tag_ids)
+        assert tag_ids == {"foo": 0, "bar": 1}
+        assert [e[2] for e in encoded] == [[0, 1], [1], []]
+
+    def test_delta_encoded_start(self):
+        encoded = encode_intervals(TEST_INTERVALS, {})
+        assert encoded[0][0] == 1611453643
+        assert encoded[1][0] == 1616346373 - 1611453643
+        assert encoded[0][1] == 6 * 3600 + 47
+        assert encoded[2][1] is None
+
+    def test_round_trip(self):
+        tag_ids = {}
+        encoded = encode_intervals(TEST_INTERVALS, tag_ids)
+        assert list(decode_intervals(encoded, list(tag_ids))) == by_start(TEST_INTERVALS)
+
+    def test_missing_start(self):
+        tag_ids = {}
+        encoded = encode_intervals([TEST_INTERVALS[0], Interval()], tag_ids)
+        decoded = list(decode_intervals(encoded, list(tag_ids)))
+        assert decoded == [Interval(annotation=""), TEST_INTERVALS[0]]
+
+
+class TestToMsgpackRequest:
+    def test_empty_diff(self):
+        assert msgpack.unpackb(to_msgpack_request(1, ([], []))) == {"userID": 1, "tags": [], "added": [], "removed": []}
+
+    def test_shared_tag_dictionary(self):
+        request = msgpack.unpackb(to_msgpack_request(42, (TEST_INTERVALS[:1], TEST_INTERVALS[1:])))
+        assert list(request) == ["userID", "tags", "added", "removed"]
+        assert request["tags"] == ["bar", "foo"]
+        assert list(decode_intervals(request["added"], request["tags"])) == TEST_INTERVALS[:1]
+        assert list(decode_intervals(request["removed"], request["tags"])) == by_start(TEST_INTERVALS[1:])
+
+    def test_modified(self):
+        old = TEST_INTERVALS[1]
+        new = Interval(old.start, old.end, ["foo", "baz"], old.annotation)
+        request = msgpack.unpackb(to_msgpack_request(1, ([], [], [(old, new)])))
+        assert list(request) == ["userID", "tags", "added", "removed", "modified"]
+        assert request["tags"] == ["foo", "baz"]
+        assert request["modified"] == [[1611453643, 1611475290, {"tags": [0, 1]}]]
+
+    def test_month_digests(self):
+        request = msgpack.unpackb(to_msgpack_request(1, ([], []), {"2021-01": "ab"}))
+        assert request["monthDigests"] == {"2021-01": "ab"}
+
+    def test_smaller_than_json(self):
+        from timewsync.json_converter import to_json_request
+
+        diff = (TEST_INTERVALS * 100, [])
+        assert len(to_msgpack_request(1, diff)) * 2 < len(to_json_request(1, diff))
+
+
+class TestResponseParser:
+    def test_empty_response(self):
+        parser = ResponseParser([to_msgpack_response([], True)])
+        assert list(parser) == []
+        assert parser.conflict_flag is True
+
+    def test_chunked(self):
+        response = to_msgpack_response(TEST_INTERVALS, False)
+        for size in range(1, len(response) + 1):
+            parser = ResponseParser(response[i : i + size] for i in range(0, len(response), size))
+            assert list(parser) == by_start(TEST_INTERVALS)
+            assert parser.conflict_flag is False
+
+    def test_read_conflict_flag(self):
+        response = msgpack.packb({"tags": ["bar"], "intervals": [[1, 2, [0], ""]] * 3, "conflictsOccurred": True})
+        for size in range(1, len(response) + 1):
+            parser = ResponseParser(response[i : i + size] for i in range(0, len(response), size))
+            assert parser.read_conflict_flag() is True
+        assert ResponseParser([msgpack.packb({"intervals": []})]).read_conflict_flag() is False
+
+    def test_truncated_response(self):
+        response = to_msgpack_response(TEST_INTERVALS, False)
+        with pytest.raises(ValueError):
+            list(ResponseParser([response[:-3]]))
+
+    def test_trailing_data(self):
+        response = to_msgpack_response(TEST_INTERVALS, False)
+        with pytest.raises(ValueError):
+            list(ResponseParser([response, msgpack.packb({})]))
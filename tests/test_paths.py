@@ -0,0 +1,72 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+import os
+
+from timewsync import paths
+from timewsync.paths import TimewarriorPaths
+
+
+def test_timewarriordb_environment(tmp_path):
+    timew_paths = TimewarriorPaths(environ={"TIMEWARRIORDB": str(tmp_path)})
+    assert timew_paths.db_data_dir == str(tmp_path / "data")
+    assert timew_paths.config_file == str(tmp_path / "timewarrior.cfg")
+    assert timew_paths.extensions_dir == str(tmp_path / "extensions")
+
+
+def test_explicit_database(tmp_path):
+    timew_paths = TimewarriorPaths(str(tmp_path / "explicit"), environ={"TIMEWARRIORDB": str(tmp_path)})
+    assert timew_paths.db_data_dir == str(tmp_path / "explicit" / "data")
+
+
+def test_xdg_directories(tmp_path, monkeypatch):
+    monkeypatch.setattr(os.path, "isdir", lambda path: False)
+    monkeypatch.setattr(paths.sys, "platform", "linux")
+    environ = {"XDG_DATA_HOME": str(tmp_path / "data"), "XDG_CONFIG_HOME": str(tmp_path / "config")}
+
+    timew_paths = TimewarriorPaths(environ=environ)
+
+    assert timew_paths.db_data_dir == str(tmp_path / "data" / "timewarrior" / "data")
+    assert timew_paths.config_file == str(tmp_path / "config" / "timewarrior" / "timewarrior.cfg")
+
+
+def test_resolved_once_on_first_access(monkeypatch):
+    checked = []
+    isdir = os.path.isdir
+    monkeypatch.setattr(os.path, "isdir", lambda path: checked.append(path) or isdir(path))
+
+    timew_paths = TimewarriorPaths(environ={})
+    assert checked == []
+
+    assert timew_paths.db_data_dir == timew_paths.db_data_dir
+    assert timew_paths.config_file
+    assert len(checked) == 1
+
+
+def test_instances_independent(tmp_path):
+    first = TimewarriorPaths(str(tmp_path / "first"))
+    second = TimewarriorPaths(str(tmp_path / "second"))
+    assert first.db_data_dir != second.db_data_dir
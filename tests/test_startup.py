@@ -0,0 +1,68 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+import re
+import subprocess
+import sys
+
+# Budget for importing the package in a fresh interpreter, in milliseconds
+IMPORT_BUDGET = 50
+# Modules only needed by a sync, a verification or generate-key
+DEFERRED_MODULES = ["colorama", "cryptography", "http.client", "jwcrypto", "jwt", "requests", "timewsync.client"]
+
+
+def _import_time() -> float:
+    """Measures the cumulative time of importing timewsync in a fresh interpreter, in milliseconds."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import timewsync"], capture_output=True, text=True, check=True
+    )
+    match = re.search(r"^import time:\s+\d+ \|\s+(\d+) \| timewsync$", process.stderr, re.MULTILINE)
+    return int(match.group(1)) / 1000
+
+
+def test_import_time_within_budget():
+    # The fastest of several runs, to be robust against a busy machine
+    assert min(_import_time() for _ in range(5)) < IMPORT_BUDGET
+
+
+def test_heavy_modules_deferred():
+    code = "import sys, timewsync, timewsync.paths; print(' '.join(sys.modules)); print(vars(timewsync.paths).keys())"
+    process = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    modules, paths_attributes = process.stdout.splitlines()
+
+    assert [module for module in DEFERRED_MODULES if module in modules.split()] == []
+    # The timewarrior locations are resolved on first access
+    assert "DB_DATA_DIR" not in paths_attributes
+
+
+def test_version_skips_sync():
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "timewsync", "--version"], capture_output=True, text=True
+    )
+
+    assert process.returncode == 0
+    assert "timewsync 1.1" in process.stdout
+    assert not re.search(r"\| +(jwcrypto|timewsync\.client)$", process.stderr, re.MULTILINE)
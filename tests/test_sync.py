@@ -0,0 +1,510 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tests.sync_server import Fault, SyncServer
+from timewsync import auth, client, replicate, sync, verify
+from timewsync.client import SyncClient, async_sync
+from timewsync.config import Configuration
+from timewsync.dispatch import generate_diff
+from timewsync.file_parser import as_interval_list
+from timewsync.io_handler import (
+    read_endpoints,
+    read_etag,
+    read_keys,
+    read_snapshot,
+    read_token,
+    write_keys,
+    write_snapshot,
+)
+from timewsync.paths import TimewarriorPaths
+from timewsync.replicate import replica_data_dir
+
+JANUARY = "inc 20210105T100000Z - 20210105T110000Z # foo\n"
+FEBRUARY = "inc 20210205T100000Z - 20210205T110000Z # bar\n"
+MARCH = "inc 20210305T100000Z - 20210305T110000Z # baz"
+APRIL = "inc 20210405T100000Z - 20210405T110000Z # qux\n"
+
+
+@pytest.fixture
+def workspace(tmp_path, sync_server, private_key_pem):
+    """A synced client: the timewarrior database, the snapshot and the server hold the same intervals."""
+    db_data_dir = tmp_path / "timewarrior" / "data"
+    db_data_dir.mkdir(parents=True)
+    data_dir = str(tmp_path / "timewsync")
+    write_keys(data_dir, private_key_pem, b"")
+
+    monthly_data = {"2021-01.data": JANUARY, "2021-02.data": FEBRUARY}
+    for file_name, data in monthly_data.items():
+        (db_data_dir / file_name).write_text(data)
+    write_snapshot(data_dir, monthly_data)
+
+    sync_server.intervals = [
+        {"start": "20210105T100000Z", "end": "20210105T110000Z", "tags": ["foo"], "annotation": ""},
+        {"start": "20210205T100000Z", "end": "20210205T110000Z", "tags": ["bar"], "annotation": ""},
+    ]
+    sync_server.remember(sync_server.intervals)
+    timew_paths = TimewarriorPaths(str(tmp_path / "timewarrior"))
+    return Configuration(data_dir, sync_server.base_url, 1, timew_paths=timew_paths), db_data_dir
+
+
+def read_files(db_data_dir):
+    return {f: (db_data_dir / f).read_text() for f in sorted(os.listdir(db_data_dir)) if f != "tags.data"}
+
+
+class TestDeltaResponse:
+    def test_only_changed_months_written(self, workspace, sync_server):
+        config, db_data_dir = workspace
+        sync_server.intervals.append(
+            {"start": "20210305T100000Z", "end": "20210305T110000Z", "tags": ["baz"], "annotation": ""}
+        )
+
+        sync(config)
+
+        assert sync_server.requests[-1].headers["Sync-Base"]
+        # The month files without changes keep their trailing line breaks, they weren't rewritten
+        assert read_files(db_data_dir) == {"2021-01.data": JANUARY, "2021-02.data": FEBRUARY, "2021-03.data": MARCH}
+
+    def test_removed_month(self, workspace, sync_server):
+        config, db_data_dir = workspace
+        del sync_server.intervals[1]
+
+        sync(config)
+
+        assert read_files(db_data_dir) == {"2021-01.data": JANUARY}
+
+    def test_unknown_base_sends_divergent_months(self, workspace, sync_server):
+        config, db_data_dir = workspace
+        sync_server.states.clear()
+        sync_server.intervals[1]["tags"] = ["qux"]
+
+        sync(config)
+
+        assert "monthDigests" in json.loads(sync_server.requests[-1].body)
+        assert read_files(db_data_dir) == {
+            "2021-01.data": JANUARY,
+            "2021-02.data": "inc 20210205T100000Z - 20210205T110000Z # qux",
+        }
+
+    def test_full_response_fallback(self, workspace, sync_server):
+        config, db_data_dir = workspace
+        sync_server.response_types = []
+
+        sync(config)
+
+        assert read_files(db_data_dir) == {"2021-01.data": JANUARY.strip(), "2021-02.data": FEBRUARY.strip()}
+
+
+class TestConditionalSync:
+    def test_idle_sync(self, workspace, sync_server):
+        config, db_data_dir = workspace
+        sync(config)
+        snapshot = os.stat(os.path.join(config.data_dir, "snapshot.tgz"))
+        etag = read_etag(config.data_dir)
+
+        sync(config)
+
+        assert etag
+        assert len(sync_server.requests) == 2
+        assert sync_server.requests[1].headers["If-None-Match"] == etag
+        assert os.stat(os.path.join(config.data_dir, "snapshot.tgz")).st_mtime_ns == snapshot.st_mtime_ns
+        assert read_files(db_data_dir) == {"2021-01.data": JANUARY, "2021-02.data": FEBRUARY}
+
+    def test_changed_on_server(self, workspace, sync_server):
+        config, db_data_dir = workspace
+        sync(config)
+        etag = read_etag(config.data_dir)
+        sync_server.apply(
+            [{"start": "20210305T100000Z", "end": "20210305T110000Z", "tags": ["baz"], "annotation": ""}], []
+        )
+
+        sync(config)
+
+        assert read_files(db_data_dir)["2021-03.data"] == MARCH
+        assert read_etag(config.data_dir) not in (None, etag)
+
+
+class TestVerify:
+    def test_matches_server(self, workspace, sync_server, caplog):
+        config, db_data_dir = workspace
+
+        with caplog.at_level(logging.INFO):
+            assert verify(config) == []
+
+        assert "The data matches the server." in caplog.text
+        assert [r.method for r in sync_server.requests] == ["POST"]
+
+    def test_reports_divergent_days(self, workspace, sync_server, caplog):
+        config, db_data_dir = workspace
+        sync_server.intervals[1]["tags"] = ["qux"]
+        (db_data_dir / "2021-03.data").write_text(MARCH)
+
+        with caplog.at_level(logging.INFO):
+            divergences = verify(config)
+
+        assert [d.bucket for d in divergences] == ["2021-02-05", "2021-03"]
+        assert "2021-02-05: intervals differ" in caplog.text
+        assert "2021-03: only local" in caplog.text
+        assert read_files(db_data_dir) == {"2021-01.data": JANUARY, "2021-02.data": FEBRUARY, "2021-03.data": MARCH}
+        assert not any(r.method == "PUT" for r in sync_server.requests)
+
+    def test_offline(self, workspace, sync_server):
+        config, db_data_dir = workspace
+        (db_data_dir / "2021-02.data").write_text("")
+
+        assert [d.bucket for d in verify(config, offline=True)] == ["2021-02"]
+        assert sync_server.requests == []
+
+    def test_unreachable_server(self, workspace, sync_server, caplog):
+        config, db_data_dir = workspace
+        config.retries = 0
+        sync_server.stop()
+
+        assert verify(config) == []
+        assert "Comparing with the snapshot of the latest sync instead." in caplog.text
+
+    def test_active_interval_ignored(self, workspace, sync_server):
+        config, db_data_dir = workspace
+        (db_data_dir / "2021-02.data").write_text(FEBRUARY + "inc 20210206T100000Z # bar\n")
+
+        assert verify(config) == []
+
+
+class TestFailover:
+    def test_unreachable_server_skipped(self, workspace, sync_server):
+        config, db_data_dir = workspace
+        unreachable = SyncServer().start()
+        unreachable.stop()
+        config = Configuration(
+            config.data_dir, [unreachable.base_url, sync_server.base_url], 1, timew_paths=config.timew_paths
+        )
+        sync_server.intervals.append(
+            {"start": "20210305T100000Z", "end": "20210305T110000Z", "tags": ["baz"], "annotation": ""}
+        )
+
+        sync(config)
+
+        assert read_files(db_data_dir)["2021-03.data"] == MARCH
+        records = read_endpoints(config.data_dir)
+        assert records[unreachable.base_url]["failures"] == 1
+        assert records[sync_server.base_url]["failures"] == 0
+
+
+@pytest.fixture
+def backup_server():
+    server = SyncServer().start()
+    yield server
+    server.stop()
+
+
+class TestReplicas:
+    def test_new_replica_receives_all_intervals(self, workspace, sync_server, backup_server):
+        config, db_data_dir = workspace
+        config.replica_base_urls = [backup_server.base_url]
+
+        sync(config)
+
+        assert backup_server.intervals == sync_server.intervals
+        replica_snapshot = read_snapshot(replica_data_dir(config.data_dir, backup_server.base_url))
+        assert replica_snapshot == read_snapshot(config.data_dir)
+
+    def test_diff_computed_once(self, workspace, sync_server, backup_server, monkeypatch):
+        config, db_data_dir = workspace
+        config.replica_base_urls = [backup_server.base_url]
+        sync(config)
+        calls = []
+        monkeypatch.setattr(client, "generate_diff", lambda *args: calls.append(args) or generate_diff(*args))
+        monkeypatch.setattr(replicate, "generate_diff", lambda *args: calls.append(args) or generate_diff(*args))
+
+        for month, data in [("2021-03", MARCH), ("2021-04", APRIL), (None, None)]:
+            if month:
+                (db_data_dir / f"{month}.data").write_text(data)
+            calls.clear()
+
+            sync(config)
+
+            assert len(calls) == 1
+            assert backup_server.intervals == sync_server.intervals
+        assert len(sync_server.intervals) == 4
+
+    def test_replica_changes_merged(self, workspace, sync_server, backup_server):
+        config, db_data_dir = workspace
+        config.replica_base_urls = [backup_server.base_url]
+        sync(config)
+        backup_server.intervals.append(
+            {"start": "20210305T100000Z", "end": "20210305T110000Z", "tags": ["baz"], "annotation": ""}
+        )
+
+        sync(config)
+
+        assert read_files(db_data_dir)["2021-03.data"] == MARCH
+        assert len(sync_server.intervals) == 2
+
+        # The primary server's snapshot lacks the merged interval, so it is sent with the next sync
+        sync(config)
+
+        assert len(sync_server.intervals) == 3
+
+    def test_unreachable_replica(self, workspace, sync_server, backup_server, caplog):
+        config, db_data_dir = workspace
+        config.replica_base_urls = [backup_server.base_url]
+        config.retries = 0
+        sync_server.intervals.append(
+            {"start": "20210305T100000Z", "end": "20210305T110000Z", "tags": ["baz"], "annotation": ""}
+        )
+        backup_server.stop()
+
+        sync(config)
+
+        assert read_files(db_data_dir)["2021-03.data"] == MARCH
+        assert f"Error connecting to replica {backup_server.base_url}." in caplog.text
+        assert read_snapshot(replica_data_dir(config.data_dir, backup_server.base_url)) == {}
+
+
+class TestTokenCache:
+    def test_token_reused(self, workspace, sync_server, monkeypatch):
+        config, db_data_dir = workspace
+        generated = []
+        generate_jwt = auth.generate_jwt
+        monkeypatch.setattr(auth, "generate_jwt", lambda *args: generated.append(args) or generate_jwt(*args))
+
+        sync(config)
+        sync(config)
+
+        assert len(generated) == 1
+        tokens = {r.headers["Authorization"] for r in sync_server.requests}
+        assert len(tokens) == 1
+
+    def test_rejected_token_dropped(self, workspace, sync_server):
+        config, db_data_dir = workspace
+        sync(config)
+        sync_server.faults = [Fault(status=401)]
+
+        sync(config)
+
+        assert read_token(config.data_dir) == (None, None)
+
+
+class TestKeyTypes:
+    @pytest.mark.parametrize("key_type", ["rsa", "ed25519", "es256"])
+    def test_verified_by_server(self, workspace, sync_server, key_pairs, key_type):
+        config, db_data_dir = workspace
+        private_key_pem, public_key_pem = key_pairs[key_type]
+        write_keys(config.data_dir, private_key_pem, public_key_pem)
+        sync_server.public_key = public_key_pem
+        (db_data_dir / "2021-03.data").write_text(MARCH)
+
+        sync(config)
+
+        assert len(sync_server.intervals) == 3
+
+    def test_wrong_key_rejected(self, workspace, sync_server, key_pairs, caplog):
+        config, db_data_dir = workspace
+        write_keys(config.data_dir, *key_pairs["ed25519"])
+        sync_server.public_key = key_pairs["es256"][1]
+
+        sync(config)
+
+        assert 'Server responded with error message "Unauthorized"' in caplog.text
+
+
+class TestTimewarriorPaths:
+    def test_several_databases_in_one_process(self, workspace, tmp_path, sync_server):
+        config, db_data_dir = workspace
+        other_db_data_dir = tmp_path / "other" / "data"
+        other_config = Configuration(
+            config.data_dir + "-other", sync_server.base_url, 1, timew_paths=TimewarriorPaths(str(tmp_path / "other"))
+        )
+        write_keys(other_config.data_dir, *read_keys(config.data_dir))
+        (db_data_dir / "2021-03.data").write_text(MARCH)
+
+        sync(config)
+        sync(other_config)
+
+        expected = {"2021-01.data": JANUARY.strip(), "2021-02.data": FEBRUARY.strip(), "2021-03.data": MARCH}
+        assert read_files(other_db_data_dir) == expected
+        assert read_files(db_data_dir)["2021-03.data"] == MARCH
+        assert not os.path.exists(os.environ["TIMEWARRIORDB"])
+
+
+class TestSyncClient:
+    def test_result(self, workspace, sync_server):
+        config, db_data_dir = workspace
+        (db_data_dir / "2021-03.data").write_text(MARCH)
+        del sync_server.intervals[0]
+
+        with SyncClient(config) as sync_client:
+            result = sync_client.sync()
+
+        assert result.success and result.error is None
+        assert (result.added, result.removed, result.received) == (1, 0, 1)
+        assert result.conflict is False
+        assert result.restarted is None
+        assert set(result.timings) == {"read", "token", "exchange", "write"}
+
+    def test_failure_result(self, workspace):
+        config, _ = workspace
+        unreachable = SyncServer().start()
+        unreachable.stop()
+        config.server_base_urls = [unreachable.base_url]
+        config.server_base_url = unreachable.base_url
+        config.retries = 0
+
+        with SyncClient(config) as sync_client:
+            result = sync_client.sync()
+
+        assert not result.success
+        assert result.error == "Error connecting to server. No changes were made."
+
+    def test_restart_status(self, workspace):
+        config, db_data_dir = workspace
+        (db_data_dir / "2021-03.data").write_text("inc 20210305T100000Z # baz\n")
+
+        result = sync(config)
+
+        assert result.success
+        assert result.restarted is True
+
+    def test_state_kept_between_syncs(self, workspace, sync_server, monkeypatch):
+        config, db_data_dir = workspace
+        generated = []
+        parsed = []
+        generate_jwt = auth.generate_jwt
+        monkeypatch.setattr(auth, "generate_jwt", lambda *args: generated.append(args) or generate_jwt(*args))
+        monkeypatch.setattr(
+            client,
+            "as_interval_list",
+            lambda file_strings: parsed.extend(file_strings) or as_interval_list(file_strings),
+        )
+
+        with SyncClient(config) as sync_client:
+            assert sync_client.sync().success
+            parsed.clear()
+            (db_data_dir / "2021-03.data").write_text(MARCH)
+            result = sync_client.sync()
+
+        assert result.success and len(sync_server.intervals) == 3
+        assert len(generated) == 1
+        # The files unchanged since the previous sync aren't parsed again
+        assert sorted(parsed) == ["2021-03.data"]
+        # Both syncs went over the same connection
+        assert len({request.client_port for request in sync_server.requests}) == 1
+
+    def test_token_not_reused_after_key_replaced(self, workspace, sync_server, key_pairs):
+        config, _ = workspace
+
+        with SyncClient(config) as sync_client:
+            assert sync_client.sync().success
+            private_key_pem, public_key_pem = key_pairs["ed25519"]
+            write_keys(config.data_dir, private_key_pem, public_key_pem)
+            sync_server.public_key = public_key_pem
+            result = sync_client.sync()
+
+        assert result.success
+        assert len({request.headers["Authorization"] for request in sync_server.requests}) == 2
+
+    def test_replica_connection_kept_between_syncs(self, workspace, backup_server):
+        config, db_data_dir = workspace
+        config.replica_base_urls = [backup_server.base_url]
+
+        with SyncClient(config) as sync_client:
+            assert sync_client.sync().success
+            (db_data_dir / "2021-03.data").write_text(MARCH)
+            assert sync_client.sync().success
+
+        assert len(backup_server.intervals) == 3
+        assert len({request.client_port for request in backup_server.requests}) == 1
+
+
+class TestAsyncSync:
+    def test_result(self, workspace, sync_server):
+        config, db_data_dir = workspace
+        (db_data_dir / "2021-03.data").write_text(MARCH)
+
+        result = asyncio.run(async_sync(config))
+
+        assert result.success and result.added == 1
+        assert len(sync_server.intervals) == 3
+
+    def test_event_loop_not_blocked(self, workspace, tmp_path, sync_server):
+        config, _ = workspace
+        other_config = Configuration(
+            config.data_dir + "-other", sync_server.base_url, 1, timew_paths=TimewarriorPaths(str(tmp_path / "other"))
+        )
+        write_keys(other_config.data_dir, *read_keys(config.data_dir))
+        sync_server.latency = 0.2
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        async def sync_both():
+            ticker = asyncio.ensure_future(tick())
+            results = await asyncio.gather(async_sync(config), async_sync(other_config))
+            ticker.cancel()
+            return results
+
+        results = asyncio.run(sync_both())
+
+        assert all(result.success for result in results)
+        assert read_files(tmp_path / "other" / "data") == {
+            "2021-01.data": JANUARY.strip(),
+            "2021-02.data": FEBRUARY.strip(),
+        }
+        assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.1
+
+    def test_cancelled(self, workspace, sync_server):
+        config, db_data_dir = workspace
+        (db_data_dir / "2021-03.data").write_text(MARCH)
+        sync_server.inject(Fault(status=503, retry_after="10"))
+        executor = ThreadPoolExecutor(max_workers=1)
+
+        async def cancel_sync():
+            task = asyncio.ensure_future(async_sync(config, executor=executor))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        start = time.monotonic()
+        asyncio.run(cancel_sync())
+        executor.shutdown(wait=True)
+
+        # The sync stopped waiting for the retry, without changes on either side
+        assert time.monotonic() - start < 2
+        assert len(sync_server.intervals) == 2
+        assert read_snapshot(config.data_dir).keys() == {"2021-01.data", "2021-02.data"}
@@ -0,0 +1,389 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+import base64
+import datetime
+import http.client
+import json
+import socket
+import socketserver
+import ssl
+import threading
+from urllib.parse import urlsplit
+
+import pytest
+
+from tests.sync_server import Fault, SyncServer
+from timewsync.transport import (
+    ConnectionFailedError,
+    FakeTransport,
+    HTTPClientTransport,
+    RequestTimeoutError,
+    create_transport,
+    is_available,
+    split_unix_socket,
+)
+
+NETWORK_TRANSPORTS = ["http.client", "requests"]
+
+
+@pytest.fixture(params=NETWORK_TRANSPORTS + ["fake"])
+def transport(request, sync_server):
+    if request.param == "fake":
+        transport = FakeTransport(sync_server.handle)
+    else:
+        transport = create_transport(request.param)
+    yield transport
+    transport.close()
+
+
+@pytest.fixture
+def proxy_server():
+    server = ProxyServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def tls_sync_server(tmp_path):
+    """A stand-in server for https://localhost, with its certificate in tmp_path/"ca.pem"."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    (tmp_path / "ca.pem").write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    (tmp_path / "key.pem").write_bytes(
+        key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(tmp_path / "ca.pem", tmp_path / "key.pem")
+
+    server = SyncServer()
+    server._httpd.socket = context.wrap_socket(server._httpd.socket, server_side=True)
+    server.start()
+    yield server
+    server.stop()
+
+
+class ProxyServer:
+    """A forward proxy tunneling CONNECT requests and forwarding the first plain HTTP request of each connection.
+
+    Attributes:
+        requests: The request line and the headers of each request received by the proxy
+    """
+
+    def __init__(self):
+        self.requests = []
+        proxy = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                method, target, version = self.rfile.readline().decode("latin-1").split()
+                headers = http.client.parse_headers(self.rfile)
+                proxy.requests.append((f"{method} {target} {version}", headers))
+                if method == "CONNECT":
+                    host, port = target.rsplit(":", 1)
+                    upstream = socket.create_connection((host, int(port)))
+                    self.wfile.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+                else:
+                    parts = urlsplit(target)
+                    upstream = socket.create_connection((parts.hostname, parts.port))
+                    head = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+                    upstream.sendall(f"{method} {parts.path} {version}\r\n{head}\r\n".encode("latin-1"))
+                downstream = threading.Thread(target=_pipe, args=(upstream.recv, self.connection))
+                downstream.start()
+                _pipe(self.rfile.read1, upstream)
+                downstream.join()
+                upstream.close()
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self) -> "ProxyServer":
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _pipe(read, destination: socket.socket) -> None:
+    """Copy data until the source is closed, then close the destination for writing."""
+    try:
+        while True:
+            data = read(64 * 1024)
+            if not data:
+                break
+            destination.sendall(data)
+    except OSError:
+        pass
+    try:
+        destination.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+
+
+def put(transport, sync_server, body=b'{"userID": 1, "added": [], "removed": []}', headers=None, timeout=(1, 1)):
+    headers = {"Content-Type": "application/json", **(headers or {})}
+    return transport.request("PUT", sync_server.base_url + "/api/sync", headers, body, timeout)
+
+
+class TestTransports:
+    def test_request(self, transport, sync_server):
+        with put(transport, sync_server) as response:
+            assert response.status_code == 200
+            assert response.reason == "OK"
+            assert response.headers["content-type"] == "application/json"
+            assert json.loads(response.text) == {"conflictsOccurred": False, "intervals": []}
+        assert sync_server.requests[0].headers["Content-Type"] == "application/json"
+
+    def test_chunked_body(self, transport, sync_server):
+        chunks = [b'{"userID": 1, ', b"", b'"added": [], "removed": []}']
+
+        with put(transport, sync_server, iter(chunks)) as response:
+            assert response.status_code == 200
+        assert sync_server.requests[0].headers["Transfer-Encoding"] == "chunked"
+        assert sync_server.requests[0].body == b"".join(chunks)
+
+    def test_compressed_response(self, transport, sync_server):
+        sync_server.compress_responses = True
+        sync_server.intervals = [
+            {"start": "20210101T100000Z", "end": "20210101T110000Z", "tags": ["foo"], "annotation": ""}
+        ] * 100
+
+        with put(transport, sync_server, headers={"Accept-Encoding": "gzip"}) as response:
+            body = b"".join(response.iter_content(1024))
+        assert json.loads(body)["intervals"] == sync_server.intervals
+        assert response.bytes_received < len(body)
+
+    def test_error_response(self, transport, sync_server):
+        response = transport.request("PUT", sync_server.base_url + "/unknown", {}, b"")
+        with response:
+            assert response.status_code == 404
+            assert json.loads(response.text)["message"] == "Not found"
+
+    def test_dropped_connection(self, transport, sync_server):
+        sync_server.inject(Fault(drop=True))
+
+        with pytest.raises(ConnectionFailedError):
+            put(transport, sync_server)
+
+
+@pytest.mark.parametrize("name", NETWORK_TRANSPORTS)
+class TestNetworkTransports:
+    def test_reuses_connection(self, name, sync_server):
+        with create_transport(name) as transport:
+            for _ in range(3):
+                with put(transport, sync_server) as response:
+                    response.text
+        assert len({r.client_port for r in sync_server.requests}) == 1
+
+    def test_without_keep_alive(self, name, sync_server):
+        with create_transport(name, keep_alive=False) as transport:
+            for _ in range(2):
+                with put(transport, sync_server) as response:
+                    response.text
+        assert len({r.client_port for r in sync_server.requests}) == 2
+
+    def test_read_timeout(self, name, sync_server):
+        sync_server.inject(Fault(delay=0.5))
+
+        with create_transport(name) as transport:
+            with pytest.raises(RequestTimeoutError):
+                put(transport, sync_server, timeout=(1, 0.1))
+
+    def test_connection_refused(self, name, sync_server):
+        base_url = sync_server.base_url
+        sync_server.stop()
+
+        with create_transport(name) as transport:
+            with pytest.raises(ConnectionFailedError):
+                transport.request("GET", base_url, {}, timeout=(1, 1))
+
+
+class TestHTTPClientTransport:
+    def test_unread_body_drained(self, sync_server):
+        with HTTPClientTransport() as transport:
+            put(transport, sync_server).close()
+            put(transport, sync_server).close()
+        assert len({r.client_port for r in sync_server.requests}) == 1
+
+    def test_large_unread_body_closes_connection(self, sync_server, monkeypatch):
+        monkeypatch.setattr("timewsync.transport.DRAIN_LIMIT", 10)
+        with HTTPClientTransport() as transport:
+            put(transport, sync_server).close()
+            put(transport, sync_server).close()
+        assert len({r.client_port for r in sync_server.requests}) == 2
+
+    def test_idle_connections_per_server(self, sync_server):
+        other_server = SyncServer().start()
+        try:
+            with HTTPClientTransport(pool_connections=1) as transport:
+                put(transport, sync_server).close()
+                put(transport, other_server).close()
+                put(transport, sync_server).close()
+        finally:
+            other_server.stop()
+        assert len({r.client_port for r in sync_server.requests}) == 2
+
+    def test_connect_ahead(self, sync_server, monkeypatch):
+        created = []
+        new_connection = HTTPClientTransport._new_connection
+        monkeypatch.setattr(
+            HTTPClientTransport, "_new_connection", lambda self, key: created.append(key) or new_connection(self, key)
+        )
+        with HTTPClientTransport() as transport:
+            transport.connect(sync_server.base_url, 1)
+            transport.connect(sync_server.base_url, 1)
+            put(transport, sync_server).close()
+        assert len(created) == 1
+
+    def test_connect_failed(self, sync_server):
+        sync_server.stop()
+        with HTTPClientTransport() as transport:
+            with pytest.raises(ConnectionFailedError):
+                transport.connect(sync_server.base_url, 1)
+
+
+class TestProxies:
+    @pytest.fixture(autouse=True)
+    def environment(self, monkeypatch):
+        for name in ("HTTP_PROXY", "HTTPS_PROXY", "NO_PROXY", "REQUESTS_CA_BUNDLE", "CURL_CA_BUNDLE"):
+            monkeypatch.delenv(name, raising=False)
+            monkeypatch.delenv(name.lower(), raising=False)
+
+    def test_http_proxy(self, sync_server, proxy_server, monkeypatch):
+        monkeypatch.setenv("HTTP_PROXY", proxy_server.url.replace("http://", "http://user:secret@"))
+
+        with HTTPClientTransport() as transport:
+            with put(transport, sync_server) as response:
+                assert json.loads(response.text) == {"conflictsOccurred": False, "intervals": []}
+        request_line, headers = proxy_server.requests[0]
+        assert request_line == f"PUT {sync_server.base_url}/api/sync HTTP/1.1"
+        assert headers["Proxy-Authorization"] == "Basic " + base64.b64encode(b"user:secret").decode()
+        assert sync_server.requests[0].path == "/api/sync"
+
+    def test_https_tunnel(self, tls_sync_server, proxy_server, tmp_path, monkeypatch):
+        monkeypatch.setenv("HTTPS_PROXY", proxy_server.url)
+        monkeypatch.setenv("REQUESTS_CA_BUNDLE", str(tmp_path / "ca.pem"))
+        port = tls_sync_server._httpd.server_address[1]
+
+        with HTTPClientTransport() as transport:
+            for _ in range(2):
+                body = b'{"userID": 1, "added": [], "removed": []}'
+                with transport.request("PUT", f"https://localhost:{port}/api/sync", {}, body, (1, 1)) as response:
+                    assert json.loads(response.text) == {"conflictsOccurred": False, "intervals": []}
+        assert len(proxy_server.requests) == 1
+        assert proxy_server.requests[0][0].startswith(f"CONNECT localhost:{port} HTTP/")
+        assert len(tls_sync_server.requests) == 2
+
+    def test_no_proxy(self, sync_server, proxy_server, monkeypatch):
+        monkeypatch.setenv("HTTP_PROXY", proxy_server.url)
+        monkeypatch.setenv("NO_PROXY", "127.0.0.1")
+
+        with HTTPClientTransport() as transport:
+            put(transport, sync_server).close()
+        assert proxy_server.requests == []
+        assert len(sync_server.requests) == 1
+
+    def test_unknown_certificate_rejected(self, tls_sync_server):
+        port = tls_sync_server._httpd.server_address[1]
+
+        with HTTPClientTransport() as transport:
+            with pytest.raises(ConnectionFailedError):
+                transport.request("GET", f"https://localhost:{port}/", {}, timeout=(1, 1))
+
+
+class TestCreateTransport:
+    def test_lightest_by_default(self):
+        assert isinstance(create_transport(), HTTPClientTransport)
+
+    def test_unknown(self):
+        assert not is_available("pycurl")
+        with pytest.raises(ValueError):
+            create_transport("pycurl")
+
+    def test_missing_dependency(self, monkeypatch):
+        monkeypatch.setattr("importlib.util.find_spec", lambda name: None)
+        assert not is_available("requests")
+        assert is_available("http.client")
+
+
+class TestUnixSockets:
+    def test_split_unix_url(self):
+        assert split_unix_socket("unix:///run/timewsync.sock") == ("http://localhost/", "/run/timewsync.sock")
+
+    def test_split_http_unix_url(self):
+        assert split_unix_socket("http+unix://%2Frun%2Ftimewsync.sock/relay") == (
+            "http://localhost/relay",
+            "/run/timewsync.sock",
+        )
+
+    def test_split_tcp_url(self):
+        assert split_unix_socket("http://localhost:8080") == ("http://localhost:8080", None)
+
+    def test_request(self, unix_sync_server):
+        base_url, unix_socket = split_unix_socket(unix_sync_server.base_url)
+        with create_transport(unix_socket=unix_socket) as transport:
+            for _ in range(2):
+                with put(transport, unix_sync_server) as response:
+                    assert json.loads(response.text) == {"conflictsOccurred": False, "intervals": []}
+        assert unix_sync_server.requests[0].headers["Host"] == "localhost"
+        assert len({r.client_port for r in unix_sync_server.requests}) == 1
+
+    def test_missing_socket(self, unix_sync_server):
+        unix_socket = unix_sync_server.unix_socket
+        unix_sync_server.stop()
+
+        with create_transport(unix_socket=unix_socket) as transport:
+            with pytest.raises(ConnectionFailedError):
+                transport.request("GET", "http://localhost/", {}, timeout=(1, 1))
+
+    def test_unsupported_transport(self):
+        with pytest.raises(ValueError):
+            create_transport("requests", unix_socket="/run/timewsync.sock")
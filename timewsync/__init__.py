@@ -28,26 +28,15 @@
 import argparse
 import logging
 import os
-import subprocess
 import sys
 
-from colorama import just_fix_windows_console, Fore
-import requests
-
 from timewsync import auth, cli
-from timewsync.dispatch import ServerError, dispatch
-from timewsync.file_parser import as_interval_list, as_file_strings, extract_tags
-from timewsync.io_handler import read_data, read_keys, write_data, write_keys, delete_snapshot
-from timewsync.config import (
-    NoConfigurationFileError,
-    MissingSectionError,
-    MissingConfigurationError,
-    Configuration,
-    create_example_configuration,
-    ensure_data_dir_exists,
-)
+from timewsync.deadline import Deadline
 from timewsync.logging_helpers import SingleLevelFilter, MinMaxLevelFilter
 
+# The synchronization is imported on first use, a cold start only pays for the command line interface
+_CLIENT_EXPORTS = {"SyncClient", "SyncResult", "async_sync", "run_conflict_hook", "sync", "verify"}
+
 DEFAULT_DATA_DIR = os.path.join("~", ".timewsync")
 
 
@@ -78,35 +67,44 @@ def make_parser():
         default=DEFAULT_DATA_DIR,
         help="the path to the data directory",
     )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        metavar="SECONDS",
+        help="abort the synchronization if it takes longer than this",
+    )
 
     subparsers = parser.add_subparsers(dest="subcommand")
-    subparsers.add_parser("generate-key", help="generates a new key pair.")
+    generate_key_parser = subparsers.add_parser("generate-key", help="generates a new key pair.")
+    generate_key_parser.add_argument(
+        "--type",
+        dest="key_type",
+        choices=list(auth.KEY_TYPES),
+        default=auth.DEFAULT_KEY_TYPE,
+        help="the type of the key pair, ed25519 and es256 are faster but have to be supported by the server",
+    )
+    verify_parser = subparsers.add_parser("verify", help="compares the local data with the server without changes.")
+    verify_parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="compare with the snapshot of the latest sync instead",
+    )
 
     return parser
 
 
-def run_conflict_hook(data_dir: str) -> None:
-    """Run 'conflicts-occurred' file if present.
+def __getattr__(name):
+    """Imports the synchronization on first access to one of its exports."""
+    if name in _CLIENT_EXPORTS:
+        from timewsync import client
 
-    Expected in '.timewsync/hooks' directory.
-
-    Args:
-        data_dir: The timewsync data directory.
-
-    Raises:
-        CalledProcessError: Is raised if the hook exits with a non-zero exit code. Holds details about the process.
-    """
-    conflict_hook = os.path.join(data_dir, "hooks", "conflicts-occurred")
-
-    if os.path.exists(conflict_hook):
-        subprocess.run(conflict_hook, check=True)
+        return getattr(client, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def main():
     """This function is the main entry point to the timewarrior
     synchronization client."""
-    just_fix_windows_console()  # ANSI escape fix for Windows terminals
-
     args = make_parser().parse_args()
     data_dir = os.path.expanduser(args.data_dir)
 
@@ -127,18 +125,33 @@ def main():
         info_handler.addFilter(SingleLevelFilter(logging.INFO))
         log.addHandler(info_handler)
 
-    # Error logging
-    red_formatter = logging.Formatter(Fore.RED + "%(levelname)s: %(message)s" + Fore.RESET)
+    # Error logging, in red if stderr is a terminal
+    error_format = "%(levelname)s: %(message)s"
+    if sys.stderr.isatty():
+        from colorama import just_fix_windows_console, Fore
+
+        just_fix_windows_console()  # ANSI escape fix for Windows terminals
+        error_format = Fore.RED + error_format + Fore.RESET
     red_handler = logging.StreamHandler(sys.stderr)
     red_handler.addFilter(MinMaxLevelFilter(logging.WARNING, logging.CRITICAL))
-    red_handler.setFormatter(red_formatter)
+    red_handler.setFormatter(logging.Formatter(error_format))
     log.addHandler(red_handler)
 
+    from timewsync.config import (
+        NoConfigurationFileError,
+        MissingSectionError,
+        MissingConfigurationError,
+        InvalidConfigurationError,
+        Configuration,
+        create_example_configuration,
+        ensure_data_dir_exists,
+    )
+
     ensure_data_dir_exists(data_dir)
 
     if args.subcommand == "generate-key":
         log.debug("Executing generate-key subcommand")
-        _generate_key(data_dir)
+        _generate_key(data_dir, args.key_type)
         return
 
     try:
@@ -158,124 +171,32 @@ def main():
     except MissingConfigurationError as e:
         log.error('The section "%s" in the configuration needs to define "%s".', e.section, e.name)
         return
-
-    log.debug("Executing sync command")
-    sync(configuration)
-
-
-def sync(configuration: Configuration) -> None:
-    """Sync's the timewarrior data with the server.
-
-    Args:
-        configuration: The user's configuration.
-    """
-    log = logging.getLogger(__name__)
-
-    # Read data
-    try:
-        log.debug("Reading timew data and snapshot")
-        timew_data, snapshot_data = read_data(configuration.data_dir)
-        timew_intervals, active_interval = as_interval_list(timew_data)
-        snapshot_intervals, _ = as_interval_list(snapshot_data)
-    except OSError as e:
-        log.debug("OSError: %s", e)
-        log.error("Error reading intervals from disk: No changes were made.")
-        return
-
-    # Read key
-    try:
-        log.debug("Reading private key")
-        private_key_pem, _ = read_keys(configuration.data_dir)
-        if private_key_pem is None:
-            log.error("No private key was found. Generate a key pair using `timewsync generate-key`.")
-            return
-    except OSError as e:
-        log.debug("OSError: %s", e)
-        log.error("Error reading private key from disk: No changes were made.")
+    except InvalidConfigurationError as e:
+        log.error('The value "%s" of "%s" in the section "%s" is not supported.', e.value, e.name, e.section)
         return
 
-    # Generate token
-    try:
-        log.debug("Generating JSON Web Token")
-        token = auth.generate_jwt(private_key_pem, configuration.user_id)
-    except Exception as e:
-        log.debug("Unexpected Exception: %s", e)
-        log.error("Unexpected error occurred during JWT generation. No changes were made.")
-        return
+    from timewsync.client import sync, verify
 
-    # Active time tracking
-    if active_interval:
-        log.info("Time tracking is active. Stopped time tracking to prevent conflicts.")
-
-    # Communicate with server
-    try:
-        log.debug("Sending request to server")
-        response_intervals, conflict_flag = dispatch(configuration, timew_intervals, snapshot_intervals, token)
-    except requests.ConnectionError as e:
-        log.debug("Connection error: %s", e)
-        log.error("Error connecting to server. No changes were made.")
-        return
-    except ServerError as e:
-        log.debug("Error details: %s", e.details)
-        log.error('Server responded with error message "%s". No changes were made.', e.message)
-        return
-    except Exception as e:
-        log.debug("Unexpected Exception: %s", e)
-        log.error("Unexpected error occurred during communication with server. No changes were made.")
-        return
-
-    # Write data
-    try:
-        log.debug("Writing timew data and snapshot")
-        server_data, started_tracking = as_file_strings(response_intervals, active_interval)
-        new_tags = extract_tags(response_intervals)
-        write_data(configuration.data_dir, server_data, new_tags)
-    except IOError as e:
-        delete_snapshot(configuration.data_dir)
-        log.debug("IOError: %s", e)
-        log.error("Error writing data to disk. To ensure consistency, the newly created snapshot was deleted.")
-        return
-    except Exception as e:
-        delete_snapshot(configuration.data_dir)
-        log.debug("Unexpected Exception: %s", e)
-        log.error(
-            "Unexpected error occurred during writing of data. "
-            "To ensure consistency, the newly created snapshot was deleted."
-        )
+    if args.subcommand == "verify":
+        log.debug("Executing verify subcommand")
+        verify(configuration, args.offline, Deadline(args.deadline))
         return
 
-    # Run hook if necessary
-    if conflict_flag:
-        try:
-            log.debug("Executing conflict hook")
-            run_conflict_hook(configuration.data_dir)
-        except subprocess.CalledProcessError:
-            log.warning("Hook exited with a non-zero exit code. Continuing...")
-        except OSError as e:
-            log.debug("OSError: %s", e)
-            log.error("Error occurred while executing the conflict-occurred hook. Continuing...")
-
-    # Output
-    if active_interval and started_tracking:
-        log.info("Restarted time tracking from the point it was stopped.")
-
-    log.info("Synchronization successful!")
-
-    if active_interval and not started_tracking:
-        log.warning(
-            "Cannot restart time tracking because there exists a time interval in the future "
-            "which would overlap with the open interval!"
-        )
+    log.debug("Executing sync command")
+    sync(configuration, Deadline(args.deadline))
 
 
-def _generate_key(data_dir: str) -> None:
-    """Generates a new RSA key pair.
+def _generate_key(data_dir: str, key_type: str = auth.DEFAULT_KEY_TYPE) -> None:
+    """Generates a new key pair.
 
     Prompts the user for confirmation if keys already exist.
 
     Args:
         data_dir: The user's timewsync data dir.
+        key_type: (Optional) The key type, one of auth.KEY_TYPES. Defaults to RSA.
     """
+    from timewsync.io_handler import read_keys, write_keys
+
     log = logging.getLogger(__name__)
 
     log.debug("Checking if previous keys exist")
@@ -290,7 +211,7 @@ def _generate_key(data_dir: str) -> None:
 
     try:
         log.debug("Generating new key pair")
-        priv_pem, pub_pem = auth.generate_keys()
+        priv_pem, pub_pem = auth.generate_keys(key_type)
     except Exception as e:
         log.error("Unexpected error occurred while generating keys: %s", e)
         return
@@ -25,39 +25,136 @@
 ###############################################################################
 
 
-from typing import Tuple
+import functools
+import hashlib
+import time
+from typing import Optional, Tuple
 
-from jwcrypto import jwk
-import jwt
+# jwcrypto, jwt and cryptography take most of the start-up time of timewsync, so they are imported by the functions
+# using them. Only generate-key needs jwcrypto.
 
+# Seconds a token is valid for, and seconds before its expiry at which a cached token is replaced
+TOKEN_LIFETIME = 15 * 60
+TOKEN_RENEWAL_MARGIN = 60
 
-def generate_keys() -> Tuple[bytes, bytes]:
+# The parameters for generating the supported key types, by the name used on the command line
+KEY_TYPES = {
+    "rsa": {"kty": "RSA", "size": 4096},
+    "ed25519": {"kty": "OKP", "crv": "Ed25519"},
+    "es256": {"kty": "EC", "crv": "P-256"},
+}
+DEFAULT_KEY_TYPE = "rsa"
+# The JWT signing algorithms matching the supported key types
+ALGORITHMS = ["RS256", "EdDSA", "ES256"]
+
+
+def generate_keys(key_type: str = DEFAULT_KEY_TYPE) -> Tuple[bytes, bytes]:
     """Generates a private / public key pair.
 
-    The keys are generated using the RSA algorithm with a size of 4096.
+    RSA keys have a size of 4096 bits. Ed25519 and ECDSA P-256 keys are much faster to generate
+    and to sign with, but have to be supported by the server.
+
+    Args:
+        key_type: (Optional) The key type, one of KEY_TYPES. Defaults to RSA.
 
     Returns:
         A tuple containing the private key and the public key in PEM format.
+
+    Raises:
+        ValueError: The key type is not supported
     """
-    keys = jwk.JWK.generate(kty="RSA", size=4096)
+    if key_type not in KEY_TYPES:
+        raise ValueError(f"Unsupported key type: {key_type}")
+
+    from jwcrypto import jwk
+
+    keys = jwk.JWK.generate(**KEY_TYPES[key_type])
     priv_pem = keys.export_to_pem(private_key=True, password=None)
     pub_pem = keys.export_to_pem()
 
     return priv_pem, pub_pem
 
 
-def generate_jwt(priv_key: bytes, user_id: int) -> str:
+def generate_jwt(priv_key: bytes, user_id: int, now: Optional[float] = None) -> str:
     """Generates a JWT token, signed with the given private key.
 
+    The token is valid for TOKEN_LIFETIME seconds. The deserialized private key is kept in memory,
+    so further tokens signed with the same key skip parsing it. The signing algorithm matches the
+    type of the key.
+
     Args:
         priv_key: The private key, used to sign the jwt.
         user_id: The id of the user.
+        now: (Optional) The UNIX time the token is issued at. Defaults to the current time.
 
     Returns:
-        A JWT containing the user id. It is signed with the provided private key.
+        A JWT containing the user id and its issue and expiry time. It is signed with the provided private key.
+
+    Raises:
+        ValueError: The key type is not supported
     """
-    payload = {"userID": user_id}
+    import jwt
+
+    issued_at = int(time.time() if now is None else now)
+    payload = {"userID": user_id, "iat": issued_at, "exp": issued_at + TOKEN_LIFETIME}
 
-    token = jwt.encode(payload, priv_key, algorithm="RS256")
+    key = _load_private_key(priv_key)
+    token = jwt.encode(payload, key, algorithm=signing_algorithm(key))
 
     return token
+
+
+def signing_algorithm(key) -> str:
+    """Returns the JWT signing algorithm matching the type of a deserialized private key.
+
+    Raises:
+        ValueError: The key type is not supported
+    """
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+    if isinstance(key, rsa.RSAPrivateKey):
+        return "RS256"
+    if isinstance(key, ed25519.Ed25519PrivateKey):
+        return "EdDSA"
+    if isinstance(key, ec.EllipticCurvePrivateKey) and isinstance(key.curve, ec.SECP256R1):
+        return "ES256"
+    raise ValueError(f"Unsupported key type: {type(key).__name__}")
+
+
+def is_reusable(token: str, user_id: int, now: Optional[float] = None) -> bool:
+    """Checks whether a previously generated token can be sent again.
+
+    The signature is not verified, the token is expected to come from generate_jwt.
+
+    Args:
+        token: The token to check.
+        user_id: The id of the user.
+        now: (Optional) The current UNIX time. Defaults to the current time.
+
+    Returns:
+        Whether the token belongs to the user and stays valid for more than TOKEN_RENEWAL_MARGIN seconds.
+    """
+    import jwt
+
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False})
+    except jwt.InvalidTokenError:
+        return False
+
+    expires_at = claims.get("exp")
+    if claims.get("userID") != user_id or not isinstance(expires_at, int):
+        return False
+    return expires_at - (time.time() if now is None else now) > TOKEN_RENEWAL_MARGIN
+
+
+def key_digest(priv_key: bytes) -> str:
+    """Returns a digest identifying a private key, e.g. to tell whether a token was signed with it."""
+    return hashlib.sha256(priv_key).hexdigest()
+
+
+@functools.lru_cache(maxsize=4)
+def _load_private_key(priv_key: bytes):
+    """Deserializes a private key in PEM format, keeping recently used keys in memory."""
+    from cryptography.hazmat.primitives import serialization
+
+    return serialization.load_pem_private_key(priv_key, password=None)
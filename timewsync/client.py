@@ -0,0 +1,630 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+"""Synchronizes the timewarrior data with the server.
+
+The command line interface in the package's main module imports this module only when
+a sync or a verification runs, as the HTTP and parsing machinery it pulls in is not needed
+for the other commands.
+"""
+
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from timewsync import auth
+from timewsync.config import Configuration
+from timewsync.deadline import Deadline, DeadlineExceededError, OperationCancelledError
+from timewsync.digest import Divergence, MerkleTree, compare_trees
+from timewsync.dispatch import Delta, Dispatcher, ServerError, apply_diff, as_delta, generate_diff, merge_deltas
+from timewsync.failover import FailoverDispatcher
+from timewsync.file_parser import as_interval_list, as_file_strings, extract_tags, get_file_name
+from timewsync.interval import Interval
+from timewsync.replicate import load_replicas, sync_replica, write_replica
+from timewsync.io_handler import (
+    read_data,
+    read_etag,
+    read_keys,
+    read_token,
+    write_data,
+    write_etag,
+    write_snapshot,
+    write_token,
+    delete_snapshot,
+)
+from timewsync.transport import ConnectionFailedError, RequestTimeoutError, TransportError
+
+
+def run_conflict_hook(data_dir: str) -> None:
+    """Run 'conflicts-occurred' file if present.
+
+    Expected in '.timewsync/hooks' directory.
+
+    Args:
+        data_dir: The timewsync data directory.
+
+    Raises:
+        CalledProcessError: Is raised if the hook exits with a non-zero exit code. Holds details about the process.
+    """
+    conflict_hook = os.path.join(data_dir, "hooks", "conflicts-occurred")
+
+    if os.path.exists(conflict_hook):
+        subprocess.run(conflict_hook, check=True)
+
+
+class SyncResult(NamedTuple):
+    """The outcome of a sync.
+
+    Attributes:
+        success: Whether the sync finished. A failed sync leaves the timewarrior data unchanged.
+        added: The number of intervals added locally since the latest sync, sent to the server.
+        removed: The number of intervals removed locally since the latest sync, sent to the server.
+        received: The number of intervals added or removed locally by the changes of the servers.
+        conflict: Whether a server resolved a conflict by merging intervals.
+        restarted: Whether time tracking goes on after the sync, None if it wasn't active.
+        timings: The seconds spent per stage of the sync, by stage name ("read", "token", "exchange", "write", "hook").
+        error: The reason the sync failed, None if it succeeded.
+    """
+
+    success: bool
+    added: int
+    removed: int
+    received: int
+    conflict: bool
+    restarted: Optional[bool]
+    timings: Dict[str, float]
+    error: Optional[str] = None
+
+
+class SyncClient:
+    """Synchronizes the timewarrior data with the server, keeping state between syncs.
+
+    The latest token, the connections to the servers and replicas and the intervals parsed from
+    unchanged files are kept, so repeated syncs from a long-running process skip most of the setup
+    a single sync needs. The client has to be closed to release the connections. The syncs of one client
+    must not run concurrently.
+
+    Attributes:
+        configuration: The user's configuration.
+    """
+
+    def __init__(self, configuration: Configuration):
+        self.configuration: Configuration = configuration
+        self._dispatcher: Optional[FailoverDispatcher] = None
+        self._replica_dispatchers: Dict[str, Dispatcher] = {}
+        self._token: Optional[str] = None
+        self._token_key_digest: Optional[str] = None
+        self._timew_cache: Dict[str, Tuple[str, List[Interval]]] = {}
+        self._snapshot_cache: Dict[str, Tuple[str, List[Interval]]] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        """Close the connections to the servers and replicas and store the servers' health and latency records."""
+        if self._dispatcher is not None:
+            self._dispatcher.close()
+            self._dispatcher = None
+        for replica_dispatcher in self._replica_dispatchers.values():
+            replica_dispatcher.close()
+        self._replica_dispatchers.clear()
+
+    def sync(self, deadline: Deadline = None) -> SyncResult:
+        """Syncs the timewarrior data with the server.
+
+        The authentication token is signed and the connection to the server is opened in the
+        background, while the data is read and parsed.
+
+        Args:
+            deadline: (Optional) The time budget for reading the data and communicating with the server.
+
+        Returns:
+            The outcome of the sync. Failures are logged and described by the result.
+        """
+        if deadline is None:
+            deadline = Deadline()
+        if self._dispatcher is None:
+            self._dispatcher = FailoverDispatcher(self.configuration)
+        for base_url in self.configuration.replica_base_urls:
+            if base_url not in self._replica_dispatchers:
+                self._replica_dispatchers[base_url] = Dispatcher(self.configuration, base_url=base_url)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            pending_token = executor.submit(self._generate_token)
+            connecting = executor.submit(self._dispatcher.connect, deadline)
+            return self._sync(pending_token, connecting, deadline)
+
+    def _generate_token(self) -> Optional[str]:
+        """Returns the token of the previous sync until it nears its expiry, then a new one.
+
+        The private key is read for every sync, so the token isn't reused once the key was replaced.
+        New tokens are signed by the module-level _generate_token(configuration, private_key_pem).
+        """
+        private_key_pem = _read_private_key(self.configuration)
+        if private_key_pem is None:
+            return None
+        digest = auth.key_digest(private_key_pem)
+        if (
+            self._token is not None
+            and self._token_key_digest == digest
+            and auth.is_reusable(self._token, self.configuration.user_id)
+        ):
+            return self._token
+        self._token = _generate_token(self.configuration, private_key_pem)
+        self._token_key_digest = digest
+        return self._token
+
+    def _sync(
+        self, pending_token: "Future[Optional[str]]", connecting: "Future[bool]", deadline: Deadline
+    ) -> SyncResult:
+        """Syncs the timewarrior data with the server, once the token and the connection are ready.
+
+        Args:
+            pending_token: The JSON Web Token being generated, None if no token could be generated.
+            connecting: The connection being opened to the server.
+            deadline: The time budget for reading the data and communicating with the server.
+
+        Returns:
+            The outcome of the sync.
+        """
+        log = logging.getLogger(__name__)
+        configuration = self.configuration
+        dispatcher = self._dispatcher
+
+        timings = {}
+        changes = ([], [])
+        stage_start = time.perf_counter()
+
+        def finish_stage(stage: str) -> None:
+            nonlocal stage_start
+            now = time.perf_counter()
+            timings[stage] = now - stage_start
+            stage_start = now
+
+        def failed(message: str, *args) -> SyncResult:
+            log.error(message, *args)
+            return SyncResult(False, len(changes[0]), len(changes[1]), 0, False, None, timings, message % args)
+
+        # Read data
+        try:
+            log.debug("Reading timew data and snapshot")
+            timew_data, snapshot_data = read_data(configuration.data_dir, configuration.timew_paths.db_data_dir)
+            timew_intervals, active_interval = _parse_files(timew_data, self._timew_cache)
+            snapshot_intervals, _ = _parse_files(snapshot_data, self._snapshot_cache)
+            etag = read_etag(configuration.data_dir)
+            changes = generate_diff(timew_intervals, snapshot_intervals)
+            replicas = load_replicas(configuration, timew_intervals, snapshot_data, snapshot_intervals, changes)
+        except OSError as e:
+            log.debug("OSError: %s", e)
+            return failed("Error reading intervals from disk: No changes were made.")
+        finish_stage("read")
+
+        token = pending_token.result()
+        if token is None:
+            error = "No authentication token could be generated."
+            return SyncResult(False, len(changes[0]), len(changes[1]), 0, False, None, timings, error)
+        finish_stage("token")
+
+        # Active time tracking
+        if active_interval:
+            log.info("Time tracking is active. Stopped time tracking to prevent conflicts.")
+
+        # Record every batch acknowledged by the server, so an interrupted sync resumes where it stopped
+        def on_batch(batch):
+            nonlocal snapshot_intervals
+            snapshot_intervals = apply_diff(snapshot_intervals, batch)
+            log.debug("Server acknowledged %d changes, updating snapshot", sum(map(len, batch)))
+            write_snapshot(configuration.data_dir, as_file_strings(snapshot_intervals)[0])
+
+        # Communicate with server
+        try:
+            log.debug("Sending request to server")
+            deadline.check()
+            connecting.result()
+            # Replicas are synced concurrently with the primary server, sharing the computed diff
+            with ThreadPoolExecutor(max_workers=max(1, len(replicas))) as executor:
+                replica_futures = [
+                    executor.submit(
+                        sync_replica,
+                        configuration,
+                        replica,
+                        timew_intervals,
+                        token,
+                        deadline,
+                        self._replica_dispatchers[replica.base_url],
+                    )
+                    for replica in replicas
+                ]
+                response, conflict_flag = dispatcher.dispatch(
+                    timew_intervals,
+                    snapshot_intervals,
+                    token,
+                    deadline,
+                    on_batch,
+                    accept_delta=True,
+                    etag=etag,
+                    changes=changes,
+                )
+                etag = dispatcher.etag
+        except DeadlineExceededError as e:
+            return failed("Synchronization did not finish within %g seconds. No changes were made.", e.seconds)
+        except ConnectionFailedError as e:
+            log.debug("Connection error: %s", e)
+            return failed("Error connecting to server. No changes were made.")
+        except RequestTimeoutError as e:
+            log.debug("Timeout: %s", e)
+            return failed("Server did not respond in time. No changes were made.")
+        except ServerError as e:
+            if e.status_code == 401:
+                # The server doesn't accept the token, e.g. after the public key was replaced
+                write_token(configuration.data_dir, None)
+                self._token = self._token_key_digest = None
+            log.debug("Error details: %s", e.details)
+            return failed('Server responded with error message "%s". No changes were made.', e.message)
+        except OperationCancelledError:
+            return failed("Synchronization was cancelled. No changes were made.")
+        except Exception as e:
+            log.debug("Unexpected Exception: %s", e)
+            return failed("Unexpected error occurred during communication with server. No changes were made.")
+        finish_stage("exchange")
+
+        # Merge the changes only known to replicas, the primary server receives them with the next sync
+        replica_results = [(replica, future.result()) for replica, future in zip(replicas, replica_futures)]
+        replica_results = [(replica, result) for replica, result in replica_results if result is not None]
+        replica_deltas = [result.delta for _, result in replica_results if result.delta.added or result.delta.removed]
+        conflict_flag = conflict_flag or any(result.conflict for _, result in replica_results)
+        primary_delta = as_delta(response, timew_intervals) if replica_results else None
+        primary_intervals = None
+        if replica_deltas:
+            log.debug("Merging changes from %d replicas", len(replica_deltas))
+            primary_intervals = apply_diff(timew_intervals, (primary_delta.added, primary_delta.removed, []))
+            response = merge_deltas([primary_delta] + replica_deltas)
+
+        # Nothing changed on either side since the latest sync
+        if response is None:
+            log.debug("Server state is unchanged, skipping writing of data")
+            try:
+                for replica, result in replica_results:
+                    write_replica(configuration, replica, timew_intervals, result, primary_delta)
+            except OSError as e:
+                log.debug("OSError: %s", e)
+                return failed(
+                    "Error writing the snapshot of a replica. Its changes will be sent again with the next sync."
+                )
+            finish_stage("write")
+            log.info("Synchronization successful!")
+            # Tracking was stopped in memory only and goes on in the unchanged files
+            restarted = True if active_interval else None
+            return SyncResult(True, len(changes[0]), len(changes[1]), 0, conflict_flag, restarted, timings)
+
+        # Write data
+        received = sum(map(len, as_delta(response, timew_intervals)))
+        try:
+            log.debug("Writing timew data and snapshot")
+            if isinstance(response, Delta):
+                log.debug("Server sent %d added and %d removed intervals", len(response.added), len(response.removed))
+                response_intervals = apply_diff(timew_intervals, (response.added, response.removed, []))
+                changed_files = {get_file_name(interval) for interval in response.added + response.removed}
+            else:
+                response_intervals = response
+                changed_files = None
+            # Tracking was stopped in memory only, the files holding the active interval have to be rewritten
+            if active_interval:
+                changed_files = None
+            server_data, started_tracking = as_file_strings(response_intervals, active_interval)
+            new_tags = extract_tags(response_intervals)
+            write_data(
+                configuration.data_dir, configuration.timew_paths.db_data_dir, server_data, new_tags, changed_files
+            )
+            # The snapshot holds the primary server's state, lacking the changes merged from replicas
+            if primary_intervals is not None:
+                write_snapshot(configuration.data_dir, as_file_strings(primary_intervals)[0])
+            write_etag(configuration.data_dir, etag)
+            for replica, result in replica_results:
+                write_replica(configuration, replica, timew_intervals, result, primary_delta)
+        except IOError as e:
+            delete_snapshot(configuration.data_dir)
+            log.debug("IOError: %s", e)
+            return failed("Error writing data to disk. To ensure consistency, the newly created snapshot was deleted.")
+        except Exception as e:
+            delete_snapshot(configuration.data_dir)
+            log.debug("Unexpected Exception: %s", e)
+            return failed(
+                "Unexpected error occurred during writing of data. "
+                "To ensure consistency, the newly created snapshot was deleted."
+            )
+        finish_stage("write")
+
+        # Run hook if necessary
+        if conflict_flag:
+            try:
+                log.debug("Executing conflict hook")
+                run_conflict_hook(configuration.data_dir)
+            except subprocess.CalledProcessError:
+                log.warning("Hook exited with a non-zero exit code. Continuing...")
+            except OSError as e:
+                log.debug("OSError: %s", e)
+                log.error("Error occurred while executing the conflict-occurred hook. Continuing...")
+            finish_stage("hook")
+
+        # Output
+        if active_interval and started_tracking:
+            log.info("Restarted time tracking from the point it was stopped.")
+
+        log.info("Synchronization successful!")
+
+        if active_interval and not started_tracking:
+            log.warning(
+                "Cannot restart time tracking because there exists a time interval in the future "
+                "which would overlap with the open interval!"
+            )
+
+        restarted = started_tracking if active_interval else None
+        return SyncResult(True, len(changes[0]), len(changes[1]), received, conflict_flag, restarted, timings)
+
+
+def sync(configuration: Configuration, deadline: Deadline = None) -> SyncResult:
+    """Sync's the timewarrior data with the server.
+
+    Args:
+        configuration: The user's configuration.
+        deadline: (Optional) The time budget for reading the data and communicating with the server.
+
+    Returns:
+        The outcome of the sync, see SyncClient.sync.
+    """
+    with SyncClient(configuration) as sync_client:
+        return sync_client.sync(deadline)
+
+
+async def async_sync(
+    configuration: Configuration, deadline: Deadline = None, executor: Optional[Executor] = None
+) -> SyncResult:
+    """Sync's the timewarrior data with the server without blocking the event loop.
+
+    The sync runs in a worker thread of the executor, from reading and parsing the data to
+    writing the server's answer, while the calling task awaits its result. Many syncs, e.g. of
+    several data directories, can run concurrently in one event loop.
+
+    Cancelling the calling task cancels the sync. It stops before sending the next request to the
+    server, with no changes made. Once the server has answered, its answer is still written in
+    the background, so the timewarrior data and the snapshot stay consistent.
+
+    Args:
+        configuration: The user's configuration.
+        deadline: (Optional) The time budget for reading the data and communicating with the server.
+        executor: (Optional) The executor running the sync. Defaults to the event loop's default executor.
+
+    Returns:
+        The outcome of the sync, see SyncClient.sync.
+    """
+    import asyncio
+
+    if deadline is None:
+        deadline = Deadline()
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, sync, configuration, deadline)
+    except asyncio.CancelledError:
+        deadline.cancel()
+        raise
+
+
+def verify(
+    configuration: Configuration, offline: bool = False, deadline: Deadline = None
+) -> Optional[List[Divergence]]:
+    """Compares the timewarrior data with the server's without changing either.
+
+    Merkle trees over the intervals are compared level by level, descending only into the
+    buckets that differ. If the server can't be reached, or if offline is set, the data is
+    compared with the snapshot of the latest sync instead.
+
+    Args:
+        configuration: The user's configuration.
+        offline: (Optional) Whether to compare with the snapshot instead of the server.
+        deadline: (Optional) The time budget for reading the data and communicating with the server.
+
+    Returns:
+        The buckets in which the data differs, or None if the comparison failed.
+    """
+    log = logging.getLogger(__name__)
+
+    if deadline is None:
+        deadline = Deadline()
+
+    try:
+        log.debug("Reading timew data and snapshot")
+        timew_data, snapshot_data = read_data(configuration.data_dir, configuration.timew_paths.db_data_dir)
+        local_tree = MerkleTree(_stored_intervals(timew_data))
+    except OSError as e:
+        log.debug("OSError: %s", e)
+        log.error("Error reading intervals from disk.")
+        return None
+
+    divergences = None
+    if not offline:
+        private_key_pem = _read_private_key(configuration)
+        token = private_key_pem and _generate_token(configuration, private_key_pem)
+        if token is None:
+            return None
+        try:
+            log.debug("Comparing with the server, root digest %s", local_tree.root)
+            with FailoverDispatcher(configuration) as dispatcher:
+                remote_root, _ = dispatcher.tree_digests([], token, deadline)
+                divergences = compare_trees(
+                    local_tree, remote_root, lambda buckets: dispatcher.tree_digests(buckets, token, deadline)[1]
+                )
+            compared_with = "the server"
+        except DeadlineExceededError as e:
+            log.error("Verification did not finish within %g seconds.", e.seconds)
+            return None
+        except TransportError as e:
+            log.debug("Connection error: %s", e)
+            log.warning("Error connecting to server. Comparing with the snapshot of the latest sync instead.")
+        except ServerError as e:
+            if e.status_code == 401:
+                write_token(configuration.data_dir, None)
+            log.debug("Error details: %s", e.details)
+            log.error('Server responded with error message "%s".', e.message)
+            return None
+
+    if divergences is None:
+        log.debug("Comparing with the snapshot of the latest sync")
+        snapshot_tree = MerkleTree(_stored_intervals(snapshot_data))
+        divergences = compare_trees(local_tree, snapshot_tree.root, snapshot_tree.children)
+        compared_with = "the snapshot of the latest sync"
+
+    if not divergences:
+        log.info("The data matches %s.", compared_with)
+        return divergences
+
+    log.warning("The data differs from %s:", compared_with)
+    for divergence in divergences:
+        if divergence.remote is None:
+            log.info("%s: only local", divergence.bucket)
+        elif divergence.local is None:
+            log.info("%s: missing locally", divergence.bucket)
+        else:
+            log.info("%s: intervals differ", divergence.bucket)
+    return divergences
+
+
+def _parse_files(
+    file_strings: Dict[str, str], cache: Dict[str, Tuple[str, List[Interval]]]
+) -> Tuple[List[Interval], Optional[Interval]]:
+    """Converts interval file strings like as_interval_list, reusing the intervals of files parsed before.
+
+    The cache maps file names to their content and intervals. Files holding the currently tracked
+    interval are not cached, as its end is set to the current time when parsing.
+
+    Args:
+        file_strings: A dictionary containing the file names and corresponding file strings.
+        cache: The intervals parsed before, updated in place.
+
+    Returns:
+        A list of Interval objects and a single Interval object, created if time tracking is active.
+    """
+    for file_name in set(cache) - set(file_strings):
+        del cache[file_name]
+
+    intervals = []
+    active_interval = None
+    for file_name, file_str in file_strings.items():
+        cached = cache.get(file_name)
+        if cached is not None and cached[0] == file_str:
+            intervals += cached[1]
+            continue
+        file_intervals, file_active_interval = as_interval_list({file_name: file_str})
+        if file_active_interval is None:
+            cache[file_name] = (file_str, file_intervals)
+        else:
+            active_interval = file_active_interval
+            cache.pop(file_name, None)
+        intervals += file_intervals
+    return intervals, active_interval
+
+
+def _stored_intervals(file_strings: Dict[str, str]) -> List[Interval]:
+    """Converts interval file strings into Interval objects, leaving out the currently tracked interval.
+
+    The tracked interval is closed in memory only, so it can't match any stored interval.
+    """
+    intervals, active_interval = as_interval_list(file_strings)
+    if active_interval:
+        intervals = [interval for interval in intervals if interval.end != active_interval.start]
+    return intervals
+
+
+def _read_private_key(configuration: Configuration) -> Optional[bytes]:
+    """Reads the private key used to sign the JSON Web Tokens.
+
+    Args:
+        configuration: The user's configuration.
+
+    Returns:
+        The private key in PEM format, or None if it could not be read.
+    """
+    log = logging.getLogger(__name__)
+
+    try:
+        log.debug("Reading private key")
+        private_key_pem, _ = read_keys(configuration.data_dir)
+        if private_key_pem is None:
+            log.error("No private key was found. Generate a key pair using `timewsync generate-key`.")
+        return private_key_pem
+    except OSError as e:
+        log.debug("OSError: %s", e)
+        log.error("Error reading private key from disk: No changes were made.")
+        return None
+
+
+def _generate_token(configuration: Configuration, private_key_pem: bytes) -> Optional[str]:
+    """Generates a JSON Web Token for authenticating with the server.
+
+    A cached token signed with the same key is reused until it nears its expiry.
+
+    Args:
+        configuration: The user's configuration.
+        private_key_pem: The private key signing the token.
+
+    Returns:
+        The token, or None if no token could be generated.
+    """
+    log = logging.getLogger(__name__)
+
+    # Reuse cached token
+    digest = auth.key_digest(private_key_pem)
+    try:
+        token, token_key_digest = read_token(configuration.data_dir)
+    except OSError as e:
+        log.debug("Error reading cached token: %s", e)
+        token, token_key_digest = None, None
+    if token is not None and token_key_digest == digest and auth.is_reusable(token, configuration.user_id):
+        log.debug("Reusing cached JSON Web Token")
+        return token
+
+    # Generate token
+    try:
+        log.debug("Generating JSON Web Token")
+        token = auth.generate_jwt(private_key_pem, configuration.user_id)
+    except Exception as e:
+        log.debug("Unexpected Exception: %s", e)
+        log.error("Unexpected error occurred during JWT generation. No changes were made.")
+        return None
+
+    try:
+        write_token(configuration.data_dir, token, digest)
+    except OSError as e:
+        log.debug("Error caching token: %s", e)
+    return token
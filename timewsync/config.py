@@ -28,6 +28,11 @@
 import configparser
 import os
 from pathlib import Path
+import re
+from typing import List, Optional, Union
+
+from timewsync.paths import TimewarriorPaths
+from timewsync.transport import TRANSPORTS, is_available, split_unix_socket
 
 CONFIGURATION_FILE_NAME = "timewsync.conf"
 EXAMPLE_CONFIGURATION = """
@@ -40,11 +45,39 @@ EXAMPLE_CONFIGURATION = """
 
 [Server]
 # The base URL of the server. Required
+# Servers listening on a Unix domain socket are given as unix:///path/to/socket
+# Several equivalent servers may be listed, separated by commas. Each sync
+# goes to the fastest healthy one and fails over to the others
 #BaseURL = http://timew.sync.domain:8080
+#BaseURL = http://a.timew.sync.domain:8080, http://b.timew.sync.domain:8080
+# Servers keeping their own copy of the data, e.g. a backup server, separated
+# by commas. Every sync is sent to them as well. Optional
+#Replicas = http://backup.timew.sync.domain:8080
+# The HTTP library used, "http.client" or "requests". Defaults to the lightest available. Optional
+#Transport = http.client
+# Number of servers to keep connection pools for. Optional
+#PoolConnections = 1
+# Number of connections kept open per server. Optional
+#PoolMaxSize = 4
+# Whether connections are kept open between requests. Optional
+#KeepAlive = yes
+# Seconds to wait for a connection to the server. Optional
+#ConnectTimeout = 10
+# Seconds to wait for data from the server. Optional
+#ReadTimeout = 60
+# Number of retries after connection problems or temporary server errors. Optional
+#Retries = 3
+# Split large syncs into requests per month or year, sent concurrently. Optional
+#ShardBy = month
+# Number of requests sent at the same time when splitting a sync. Optional
+#ParallelRequests = 4
 
 [Client]
 # User id. Required
 #UserID = 1234
+# The directory of the timewarrior database, like the TIMEWARRIORDB environment
+# variable. Defaults to the location timewarrior uses. Optional
+#TimewarriorDB = ~/.timewarrior
 """
 
 
@@ -78,20 +111,77 @@ class MissingConfigurationError(Exception):
         self.name: str = name
 
 
+class InvalidConfigurationError(Exception):
+    """A configuration parameter has a value which is not supported
+
+    Attributes:
+        section: The section in which the configuration is defined
+        name: The name of the configuration parameter
+        value: The unsupported value
+    """
+
+    def __init__(self, section: str, name: str, value: str):
+        self.section: str = section
+        self.name: str = name
+        self.value: str = value
+
+
 class Configuration:
     """Holds all configuration options defined in the timewsync client
     configuration file
 
     Attributes:
         data_dir: The path to the timewsync data directory
-        server_base_url: The base URL (API Endpoint) of the synchronization server
+        server_base_url: The base URL (API Endpoint) of the synchronization server, the first one if several are given
+        server_base_urls: The base URLs of all equivalent synchronization servers
         user_id: The unique ID of the timewsync user
+        pool_connections: The number of servers to keep connection pools for
+        pool_maxsize: The number of connections kept open per server
+        keep_alive: Whether connections are kept open between requests
+        connect_timeout: The number of seconds to wait for a connection to the server
+        read_timeout: The number of seconds to wait for data from the server
+        retries: The number of retries after connection problems or temporary server errors
+        shard_by: The period ("month" or "year") to split syncs by, or None to send them unsplit
+        parallel_requests: The number of requests sent at the same time when splitting a sync
+        transport: The name of the transport sending the requests, or None for the lightest available
+        replica_base_urls: The base URLs of the servers keeping their own copy of the data, synced along
+        timew_paths: The locations of the timewarrior database, resolved from the environment on first access by default
     """
 
-    def __init__(self, data_dir: str, server_base_url: str, user_id: int):
+    def __init__(
+        self,
+        data_dir: str,
+        server_base_url: Union[str, List[str]],
+        user_id: int,
+        pool_connections: int = 1,
+        pool_maxsize: int = 4,
+        keep_alive: bool = True,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 60.0,
+        retries: int = 3,
+        shard_by: Optional[str] = None,
+        parallel_requests: int = 4,
+        transport: Optional[str] = None,
+        replica_base_urls: Optional[List[str]] = None,
+        timew_paths: Optional[TimewarriorPaths] = None,
+    ):
         self.data_dir = data_dir
-        self.server_base_url: str = server_base_url
+        if isinstance(server_base_url, str):
+            server_base_url = [server_base_url]
+        self.server_base_urls: List[str] = list(server_base_url)
+        self.server_base_url: str = self.server_base_urls[0]
         self.user_id: int = user_id
+        self.pool_connections: int = pool_connections
+        self.pool_maxsize: int = pool_maxsize
+        self.keep_alive: bool = keep_alive
+        self.connect_timeout: float = connect_timeout
+        self.read_timeout: float = read_timeout
+        self.retries: int = retries
+        self.shard_by: Optional[str] = shard_by
+        self.parallel_requests: int = parallel_requests
+        self.transport: Optional[str] = transport
+        self.replica_base_urls: List[str] = replica_base_urls or []
+        self.timew_paths: TimewarriorPaths = timew_paths or TimewarriorPaths()
 
     @classmethod
     def read(cls, data_dir: str):
@@ -105,6 +195,7 @@ class Configuration:
             NoConfigurationFileError: The configuration file does not exist
             MissingSectionError: A mandatory section is missing from the configuration file
             MissingConfigurationError: A mandatory variable is missing from the configuration file
+            InvalidConfigurationError: A variable has an unsupported value
         """
         path = os.path.join(data_dir, CONFIGURATION_FILE_NAME)
         if not os.path.isfile(path):
@@ -115,9 +206,31 @@ class Configuration:
 
         if "Server" in config:
             if "BaseURL" in config["Server"]:
-                server_base_url = config.get("Server", "BaseURL")
+                server_base_url = _split_urls(config.get("Server", "BaseURL"))
+                if not server_base_url:
+                    raise MissingConfigurationError("Server", "BaseURL")
             else:
                 raise MissingConfigurationError("Server", "BaseURL")
+            replica_base_urls = _split_urls(config.get("Server", "Replicas", fallback=""))
+            pool_connections = config.getint("Server", "PoolConnections", fallback=1)
+            pool_maxsize = config.getint("Server", "PoolMaxSize", fallback=4)
+            keep_alive = config.getboolean("Server", "KeepAlive", fallback=True)
+            connect_timeout = config.getfloat("Server", "ConnectTimeout", fallback=10.0)
+            read_timeout = config.getfloat("Server", "ReadTimeout", fallback=60.0)
+            retries = config.getint("Server", "Retries", fallback=3)
+            shard_by = config.get("Server", "ShardBy", fallback=None)
+            if shard_by not in (None, "month", "year"):
+                raise InvalidConfigurationError("Server", "ShardBy", shard_by)
+            parallel_requests = config.getint("Server", "ParallelRequests", fallback=4)
+            transport = config.get("Server", "Transport", fallback=None)
+            if transport is not None and not is_available(transport):
+                raise InvalidConfigurationError("Server", "Transport", transport)
+            if (
+                transport is not None
+                and any(split_unix_socket(url)[1] for url in server_base_url + replica_base_urls)
+                and not TRANSPORTS[transport].unix_sockets
+            ):
+                raise InvalidConfigurationError("Server", "Transport", transport)
         else:
             raise MissingSectionError("Server")
 
@@ -126,10 +239,31 @@ class Configuration:
                 user_id = config.getint("Client", "UserID")
             else:
                 raise MissingConfigurationError("Client", "UserID")
+            timewarriordb = config.get("Client", "TimewarriorDB", fallback=None)
         else:
             raise MissingSectionError("Client")
 
-        return cls(data_dir, server_base_url, user_id)
+        return cls(
+            data_dir,
+            server_base_url,
+            user_id,
+            pool_connections,
+            pool_maxsize,
+            keep_alive,
+            connect_timeout,
+            read_timeout,
+            retries,
+            shard_by,
+            parallel_requests,
+            transport,
+            replica_base_urls,
+            TimewarriorPaths(os.path.expanduser(timewarriordb) if timewarriordb else None),
+        )
+
+
+def _split_urls(value: str) -> List[str]:
+    """Splits a list of URLs separated by commas or whitespace."""
+    return [url for url in re.split(r"[,\s]+", value) if url]
 
 
 def create_example_configuration(data_dir: str) -> str:
@@ -0,0 +1,113 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+import threading
+import time
+from typing import Optional
+
+
+class DeadlineExceededError(Exception):
+    """The time budget of an operation has been used up
+
+    Attributes:
+        seconds: The total time budget in seconds
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds: float = seconds
+
+
+class OperationCancelledError(Exception):
+    """The operation has been cancelled before it finished"""
+
+    pass
+
+
+class Deadline:
+    """A time budget for an operation consisting of several steps, e.g. a whole synchronization.
+
+    The operation can also be cancelled from another thread. Its steps then fail on the next check
+    of the deadline, and waits end right away.
+
+    Attributes:
+        seconds: The total time budget in seconds, or None if the time is unlimited
+    """
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.seconds: Optional[float] = seconds
+        self._end: Optional[float] = time.monotonic() + seconds if seconds is not None else None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the operation has been cancelled."""
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        """Cancels the operation, the next check of the deadline raises OperationCancelledError."""
+        self._cancelled.set()
+
+    def remaining(self) -> Optional[float]:
+        """Returns the remaining time in seconds, or None if the time is unlimited."""
+        if self._end is None:
+            return None
+        return max(0.0, self._end - time.monotonic())
+
+    def check(self) -> None:
+        """Raises DeadlineExceededError if no time is left, OperationCancelledError if the operation was cancelled."""
+        if self.cancelled:
+            raise OperationCancelledError()
+        if self.remaining() == 0:
+            raise DeadlineExceededError(self.seconds)
+
+    def timeout(self, timeout: float) -> float:
+        """Limits a timeout to the remaining time.
+
+        Args:
+            timeout: The timeout of a single step in seconds.
+
+        Raises:
+            DeadlineExceededError: No time is left
+            OperationCancelledError: The operation has been cancelled
+        """
+        self.check()
+        remaining = self.remaining()
+        return timeout if remaining is None else min(timeout, remaining)
+
+    def sleep(self, seconds: float) -> None:
+        """Waits for the given time.
+
+        Raises:
+            DeadlineExceededError: The deadline would pass while waiting
+            OperationCancelledError: The operation has been cancelled before or while waiting
+        """
+        self.check()
+        remaining = self.remaining()
+        if remaining is not None and remaining <= seconds:
+            raise DeadlineExceededError(self.seconds)
+        if self._cancelled.wait(seconds):
+            raise OperationCancelledError()
@@ -0,0 +1,203 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+"""Digests identifying a state of the interval data, shared by client and server.
+
+A digest is computed over the canonical form of the intervals: their lines in the
+timewarrior data format, sorted and joined by line breaks. It doesn't depend on the
+order of the intervals or on how they are split into files.
+
+Month digests identify the intervals starting in one month, so client and server can
+tell which parts of the history differ. They are truncated to 128 bits to stay compact.
+
+A Merkle tree groups the intervals into buckets by the year, month and day they start in.
+The digest of a day covers its intervals, the digest of any other bucket covers the digests
+of the buckets it contains. Two trees are compared by descending only into buckets whose
+digests differ, so the cost of a comparison depends on the number of differences.
+"""
+
+import hashlib
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from timewsync.interval import Interval
+
+
+def canonical_lines(intervals: Iterable[Interval]) -> List[str]:
+    """Return the sorted lines of the intervals in the timewarrior data format."""
+    return sorted(map(str, intervals))
+
+
+def month_key(interval: Interval) -> str:
+    """Return the month an interval starts in, in the format YYYY-MM."""
+    return interval.start.strftime("%Y-%m")
+
+
+def state_digest(intervals: Iterable[Interval]) -> str:
+    """Return the digest of a set of intervals.
+
+    Args:
+        intervals: The Interval objects.
+
+    Returns:
+        The hexadecimal SHA-256 digest of the canonical form of the intervals.
+    """
+    return _digest(canonical_lines(intervals))
+
+
+def _digest(lines: List[str]) -> str:
+    """Return the hexadecimal SHA-256 digest of the lines, each terminated by a line break."""
+    digest = hashlib.sha256()
+    for line in lines:
+        digest.update(line.encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def month_digests(intervals: Iterable[Interval]) -> Dict[str, str]:
+    """Return the digests of the intervals per month they start in.
+
+    Args:
+        intervals: The Interval objects.
+
+    Returns:
+        A dictionary containing the months (YYYY-MM) and the hexadecimal digests of their intervals, sorted by month.
+    """
+    months = defaultdict(list)
+    for interval in intervals:
+        months[month_key(interval)].append(interval)
+    return {month: _digest(canonical_lines(months[month]))[:32] for month in sorted(months)}
+
+
+# The root bucket of a Merkle tree, containing the year buckets
+ROOT_BUCKET = ""
+
+# The formats of the bucket names on each level below the root: year, month, day
+BUCKET_FORMATS = ["%Y", "%Y-%m", "%Y-%m-%d"]
+
+
+class MerkleTree:
+    """A Merkle tree over intervals, bucketed by the year, month and day they start in.
+
+    Buckets are named after the period they cover, e.g. "2021", "2021-01" and "2021-01-05".
+    The root bucket is named by the empty string.
+
+    Attributes:
+        root: The digest of the root bucket, covering all intervals.
+    """
+
+    def __init__(self, intervals: Iterable[Interval]):
+        days = defaultdict(list)
+        for interval in intervals:
+            days[interval.start.strftime(BUCKET_FORMATS[-1])].append(interval)
+
+        # Group the buckets of each level by the bucket containing them, from the days up to the root
+        self._children: Dict[str, Dict[str, str]] = {}
+        digests = {day: _digest(canonical_lines(day_intervals)) for day, day_intervals in days.items()}
+        for _ in BUCKET_FORMATS:
+            parents = defaultdict(dict)
+            for bucket in sorted(digests):
+                parents[_parent(bucket)][bucket] = digests[bucket]
+            self._children.update(parents)
+            digests = {parent: _children_digest(children) for parent, children in parents.items()}
+        self.root: str = digests.get(ROOT_BUCKET, _children_digest({}))
+
+    def children(self, buckets: Iterable[str]) -> Dict[str, Dict[str, str]]:
+        """Return the digests of the buckets contained in the given buckets.
+
+        Args:
+            buckets: The names of the buckets.
+
+        Returns:
+            A dictionary containing the given bucket names and the digests of the buckets they contain,
+            by bucket name. Days and unknown buckets contain no buckets.
+        """
+        return {bucket: dict(self._children.get(bucket, {})) for bucket in buckets}
+
+
+class Divergence(NamedTuple):
+    """A bucket in which the intervals of two Merkle trees differ.
+
+    Attributes:
+        bucket: The name of the bucket
+        local: The digest of the bucket in the local tree, or None if it holds no intervals there
+        remote: The digest of the bucket in the remote tree, or None if it holds no intervals there
+    """
+
+    bucket: str
+    local: Optional[str]
+    remote: Optional[str]
+
+
+def compare_trees(
+    local: MerkleTree, remote_root: str, remote_children: Callable[[List[str]], Dict[str, Dict[str, str]]]
+) -> List[Divergence]:
+    """Find the buckets in which a remote Merkle tree differs from a local one.
+
+    Starting at the root, the trees are compared one level at a time, descending only into
+    buckets present in both trees with differing digests. Buckets present in only one of
+    the trees are reported without descending into them.
+
+    Args:
+        local: The local tree.
+        remote_root: The digest of the root bucket of the remote tree.
+        remote_children: Returns the digests of the buckets contained in the given buckets of the remote tree,
+                         like MerkleTree.children. It is called once per level with differing buckets.
+
+    Returns:
+        The differing days and the buckets present in only one of the trees, sorted by name.
+    """
+    divergent = []
+    pending = [ROOT_BUCKET] if local.root != remote_root else []
+    while pending:
+        local_children, remote = local.children(pending), remote_children(pending)
+        pending = []
+        for bucket, ours in local_children.items():
+            theirs = remote.get(bucket, {})
+            for child in sorted(set(ours) | set(theirs)):
+                if ours.get(child) == theirs.get(child):
+                    continue
+                if child in ours and child in theirs and not _is_day(child):
+                    pending.append(child)
+                else:
+                    divergent.append(Divergence(child, ours.get(child), theirs.get(child)))
+    return sorted(divergent)
+
+
+def _parent(bucket: str) -> str:
+    """Return the name of the bucket containing the given one, e.g. "2021-01" for "2021-01-05"."""
+    return bucket.rpartition("-")[0]
+
+
+def _is_day(bucket: str) -> bool:
+    """Return whether a bucket is a day, the lowest level of a Merkle tree."""
+    return bucket.count("-") == len(BUCKET_FORMATS) - 1
+
+
+def _children_digest(children: Dict[str, str]) -> str:
+    """Return the digest of a bucket, covering the names and digests of the buckets it contains."""
+    return _digest([f"{bucket} {digest}" for bucket, digest in sorted(children.items())])
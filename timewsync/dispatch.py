@@ -25,16 +25,83 @@
 ###############################################################################
 
 
-from typing import List, Tuple
+import codecs
+import email.utils
+import functools
+import itertools
+import logging
+import random
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, TypeVar, Union
 from urllib.parse import urljoin
 
-import requests
-
-from timewsync import json_converter
+from timewsync import json_converter, msgpack_converter
 from timewsync.interval import Interval
 from timewsync.config import Configuration
+from timewsync.deadline import Deadline
+from timewsync.digest import month_digests, month_key, state_digest
+from timewsync.transport import (
+    RequestTimeoutError,
+    Response,
+    Transport,
+    TransportError,
+    create_transport,
+    split_unix_socket,
+)
+
+# Relative to the base URL, so a path in it is kept as prefix
+SYNC_ENDPOINT = "api/sync"
+VERIFY_ENDPOINT = "api/verify"
+RESPONSE_CHUNK_SIZE = 64 * 1024
+REQUEST_CHUNK_SIZE = 64 * 1024
+
+JSON_CONTENT_TYPE = "application/json"
+DELTA_CONTENT_TYPE = "application/vnd.timewsync.delta+json"
+MONTHS_CONTENT_TYPE = "application/vnd.timewsync.months+json"
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+# Content encodings supported for request and response bodies, in order of preference
+CONTENT_ENCODINGS = {"gzip": zlib.MAX_WBITS | 16, "deflate": zlib.MAX_WBITS}
+
+# Diffs with at least this many intervals are worth a round trip for negotiating the request format
+NEGOTIATION_THRESHOLD = 100
+# Protocol extension for sending only the changed fields of modified intervals
+MODIFIED_FEATURE = "modified"
+# Diffs with at least this many intervals are streamed, if the server supports it
+STREAMING_THRESHOLD = 1000
+# Request bodies of at least this many bytes are compressed, if the server supports it
+COMPRESSION_THRESHOLD = 1400
+
+# Responses with these status codes indicate temporary problems, the request is retried
+RETRY_STATUS_CODES = {408, 429, 502, 503, 504}
+# Base and maximum of the randomized, exponentially growing delay between retries, in seconds
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+# Diffs larger than the batch size are sent in several requests. The size adapts between these limits
+INITIAL_BATCH_SIZE = 5000
+MIN_BATCH_SIZE = 100
+MAX_BATCH_SIZE = 50000
+# Batches answered within this many seconds are considered fast, the batch size grows
+FAST_RESPONSE_TIME = 2.0
 
-SYNC_ENDPOINT = "/api/sync"
+# A pair of the snapshot version and the current version of a modified interval
+Modification = Tuple[Interval, Interval]
+# The added, removed and modified intervals
+Diff = Tuple[List[Interval], List[Interval], List[Modification]]
+
+# Keys of the periods a diff is split into, when sending shards concurrently
+SHARD_KEYS = {
+    "month": lambda interval: (interval.start.year, interval.start.month),
+    "year": lambda interval: interval.start.year,
+}
+
+T = TypeVar("T")
 
 
 class ServerError(Exception):
@@ -44,45 +111,1013 @@ class ServerError(Exception):
         status_code: HTTP status code reported by the server
         message: Error message sent by server
         details: Additional technical details reported by the server
+        retry_after: The number of seconds the server asked to wait before retrying, if any
     """
 
-    def __init__(self, status_code: int, message: str, details: str):
+    def __init__(self, status_code: int, message: str, details: str, retry_after: float = None):
         self.status_code: int = status_code
         self.message: str = message
         self.details: str = details
+        self.retry_after: Optional[float] = retry_after
+
+
+class Delta(NamedTuple):
+    """The changes of the server's state relative to the client's state after a sync.
+
+    Attributes:
+        added: The intervals the client doesn't have yet
+        removed: The intervals the client has to remove
+    """
+
+    added: List[Interval]
+    removed: List[Interval]
+
+
+class ServerCapabilities:
+    """Optional protocol features supported by the synchronization server
+
+    The server advertises them in response to an OPTIONS request on the sync endpoint.
+    Servers not answering such a request only support the plain JSON protocol.
+
+    Attributes:
+        request_types: The content types accepted as sync request body
+        request_encodings: The content encodings accepted for the sync request body
+        features: Extensions of the sync protocol, e.g. "modified" operations
+    """
+
+    def __init__(
+        self, request_types: List[str] = None, request_encodings: List[str] = None, features: List[str] = None
+    ):
+        if request_types is None:
+            request_types = [JSON_CONTENT_TYPE]
+        if request_encodings is None:
+            request_encodings = []
+        if features is None:
+            features = []
+        self.request_types: List[str] = request_types
+        self.request_encodings: List[str] = request_encodings
+        self.features: List[str] = features
+
+    @property
+    def request_encoding(self) -> Optional[str]:
+        """The preferred content encoding for request bodies, or None if compression isn't supported."""
+        return next((encoding for encoding in CONTENT_ENCODINGS if encoding in self.request_encodings), None)
+
+    @classmethod
+    def probe(cls, request: Callable[..., Response], request_url: str, header: dict):
+        """Asks the server for its capabilities.
+
+        Args:
+            request: The function used for sending the request, called with the method, URL and headers.
+            request_url: The URL of the sync endpoint.
+            header: The headers to send along, including authorization.
+
+        Returns:
+            The capabilities of the server. Defaults are returned if the server doesn't advertise any.
+
+        Raises:
+            ServerError: The server responded with a temporary error
+        """
+        with request("OPTIONS", request_url, headers=header) as server_response:
+            if server_response.status_code in RETRY_STATUS_CODES:
+                raise _server_error(server_response)
+            if server_response.status_code not in (200, 204):
+                return cls()
+
+        return cls(
+            request_types=_split_header(server_response.headers.get("Accept-Put", JSON_CONTENT_TYPE)),
+            request_encodings=_split_header(server_response.headers.get("Accept-Encoding", "")),
+            features=_split_header(server_response.headers.get("Sync-Features", "")),
+        )
+
+
+class Dispatcher:
+    """Sends sync requests to the server, keeping connections open between requests.
+
+    Repeated syncs through the same dispatcher reuse pooled connections and skip the
+    TCP and TLS setup, as well as the negotiation of the server's capabilities.
+    Requests go to the given base URL, or the first configured one.
+
+    Attributes:
+        config: The timewsync configuration.
+        transport: The transport sending the requests and holding the connection pool.
+        batch_size: The maximum number of intervals sent per request, adapted to the server's responses.
+        etag: The version of the server's state sent along with the last sync response, if any.
+        latency: The seconds until the headers of the latest response arrived, None before the first response.
+    """
+
+    def __init__(self, config: Configuration, transport: Transport = None, base_url: str = None):
+        base_url, unix_socket = split_unix_socket(base_url or config.server_base_url)
+        if transport is None:
+            transport = create_transport(
+                config.transport, config.pool_connections, config.pool_maxsize, config.keep_alive, unix_socket
+            )
+        self.config: Configuration = config
+        self.transport: Transport = transport
+        # Ends with a slash, so the endpoints are appended to its path instead of replacing the last segment
+        self._base_url: str = base_url if base_url.endswith("/") else base_url + "/"
+        self._capabilities: Optional[ServerCapabilities] = None
+        self._request_count: int = 0
+        self.batch_size: int = INITIAL_BATCH_SIZE
+        self.etag: Optional[str] = None
+        self.latency: Optional[float] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        """Close all pooled connections."""
+        self.transport.close()
+
+    def connect(self, deadline: Deadline = None) -> bool:
+        """Open a connection to the server ahead of the first request.
+
+        The TCP and TLS handshakes can then run in the background while the caller prepares the
+        request. A failed connection is left for the first request to retry and report.
+
+        Args:
+            deadline: (Optional) The time budget for the whole exchange with the server.
+
+        Returns:
+            Whether the connection was established.
+        """
+        log = logging.getLogger(__name__)
+
+        if deadline is None:
+            deadline = Deadline()
+
+        try:
+            self.transport.connect(self._base_url, deadline.timeout(self.config.connect_timeout))
+        except TransportError as e:
+            log.debug("Connecting ahead of the first request failed: %s", e)
+            return False
+        return True
+
+    def dispatch(
+        self,
+        timew_intervals: List[Interval],
+        snapshot_intervals: List[Interval],
+        auth_token: str,
+        deadline: Deadline = None,
+        on_batch: Callable[[Diff], None] = None,
+        accept_delta: bool = False,
+        etag: str = None,
+        changes: Tuple[List[Interval], List[Interval]] = None,
+    ) -> (Union[List[Interval], Delta, None], bool):
+        """Send a sync request to the server.
+
+        Large diffs are split into batches which are sent one after another. The batch size
+        shrinks when the server rejects a request as too large or doesn't answer in time,
+        and grows again while the server answers quickly. After each acknowledged batch but
+        the last one, on_batch is called with it, so the caller can record the progress.
+
+        Failed attempts caused by connection problems, timeouts or temporary server errors
+        are retried with exponential backoff. All attempts of a batch carry the same
+        idempotency key, so the server applies each batch only once.
+
+        If accept_delta is set, the last request carries the digest of the snapshot with the
+        earlier batches applied. A server which knows this state may answer with the changes
+        relative to the client's state, i.e. the client intervals, instead of all intervals.
+        The last request also carries the digests of the client intervals per month. A server which
+        doesn't know the snapshot's state may answer with the intervals of the months whose digests
+        differ from its own. Such a response is converted into a Delta as well.
+
+        If nothing changed on the client and the etag of the last sync is given, the request is
+        conditional. The server answers "304 Not Modified" without a body if its state is still
+        the same, so the caller can skip parsing and writing. The conditional request leaves out
+        the digests for a Delta, which are only computed and sent if the server's state changed.
+
+        Args:
+            timew_intervals: A list of all client Interval objects.
+            snapshot_intervals: A list of all Interval objects found in the snapshot of the latest sync.
+            auth_token: A JWT used as authentication token.
+            deadline: (Optional) The time budget for the whole exchange with the server.
+            on_batch: (Optional) Called with the added, removed and modified Interval objects
+                      of each acknowledged batch, except for the last one.
+            accept_delta: (Optional) Whether the server may answer with a Delta instead of all intervals.
+            etag: (Optional) The version of the server's state after the latest sync.
+            changes: (Optional) The added and removed Interval objects, if already computed by generate_diff.
+
+        Returns:
+            A list of Interval objects resulting from the sync, or a Delta if accepted and sent by the server,
+            or None if the server's state still matches the etag,
+            and a boolean flag indicating whether a conflict had been resolved.
+
+        Raises:
+            ServerError: The server responded with an error
+            DeadlineExceededError: The deadline passed before the exchange was completed
+        """
+        if deadline is None:
+            deadline = Deadline()
+        self.etag = None
+
+        if changes is None:
+            changes = generate_diff(timew_intervals, snapshot_intervals)
+        added, removed = changes
+
+        request_url = urljoin(self._base_url, SYNC_ENDPOINT)
+        header = {
+            "Authorization": f"Bearer {auth_token}",
+            "Accept": JSON_CONTENT_TYPE,
+            "Accept-Encoding": ", ".join(CONTENT_ENCODINGS),
+        }
+        if msgpack_converter.is_available():
+            header["Accept"] = f"{msgpack_converter.CONTENT_TYPE}, {JSON_CONTENT_TYPE};q=0.9"
+
+        # Only large diffs are worth the extra round trip for negotiating the request format
+        diff_size = len(added) + len(removed)
+        capabilities = self._capabilities or ServerCapabilities()
+        if diff_size >= NEGOTIATION_THRESHOLD and self._capabilities is None:
+            request = functools.partial(self._request, deadline=deadline)
+            try:
+                self._capabilities = capabilities = self._with_retries(
+                    lambda: ServerCapabilities.probe(request, request_url, header), deadline
+                )
+            except ServerError:
+                pass  # The negotiation is optional, retry it with the next sync
+
+        if MODIFIED_FEATURE in capabilities.features:
+            diff = pair_modifications(added, removed)
+        else:
+            diff = added, removed, []
+
+        if self.config.shard_by and diff_size:
+            # The responses of concurrent shards don't identify a single version of the server's state
+            result = self._dispatch_shards(request_url, header, capabilities, diff, deadline, on_batch)
+            self.etag = None
+            return result
+
+        if etag and not diff_size:
+            header["If-None-Match"] = etag
+            if accept_delta:
+                if self._with_retries(lambda: self._not_modified(request_url, header, deadline), deadline):
+                    return None, False
+                del header["If-None-Match"]
+        if not accept_delta:
+            return self._dispatch_diff(request_url, header, capabilities, diff, deadline, on_batch)
+
+        client_months = month_digests(timew_intervals)
+        response, conflict_flag = self._dispatch_diff(
+            request_url,
+            header,
+            capabilities,
+            diff,
+            deadline,
+            on_batch,
+            delta_base=snapshot_intervals,
+            client_months=client_months,
+        )
+        if isinstance(response, dict):
+            response = _months_to_delta(response, timew_intervals)
+        return response, conflict_flag
+
+    def tree_digests(
+        self, buckets: List[str], auth_token: str, deadline: Deadline = None
+    ) -> (str, Dict[str, Dict[str, str]]):
+        """Request digests of the Merkle tree over the intervals stored on the server.
+
+        The request doesn't change the server's state, so it is retried like a sync request.
+
+        Args:
+            buckets: The names of the buckets whose contained buckets are requested, see digest.MerkleTree.
+            auth_token: A JWT used as authentication token.
+            deadline: (Optional) The time budget for the whole exchange with the server.
+
+        Returns:
+            The digest of the server's root bucket and a dictionary containing the requested bucket names
+            and the digests of the buckets they contain, by bucket name.
+
+        Raises:
+            ServerError: The server responded with an error
+            DeadlineExceededError: The deadline passed before the exchange was completed
+        """
+        if deadline is None:
+            deadline = Deadline()
+
+        request_url = urljoin(self._base_url, VERIFY_ENDPOINT)
+        header = {
+            "Authorization": f"Bearer {auth_token}",
+            "Content-Type": JSON_CONTENT_TYPE,
+            "Accept": JSON_CONTENT_TYPE,
+        }
+        request_body = json_converter.to_json_verify_request(self.config.user_id, buckets).encode("utf-8")
+
+        def attempt():
+            with self._request("POST", request_url, deadline, header, request_body) as server_response:
+                if server_response.status_code != 200:
+                    raise _server_error(server_response)
+                return json_converter.from_json_verify_response(server_response.text)
+
+        return self._with_retries(attempt, deadline)
+
+    def _dispatch_shards(
+        self,
+        request_url: str,
+        header: dict,
+        capabilities: ServerCapabilities,
+        diff: Diff,
+        deadline: Deadline,
+        on_batch: Optional[Callable[[Diff], None]],
+    ) -> (List[Interval], bool):
+        """Split the diff by month or year and send the shards concurrently.
+
+        Each response holds the whole state of the server, which may lack the changes of shards
+        still in flight. The result therefore takes the intervals of each shard's period from the
+        response to that shard, and all other intervals from the response to the last shard.
+
+        Returns:
+            A list of Interval objects resulting from the sync
+            and a boolean flag indicating whether a conflict had been resolved.
+        """
+        log = logging.getLogger(__name__)
+
+        shard_key = SHARD_KEYS[self.config.shard_by]
+        shards = _shard_diff(diff, shard_key)
+        workers = max(1, min(self.config.parallel_requests, self.config.pool_maxsize, len(shards)))
+        log.debug("Sending %d shards by %s, %d at a time", len(shards), self.config.shard_by, workers)
+
+        if on_batch:
+            # Every batch is reported, as one shard may fail after others completed
+            lock = threading.Lock()
+
+            def report(batch):
+                with lock:
+                    on_batch(batch)
+
+        else:
+            report = None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                key: executor.submit(
+                    self._dispatch_diff, request_url, header, capabilities, shard, deadline, report, report_last=True
+                )
+                for key, shard in shards.items()
+            }
+            responses = {key: future.result() for key, future in futures.items()}
+
+        last_intervals, _ = responses[list(responses)[-1]]
+        result = [interval for interval in last_intervals if shard_key(interval) not in responses]
+        for key, (response_intervals, _) in responses.items():
+            result += [interval for interval in response_intervals if shard_key(interval) == key]
+        return result, any(conflict_flag for _, conflict_flag in responses.values())
+
+    def _dispatch_diff(
+        self,
+        request_url: str,
+        header: dict,
+        capabilities: ServerCapabilities,
+        diff: Diff,
+        deadline: Deadline,
+        on_batch: Optional[Callable[[Diff], None]],
+        report_last: bool = False,
+        delta_base: Optional[List[Interval]] = None,
+        client_months: Optional[Dict[str, str]] = None,
+    ) -> (Union[List[Interval], Delta, Dict[str, List[Interval]]], bool):
+        """Send the diff in batches, the last response holding the resulting state.
+
+        Args:
+            delta_base: (Optional) The snapshot the diff was generated from, if a Delta is accepted.
+            client_months: (Optional) The digests of the client intervals per month,
+                           if a response limited to the months whose digests differ is accepted.
+
+        Returns:
+            A list of Interval objects resulting from the sync, a Delta, or the intervals of divergent months,
+            and a boolean flag indicating whether a conflict had been resolved.
+        """
+        base_digests = {}
+
+        def base_digest(position: int) -> str:
+            # The state the server computes the delta against, before applying the last batch
+            if position not in base_digests:
+                base_digests[position] = state_digest(apply_diff(delta_base, _slice_diff(diff, 0, position)))
+            return base_digests[position]
+
+        diff_size = _diff_size(diff)
+        position = 0
+        conflict_flag = False
+        pending = {}
+        while True:
+            batch, (parsed_response, batch_conflict_flag) = self._with_retries(
+                lambda: self._send_batch(
+                    request_url,
+                    header,
+                    capabilities,
+                    diff,
+                    position,
+                    pending,
+                    deadline,
+                    base_digest if delta_base is not None else None,
+                    client_months,
+                ),
+                deadline,
+            )
+            conflict_flag = conflict_flag or batch_conflict_flag
+            position += _diff_size(batch)
+            if on_batch and (position < diff_size or report_last):
+                on_batch(batch)
+            if position >= diff_size:
+                return parsed_response, conflict_flag
+
+    def _send_batch(
+        self,
+        request_url: str,
+        header: dict,
+        capabilities: ServerCapabilities,
+        diff: Diff,
+        position: int,
+        pending: Dict[int, Tuple[Diff, str]],
+        deadline: Deadline,
+        base_digest: Optional[Callable[[int], str]] = None,
+        client_months: Optional[Dict[str, str]] = None,
+    ) -> (Diff, Tuple[Union[List[Interval], Delta, Dict[str, List[Interval]]], bool]):
+        """Send the batch of the diff starting at the given position, adapting the batch size.
+
+        Args:
+            request_url: The URL of the sync endpoint.
+            header: The headers to send along, including authorization.
+            capabilities: The capabilities of the server.
+            diff: A Tuple of all added, removed and modified Interval objects.
+            position: The number of intervals of the diff already acknowledged by the server.
+            pending: The batch sent but not acknowledged yet and its idempotency key, by position.
+                     The server may have applied it, so it is sent again unchanged.
+            deadline: The time budget for the whole exchange with the server.
+            base_digest: (Optional) Returns the digest of the base state for a delta at a position.
+                         Only set if a Delta is accepted in response to the last batch.
+            client_months: (Optional) The digests of the client intervals per month, sent with the last batch.
+
+        Returns:
+            The batch sent and the parsed response.
+
+        Raises:
+            ServerError: The server responded with an error
+        """
+        log = logging.getLogger(__name__)
+
+        while True:
+            if position not in pending:
+                pending[position] = _slice_diff(diff, position, self.batch_size), str(uuid.uuid4())
+            batch, key = pending[position]
+            batch_size = _diff_size(batch)
+            batch_header = {**header, "Idempotency-Key": key}
+            last_batch = position + batch_size >= _diff_size(diff)
+            accept = [header["Accept"]]
+            if client_months and last_batch:
+                accept.insert(0, MONTHS_CONTENT_TYPE)
+            if base_digest and last_batch:
+                accept.insert(0, DELTA_CONTENT_TYPE)
+                batch_header["Sync-Base"] = base_digest(position)
+            batch_header["Accept"] = ", ".join(accept)
+            if not last_batch:
+                # Only the response to the last batch is used, the others merely acknowledge their batch
+                batch_header["Prefer"] = "return=minimal"
+
+            start = time.monotonic()
+            try:
+                response = self._send(
+                    request_url,
+                    batch_header,
+                    capabilities,
+                    batch,
+                    deadline,
+                    client_months if last_batch else None,
+                    final=last_batch,
+                )
+            except RequestTimeoutError:
+                # Only later batches are smaller, the server may have applied this one
+                self.batch_size = max(MIN_BATCH_SIZE, batch_size // 2)
+                log.debug("Request timed out, reduced batch size to %d", self.batch_size)
+                raise
+            except ServerError as e:
+                if e.status_code != 413 or batch_size <= MIN_BATCH_SIZE:
+                    raise
+                # The server rejected the batch without applying it, so a smaller one may take its place
+                del pending[position]
+                self.batch_size = max(MIN_BATCH_SIZE, batch_size // 2)
+                log.debug("Request was too large, reduced batch size to %d", self.batch_size)
+                continue
+            del pending[position]
+
+            if batch_size == self.batch_size and time.monotonic() - start < FAST_RESPONSE_TIME:
+                self.batch_size = min(MAX_BATCH_SIZE, self.batch_size * 2)
+            return batch, response
+
+    def _send(
+        self,
+        request_url: str,
+        header: dict,
+        capabilities: ServerCapabilities,
+        diff: Diff,
+        deadline: Deadline,
+        client_months: Optional[Dict[str, str]] = None,
+        final: bool = True,
+    ) -> (Union[List[Interval], Delta, Dict[str, List[Interval]], None], bool):
+        """Encode the diff in the best format supported by the server and exchange it.
+
+        Raises:
+            ServerError: The server responded with an error
+        """
+        diff_size = _diff_size(diff)
+        streaming = diff_size >= STREAMING_THRESHOLD and NDJSON_CONTENT_TYPE in capabilities.request_types
+        if streaming:
+            header["Content-Type"] = NDJSON_CONTENT_TYPE
+            request_body = _coalesce(
+                json_converter.iter_ndjson_request(self.config.user_id, diff, client_months), REQUEST_CHUNK_SIZE
+            )
+        elif msgpack_converter.CONTENT_TYPE in capabilities.request_types and msgpack_converter.is_available():
+            header["Content-Type"] = msgpack_converter.CONTENT_TYPE
+            request_body = msgpack_converter.to_msgpack_request(self.config.user_id, diff, client_months)
+        else:
+            header["Content-Type"] = JSON_CONTENT_TYPE
+            request_body = json_converter.to_json_request(self.config.user_id, diff, client_months).encode("utf-8")
+
+        # Small bodies fit into a single packet anyway
+        encoding = capabilities.request_encoding
+        if encoding and (streaming or len(request_body) >= COMPRESSION_THRESHOLD):
+            header["Content-Encoding"] = encoding
+            if streaming:
+                request_body = _compress(request_body, encoding)
+            else:
+                request_body = b"".join(_compress([request_body], encoding))
+
+        return self._exchange(request_url, request_body, header, deadline, final)
+
+    def _exchange(
+        self, request_url: str, request_body, header: dict, deadline: Deadline, final: bool = True
+    ) -> (Union[List[Interval], Delta, Dict[str, List[Interval]], None], bool):
+        """Send a single sync request and parse the response.
+
+        A conditional request answered with "304 Not Modified", or "412 Precondition Failed"
+        as some servers answer conditional PUT requests, results in None.
+
+        The response to a batch other than the last one only acknowledges it. It results in None
+        and is read only as far as needed for the conflict flag, which servers send ahead of the
+        intervals. The intervals are neither decoded nor, beyond a small rest, received.
+
+        Raises:
+            ServerError: The server responded with an error
+        """
+        with self._request("PUT", request_url, deadline, header, request_body) as server_response:
+            if server_response.status_code in (304, 412) and "If-None-Match" in header:
+                self.etag = server_response.headers.get("ETag", header["If-None-Match"])
+                return None, False
+            if server_response.status_code != 200:
+                raise _server_error(server_response)
+            self.etag = server_response.headers.get("ETag")
+
+            # Parse intervals while the body is still being received
+            response_type = server_response.headers.get("Content-Type", JSON_CONTENT_TYPE).split(";")[0].strip()
+            if not final:
+                if response_type == msgpack_converter.CONTENT_TYPE:
+                    parser = msgpack_converter.ResponseParser(_iter_body(server_response))
+                else:
+                    parser = json_converter.ResponseParser(_iter_text(_iter_body(server_response)))
+                return None, parser.read_conflict_flag()
+            if response_type == DELTA_CONTENT_TYPE:
+                added, removed, conflict_flag = json_converter.from_json_delta_response(
+                    "".join(_iter_text(_iter_body(server_response)))
+                )
+                return Delta(added, removed), conflict_flag
+            if response_type == MONTHS_CONTENT_TYPE:
+                return json_converter.from_json_months_response("".join(_iter_text(_iter_body(server_response))))
+            if response_type == msgpack_converter.CONTENT_TYPE:
+                parser = msgpack_converter.ResponseParser(_iter_body(server_response))
+            else:
+                parser = json_converter.ResponseParser(_iter_text(_iter_body(server_response)))
+            parsed_response = list(parser)
+
+        return parsed_response, parser.conflict_flag
+
+    def _not_modified(self, request_url: str, header: dict, deadline: Deadline) -> bool:
+        """Send an empty conditional sync request and return whether the server's state still matches the etag.
+
+        The request carries no digests, so it stays small. If the state changed, the response
+        is dropped unread and the caller repeats the request with the digests.
+
+        Raises:
+            ServerError: The server responded with an error
+        """
+        header = {**header, "Content-Type": JSON_CONTENT_TYPE}
+        request_body = json_converter.to_json_request(self.config.user_id, ([], [], [])).encode("utf-8")
+        with self._request("PUT", request_url, deadline, header, request_body) as server_response:
+            if server_response.status_code in (304, 412):
+                self.etag = server_response.headers.get("ETag", header["If-None-Match"])
+                return True
+            if server_response.status_code != 200:
+                raise _server_error(server_response)
+        return False
+
+    def _with_retries(self, attempt: Callable[[], T], deadline: Deadline) -> T:
+        """Call the given function, retrying it after temporary failures.
+
+        Between attempts, the dispatcher waits for an exponentially growing, randomized time,
+        or as long as the server asked for using a Retry-After header.
+
+        Args:
+            attempt: The function to be called.
+            deadline: The time budget for all attempts.
+
+        Returns:
+            The result of the first successful attempt.
+
+        Raises:
+            DeadlineExceededError: The deadline passed before an attempt succeeded
+        """
+        log = logging.getLogger(__name__)
+
+        for retry in itertools.count():
+            try:
+                return attempt()
+            except (TransportError, ServerError) as e:
+                retry_after = None
+                if isinstance(e, ServerError):
+                    if e.status_code not in RETRY_STATUS_CODES:
+                        raise
+                    retry_after = e.retry_after
+                if retry >= self.config.retries:
+                    raise
+
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**retry))
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                log.debug("Attempt %d failed (%s), retrying in %.2f s", retry + 1, type(e).__name__, delay)
+                deadline.sleep(delay)
+
+    def _request(self, method: str, url: str, deadline: Deadline, headers: dict, body=None) -> Response:
+        """Send a request using the transport and report its timing in the debug output.
+
+        The connect and read timeouts are limited to the time remaining until the deadline.
+        The time reported spans from sending the request until the response headers arrived,
+        including the connection setup if no pooled connection could be reused.
+        """
+        log = logging.getLogger(__name__)
+
+        timeout = (deadline.timeout(self.config.connect_timeout), deadline.timeout(self.config.read_timeout))
+
+        self._request_count += 1
+        server_response = self.transport.request(method, url, headers, body, timeout)
+        self.latency = server_response.elapsed
+        log.debug(
+            "%s %s (request %d of this session): status %d after %.1f ms",
+            method,
+            url,
+            self._request_count,
+            server_response.status_code,
+            server_response.elapsed * 1000,
+        )
+        return server_response
 
 
 def dispatch(
-    config: Configuration, timew_intervals: List[Interval], snapshot_intervals: List[Interval], auth_token: str
-) -> (List[Interval], bool):
-    """Send a sync request to the server.
+    config: Configuration,
+    timew_intervals: List[Interval],
+    snapshot_intervals: List[Interval],
+    auth_token: str,
+    deadline: Deadline = None,
+    on_batch: Callable[[Diff], None] = None,
+    accept_delta: bool = False,
+) -> (Union[List[Interval], Delta], bool):
+    """Send a sync request to the server, using a new connection.
+
+    Use a Dispatcher for sending multiple requests over pooled connections.
 
     Args:
         config: The timewsync configuration file.
         timew_intervals: A list of all client Interval objects.
         snapshot_intervals: A list of all Interval objects found in the snapshot of the latest sync.
         auth_token: A JWT used as authentication token.
+        deadline: (Optional) The time budget for the whole exchange with the server.
+        on_batch: (Optional) Called with the added, removed and modified Interval objects
+                  of each acknowledged batch, except for the last one.
+        accept_delta: (Optional) Whether the server may answer with a Delta instead of all intervals.
 
     Returns:
-        A list of Interval objects resulting from the sync
+        A list of Interval objects resulting from the sync, or a Delta if accepted and sent by the server,
         and a boolean flag indicating whether a conflict had been resolved.
     """
-    diff = generate_diff(timew_intervals, snapshot_intervals)
+    with Dispatcher(config) as dispatcher:
+        return dispatcher.dispatch(timew_intervals, snapshot_intervals, auth_token, deadline, on_batch, accept_delta)
+
 
-    request_url = urljoin(config.server_base_url, SYNC_ENDPOINT)
-    request_body = json_converter.to_json_request(config.user_id, diff)
+def _server_error(server_response: Response) -> ServerError:
+    """Create a ServerError from an error response.
 
-    header = {"Authorization": f"Bearer {auth_token}"}
+    Error responses not sent by the sync server itself, e.g. by a proxy, are not JSON encoded.
+    For those the reason phrase is used as message and the body as details.
 
-    server_response = requests.put(request_url, request_body, headers=header)
+    Args:
+        server_response: The error response.
 
-    if server_response.status_code != 200:
+    Returns:
+        The ServerError describing the response.
+    """
+    try:
         message, details = json_converter.from_json_error_response(server_response.text)
-        raise ServerError(server_response.status_code, message, details)
+    except (ValueError, KeyError, TypeError):
+        message, details = server_response.reason, server_response.text
+    return ServerError(server_response.status_code, message, details, _parse_retry_after(server_response))
+
+
+def _parse_retry_after(server_response: Response) -> Optional[float]:
+    """Return the number of seconds to wait as specified in the Retry-After header, if present and valid."""
+    value = server_response.headers.get("Retry-After")
+    if value is None:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        retry_date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_date.tzinfo is None:
+        return None
+    return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
+
+
+def _iter_text(chunks: Iterable[bytes]) -> Iterator[str]:
+    """Decode UTF-8 encoded chunks, which may split characters at their boundaries.
+
+    Args:
+        chunks: The encoded chunks.
+
+    Returns:
+        An iterator over the decoded chunks.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def _iter_body(server_response: Response) -> Iterator[bytes]:
+    """Read a streamed response body chunk by chunk.
+
+    Compressed bodies are decompressed and the bytes saved are reported in the debug output.
+
+    Args:
+        server_response: A response whose body has not been consumed yet.
+
+    Returns:
+        An iterator over the chunks of the response body.
+    """
+    log = logging.getLogger(__name__)
+
+    size = 0
+    for chunk in server_response.iter_content(RESPONSE_CHUNK_SIZE):
+        size += len(chunk)
+        yield chunk
+
+    encoding = server_response.headers.get("Content-Encoding")
+    if encoding:
+        compressed_size = server_response.bytes_received
+        log.debug(
+            "Received response body using %s with %d bytes, %d bytes uncompressed (%d bytes saved)",
+            encoding,
+            compressed_size,
+            size,
+            size - compressed_size,
+        )
+
+
+def _coalesce(chunks: Iterable[bytes], size: int) -> Iterator[bytes]:
+    """Join small chunks into chunks of at least the given size.
+
+    Keeps the overhead of chunked transfer encoding low when streaming many short lines.
+
+    Args:
+        chunks: The chunks to be joined.
+        size: The minimum size of each joined chunk, except for the last one.
+
+    Returns:
+        An iterator over the joined chunks.
+    """
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= size:
+            yield b"".join(pending)
+            pending = []
+            pending_size = 0
+    if pending:
+        yield b"".join(pending)
+
+
+def _compress(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """Compress a body chunk by chunk and report the bytes saved in the debug output.
+
+    Args:
+        chunks: The uncompressed chunks.
+        encoding: A content encoding from CONTENT_ENCODINGS.
+
+    Returns:
+        An iterator over the compressed chunks.
+    """
+    log = logging.getLogger(__name__)
+
+    compressor = zlib.compressobj(wbits=CONTENT_ENCODINGS[encoding])
+    size = compressed_size = 0
+    duration = 0.0
+
+    for chunk in chunks:
+        start = time.perf_counter()
+        compressed_chunk = compressor.compress(chunk)
+        duration += time.perf_counter() - start
+        size += len(chunk)
+        if compressed_chunk:
+            compressed_size += len(compressed_chunk)
+            yield compressed_chunk
+
+    start = time.perf_counter()
+    compressed_chunk = compressor.flush()
+    duration += time.perf_counter() - start
+    compressed_size += len(compressed_chunk)
+    yield compressed_chunk
+
+    log.debug(
+        "Compressed request body using %s from %d to %d bytes (%d bytes saved) in %.1f ms",
+        encoding,
+        size,
+        compressed_size,
+        size - compressed_size,
+        duration * 1000,
+    )
+
+
+def _split_header(value: str) -> List[str]:
+    """Split a comma separated header value into its elements, dropping parameters like 'q'."""
+    return [element.split(";")[0].strip() for element in value.split(",") if element.strip()]
+
+
+def apply_diff(intervals: List[Interval], diff: Diff) -> List[Interval]:
+    """Apply a diff to a list of intervals.
+
+    Args:
+        intervals: A list of Interval objects.
+        diff: A Tuple of added, removed and modified Interval objects.
+
+    Returns:
+        A new list of Interval objects without the removed and including the added ones.
+    """
+    added, removed, modified = diff
+    removed_keys = {_key(interval) for interval in removed}
+    removed_keys.update(_key(old) for old, _ in modified)
+    result = [interval for interval in intervals if _key(interval) not in removed_keys]
+    present_keys = {_key(interval) for interval in result}
+    result += [interval for interval in added if _key(interval) not in present_keys]
+    result += [new for _, new in modified if _key(new) not in present_keys]
+    return result
+
+
+def as_delta(response: Union[List[Interval], Delta, None], timew_intervals: List[Interval]) -> Delta:
+    """Convert a sync response into the changes of the server's state relative to the client intervals.
+
+    Args:
+        response: A response returned by Dispatcher.dispatch for the client intervals.
+        timew_intervals: A list of all client Interval objects.
+
+    Returns:
+        The Interval objects added and removed on the server, empty if the server's state matches the client's.
+    """
+    if response is None:
+        return Delta([], [])
+    if isinstance(response, Delta):
+        return response
+    client_keys = {_key(interval) for interval in timew_intervals}
+    server_keys = {_key(interval) for interval in response}
+    return Delta(
+        [interval for interval in response if _key(interval) not in client_keys],
+        [interval for interval in timew_intervals if _key(interval) not in server_keys],
+    )
+
+
+def merge_deltas(deltas: List[Delta]) -> Delta:
+    """Combine the changes of several servers relative to the same client intervals.
+
+    Changes reported by more than one server are contained only once.
+    """
+    added = {_key(interval): interval for delta in deltas for interval in delta.added}
+    removed = {_key(interval): interval for delta in deltas for interval in delta.removed}
+    return Delta(list(added.values()), list(removed.values()))
+
+
+def _key(interval: Interval) -> tuple:
+    """Return a hashable key identifying an Interval object by its contents.
+
+    A missing annotation and an empty one are the same in the timewarrior data format.
+    """
+    return interval.start, interval.end, tuple(interval.tags), interval.annotation or ""
+
+
+def _months_to_delta(months: Dict[str, List[Interval]], timew_intervals: List[Interval]) -> Delta:
+    """Convert a response holding the intervals of divergent months into a Delta.
+
+    Args:
+        months: A dictionary containing the months (YYYY-MM) and all their Interval objects on the server.
+        timew_intervals: A list of all client Interval objects.
+
+    Returns:
+        The changes of the listed months relative to the client intervals.
+    """
+    client_intervals = [interval for interval in timew_intervals if month_key(interval) in months]
+    client_keys = {_key(interval) for interval in client_intervals}
+    server_keys = {_key(interval) for intervals in months.values() for interval in intervals}
+    return Delta(
+        [interval for intervals in months.values() for interval in intervals if _key(interval) not in client_keys],
+        [interval for interval in client_intervals if _key(interval) not in server_keys],
+    )
+
+
+def _diff_size(diff: Diff) -> int:
+    """Return the number of operations in a diff."""
+    return sum(map(len, diff))
+
+
+def _shard_diff(diff: Diff, shard_key: Callable[[Interval], T]) -> Dict[T, Diff]:
+    """Split a diff into shards by the period the intervals start in.
+
+    Modifications moving an interval to another period are split into removal and addition.
+
+    Args:
+        diff: A Tuple of added, removed and modified Interval objects.
+        shard_key: Returns the key of the period an Interval object belongs to.
+
+    Returns:
+        A dictionary containing the added, removed and modified Interval objects per period, sorted by period.
+    """
+    added, removed, modified = diff
+    shards = {}
+    for interval in added:
+        shards.setdefault(shard_key(interval), ([], [], []))[0].append(interval)
+    for interval in removed:
+        shards.setdefault(shard_key(interval), ([], [], []))[1].append(interval)
+    for old, new in modified:
+        if shard_key(old) == shard_key(new):
+            shards.setdefault(shard_key(new), ([], [], []))[2].append((old, new))
+        else:
+            shards.setdefault(shard_key(old), ([], [], []))[1].append(old)
+            shards.setdefault(shard_key(new), ([], [], []))[0].append(new)
+    return dict(sorted(shards.items()))
+
+
+def _slice_diff(diff: Diff, start: int, size: int) -> Diff:
+    """Return a batch of the diff, taking the removed intervals first, then the modified and the added ones.
+
+    Args:
+        diff: A Tuple of added, removed and modified Interval objects.
+        start: The position of the batch, counting removed intervals first.
+        size: The maximum number of intervals in the batch.
+
+    Returns:
+        A Tuple of the added, removed and modified Interval objects in the batch.
+    """
+    added, removed, modified = diff
+    end = start + size
+    offset = len(removed) + len(modified)
+    return (
+        added[max(0, start - offset) : max(0, end - offset)],
+        removed[start:end],
+        modified[max(0, start - len(removed)) : max(0, end - len(removed))],
+    )
+
+
+def pair_modifications(added: List[Interval], removed: List[Interval]) -> Diff:
+    """Pair removed and added intervals which are versions of the same interval.
+
+    Pairs share the same start time, or otherwise the same end time, tags and annotation,
+    i.e. only the start time was moved. Intervals whose key is ambiguous are not paired.
+
+    Args:
+        added: A list of added Interval objects.
+        removed: A list of removed Interval objects.
+
+    Returns:
+        A Tuple of the remaining added and removed Interval objects
+        and a list of pairs of the previous and the current version of modified intervals.
+    """
+    modified = []
+    for key in (lambda i: i.start, lambda i: (i.end, tuple(i.tags), i.annotation)):
+        removed_by_key = _unique_by(removed, key)
+        pairs = [(removed_by_key[k], interval) for k, interval in _unique_by(added, key).items() if k in removed_by_key]
+        if not pairs:
+            continue
+        paired = {id(interval) for pair in pairs for interval in pair}
+        added = [interval for interval in added if id(interval) not in paired]
+        removed = [interval for interval in removed if id(interval) not in paired]
+        modified += pairs
+    return added, removed, modified
 
-    parsed_response, conflict_flag = json_converter.from_json_response(server_response.text)
 
-    return parsed_response, conflict_flag
+def _unique_by(intervals: List[Interval], key: Callable[[Interval], T]) -> Dict[T, Interval]:
+    """Index Interval objects by a key, leaving out keys shared by several of them."""
+    index = {}
+    for interval in intervals:
+        index[key(interval)] = interval if key(interval) not in index else None
+    return {k: interval for k, interval in index.items() if interval is not None}
 
 
 def generate_diff(
@@ -0,0 +1,278 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+import copy
+import logging
+import random
+import time
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar, Union
+
+from timewsync.config import Configuration
+from timewsync.deadline import Deadline
+from timewsync.dispatch import BACKOFF_BASE, BACKOFF_MAX, RETRY_STATUS_CODES, Delta, Diff, Dispatcher, ServerError
+from timewsync.interval import Interval
+from timewsync.io_handler import read_endpoints, write_endpoints
+from timewsync.transport import TransportError
+
+# Seconds a failed server is skipped, doubling with every further failure up to the maximum
+HEALTH_RETRY_AFTER = 30.0
+HEALTH_RETRY_MAX = 3600.0
+# Weight of a new measurement in the moving average of a server's latency
+LATENCY_WEIGHT = 0.3
+# Connection timeout used while other servers are left to fail over to
+FAILOVER_CONNECT_TIMEOUT = 3.0
+
+T = TypeVar("T")
+
+
+class EndpointRecord:
+    """The health and latency of a server, as observed by earlier requests.
+
+    Attributes:
+        latency: The moving average of the seconds until response headers arrived, None if never measured.
+        failures: The number of consecutive failed attempts.
+        failed_at: The UNIX time of the latest failed attempt, None if there was none.
+    """
+
+    def __init__(self, latency: Optional[float] = None, failures: int = 0, failed_at: Optional[float] = None):
+        self.latency: Optional[float] = latency
+        self.failures: int = failures
+        self.failed_at: Optional[float] = failed_at
+
+    @classmethod
+    def from_dict(cls, record: dict):
+        """Creates a record from its stored form, ignoring unknown keys."""
+        return cls(record.get("latency"), record.get("failures", 0), record.get("failedAt"))
+
+    def to_dict(self) -> dict:
+        """Returns the stored form of the record."""
+        return {"latency": self.latency, "failures": self.failures, "failedAt": self.failed_at}
+
+    def healthy(self, now: float) -> bool:
+        """Returns whether the server is worth trying first, i.e. didn't fail recently."""
+        if self.failures == 0 or self.failed_at is None:
+            return True
+        return now - self.failed_at >= min(HEALTH_RETRY_MAX, HEALTH_RETRY_AFTER * 2 ** (self.failures - 1))
+
+    def record_success(self, latency: Optional[float]) -> None:
+        """Marks the server as healthy and updates its latency with a new measurement."""
+        self.failures = 0
+        self.failed_at = None
+        if latency is None:
+            return
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = LATENCY_WEIGHT * latency + (1 - LATENCY_WEIGHT) * self.latency
+
+    def record_failure(self, now: float) -> None:
+        """Marks the server as unhealthy for a time growing with the number of consecutive failures."""
+        self.failures += 1
+        self.failed_at = now
+
+
+def order_endpoints(base_urls: List[str], records: Dict[str, EndpointRecord], now: float) -> List[str]:
+    """Orders servers by the preference of trying them.
+
+    Healthy servers come first, ordered by latency. Servers without a latency measurement are
+    tried before measured ones, so that a newly configured server gets measured once. Ties keep
+    the configured order.
+
+    Args:
+        base_urls: The base URLs of the servers in the configured order.
+        records: The records of the servers by base URL. Servers without a record are unknown.
+        now: The current UNIX time.
+
+    Returns:
+        The base URLs in the order in which the servers should be tried.
+    """
+
+    def preference(index: int):
+        record = records.get(base_urls[index], EndpointRecord())
+        return not record.healthy(now), record.latency or 0.0, index
+
+    return [base_urls[index] for index in sorted(range(len(base_urls)), key=preference)]
+
+
+class FailoverDispatcher:
+    """Sends requests to the fastest healthy one of several equivalent servers.
+
+    Each request first goes to the server which answered fastest before, skipping servers which
+    failed recently. Connection problems, timeouts and temporary server errors immediately move
+    on to the next server, with a short connection timeout. If every server failed, all of them
+    are tried again after a backoff, up to the configured number of retries.
+
+    The health and latency records are read from the data directory and written back on close.
+    With a single configured server, requests behave like those of a Dispatcher and no records
+    are kept.
+
+    Attributes:
+        config: The timewsync configuration.
+        records: The health and latency records of the servers by base URL.
+        dispatcher: The dispatcher of the server which answered the latest request, None before.
+    """
+
+    def __init__(self, config: Configuration):
+        self.config: Configuration = config
+        self.records: Dict[str, EndpointRecord] = {}
+        self.dispatcher: Optional[Dispatcher] = None
+        self._dispatchers: Dict[str, Dispatcher] = {}
+        self._failover: bool = len(config.server_base_urls) > 1
+
+        if self._failover:
+            log = logging.getLogger(__name__)
+            try:
+                records = read_endpoints(config.data_dir)
+            except OSError as e:
+                log.debug("Error reading endpoint records: %s", e)
+                records = {}
+            self.records = {url: EndpointRecord.from_dict(record) for url, record in records.items()}
+
+            # Retries and long connection attempts are left to the failover
+            self._server_config = copy.copy(config)
+            self._server_config.retries = 0
+            self._server_config.connect_timeout = min(config.connect_timeout, FAILOVER_CONNECT_TIMEOUT)
+        else:
+            self._server_config = config
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def etag(self) -> Optional[str]:
+        """The version of the server's state sent along with the last sync response, if any."""
+        return self.dispatcher.etag if self.dispatcher else None
+
+    def close(self) -> None:
+        """Close all pooled connections and store the health and latency records."""
+        for dispatcher in self._dispatchers.values():
+            dispatcher.close()
+
+        if self._failover:
+            log = logging.getLogger(__name__)
+            records = {url: record.to_dict() for url, record in self.records.items()}
+            try:
+                write_endpoints(self.config.data_dir, records)
+            except OSError as e:
+                log.debug("Error writing endpoint records: %s", e)
+
+    def connect(self, deadline: Deadline = None) -> bool:
+        """Open a connection to the server the next request goes to first, see Dispatcher.connect.
+
+        If the connection fails, the server is recorded as failed, so the request goes to the next one.
+        """
+        base_url = order_endpoints(self.config.server_base_urls, self.records, time.time())[0]
+        connected = self._dispatcher(base_url).connect(deadline)
+        if not connected and self._failover:
+            self.records.setdefault(base_url, EndpointRecord()).record_failure(time.time())
+        return connected
+
+    def dispatch(
+        self,
+        timew_intervals: List[Interval],
+        snapshot_intervals: List[Interval],
+        auth_token: str,
+        deadline: Deadline = None,
+        on_batch: Callable[[Diff], None] = None,
+        accept_delta: bool = False,
+        etag: str = None,
+        changes: Tuple[List[Interval], List[Interval]] = None,
+    ) -> (Union[List[Interval], Delta, None], bool):
+        """Send a sync request to the fastest healthy server, see Dispatcher.dispatch.
+
+        If a server fails after acknowledging some batches, the next server receives the whole diff,
+        including the acknowledged changes.
+        """
+        return self._with_failover(
+            lambda dispatcher: dispatcher.dispatch(
+                timew_intervals, snapshot_intervals, auth_token, deadline, on_batch, accept_delta, etag, changes
+            ),
+            deadline,
+        )
+
+    def tree_digests(self, buckets: List[str], auth_token: str, deadline: Deadline = None):
+        """Request digests of the Merkle tree over the intervals stored on the server, see Dispatcher.tree_digests.
+
+        Requests for the root bucket go to the fastest healthy server. Requests for further buckets
+        go to the server which answered the latest request, so all digests describe the same tree.
+        """
+        if buckets and self.dispatcher is not None:
+            return self.dispatcher.tree_digests(buckets, auth_token, deadline)
+        return self._with_failover(lambda dispatcher: dispatcher.tree_digests(buckets, auth_token, deadline), deadline)
+
+    def _with_failover(self, attempt: Callable[[Dispatcher], T], deadline: Optional[Deadline]) -> T:
+        """Call the given function with the dispatchers of the servers in order of preference until it succeeds.
+
+        Args:
+            attempt: The function to be called with a dispatcher.
+            deadline: The time budget for all attempts.
+
+        Returns:
+            The result of the first successful attempt.
+        """
+        log = logging.getLogger(__name__)
+
+        if deadline is None:
+            deadline = Deadline()
+
+        base_urls = self.config.server_base_urls
+        rounds = self.config.retries + 1 if self._failover else 1
+
+        for retry in range(rounds):
+            if retry > 0:
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (retry - 1)))
+                log.debug("All servers failed, retrying in %.2f s", delay)
+                deadline.sleep(delay)
+
+            for base_url in order_endpoints(base_urls, self.records, time.time()):
+                dispatcher = self._dispatcher(base_url)
+                try:
+                    result = attempt(dispatcher)
+                except (TransportError, ServerError) as e:
+                    if isinstance(e, ServerError) and e.status_code not in RETRY_STATUS_CODES:
+                        raise
+                    if not self._failover:
+                        raise
+                    self.records.setdefault(base_url, EndpointRecord()).record_failure(time.time())
+                    log.debug("Server %s failed (%s), failing over", base_url, type(e).__name__)
+                    error = e
+                    continue
+
+                if self._failover:
+                    self.records.setdefault(base_url, EndpointRecord()).record_success(dispatcher.latency)
+                self.dispatcher = dispatcher
+                return result
+
+        raise error
+
+    def _dispatcher(self, base_url: str) -> Dispatcher:
+        """Returns the dispatcher of the given server, creating it on first use."""
+        if base_url not in self._dispatchers:
+            self._dispatchers[base_url] = Dispatcher(self._server_config, base_url=base_url)
+        return self._dispatchers[base_url]
@@ -27,12 +27,14 @@
 
 from __future__ import annotations
 
+import re
 from datetime import datetime
 from typing import List
 
 from timewsync.tokenizer import tokenize
 
 DATETIME_FORMAT = "%Y%m%dT%H%M%SZ"
+DATETIME_REGEX = re.compile(r"(\d{4})(\d\d)(\d\d)T(\d\d)(\d\d)(\d\d)Z", re.ASCII)
 
 
 class Interval:
@@ -80,12 +82,12 @@ class Interval:
 
         # Optional <iso>
         if len(tokens) > 1 and len(tokens[1]) == 16:
-            start = datetime.strptime(tokens[1], DATETIME_FORMAT)
+            start = parse_datetime(tokens[1])
             cursor = 2
 
             # Optional '-' <iso>
             if len(tokens) > 3 and tokens[2] == "-" and len(tokens[3]) == 16:
-                end = datetime.strptime(tokens[3], DATETIME_FORMAT)
+                end = parse_datetime(tokens[3])
                 cursor = 4
 
         # Optional '#'
@@ -133,8 +135,8 @@ class Interval:
             A reference to the new Interval object.
         """
         return cls(
-            start=datetime.strptime(start, DATETIME_FORMAT) if start else None,
-            end=datetime.strptime(end, DATETIME_FORMAT) if end else None,
+            start=parse_datetime(start) if start else None,
+            end=parse_datetime(end) if end else None,
             tags=tags,
             annotation=annotation,
         )
@@ -154,9 +156,9 @@ class Interval:
         """Return the object as a string in timewarrior format."""
         out = "inc"
         if self.start:
-            out += " " + self.start.strftime(DATETIME_FORMAT)
+            out += " " + format_datetime(self.start)
             if self.end:
-                out += " - " + self.end.strftime(DATETIME_FORMAT)
+                out += " - " + format_datetime(self.end)
         if self.tags:
             out += " #"
             for tag in self.tags:
@@ -170,13 +172,48 @@ class Interval:
     def asdict(self) -> dict:
         """Return the object as a dictionary."""
         return {
-            "start": self.start.strftime(DATETIME_FORMAT) if self.start else "",
-            "end": self.end.strftime(DATETIME_FORMAT) if self.end else "",
+            "start": format_datetime(self.start) if self.start else "",
+            "end": format_datetime(self.end) if self.end else "",
             "tags": self.tags,
             "annotation": self.annotation if self.annotation else "",
         }
 
 
+def parse_datetime(string: str) -> datetime:
+    """Parses a date in DATETIME_FORMAT.
+
+    Equivalent to datetime.strptime(string, DATETIME_FORMAT), but several times faster.
+
+    Args:
+        string: The date to be parsed.
+
+    Returns:
+        The parsed date as naive datetime object.
+
+    Raises:
+        ValueError: The date does not match DATETIME_FORMAT
+    """
+    match = DATETIME_REGEX.fullmatch(string)
+    if not match:
+        raise ValueError("time data '%s' does not match format '%s'" % (string, DATETIME_FORMAT))
+    year, month, day, hour, minute, second = match.groups()
+    return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second))
+
+
+def format_datetime(date: datetime) -> str:
+    """Formats a date in DATETIME_FORMAT.
+
+    Equivalent to date.strftime(DATETIME_FORMAT), but several times faster.
+
+    Args:
+        date: The date to be formatted.
+
+    Returns:
+        The formatted date.
+    """
+    return "%04d%02d%02dT%02d%02d%02dZ" % (date.year, date.month, date.day, date.hour, date.minute, date.second)
+
+
 def _strip_double_quotes(string: str) -> str:
     """Removes encapsulating double quotes, if there are some.
 
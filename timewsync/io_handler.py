@@ -25,54 +25,60 @@
 ###############################################################################
 
 
+import io
+import json
 import os
 import re
+import shutil
 import tarfile
+import tempfile
 from pathlib import Path
-from typing import Dict, Tuple, Optional
-
-from timewsync import paths
+from typing import Dict, Optional, Set, Tuple
 
 DATAFILE_REGEX = r"^\d\d\d\d-\d\d\.data$"
 
 
-def read_data(timewsync_data_dir: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+def read_data(timewsync_data_dir: str, db_data_dir: str) -> Tuple[Dict[str, str], Dict[str, str]]:
     """Reads the monthly separated interval data from the timewarrior database and the snapshot.
 
     Args:
         timewsync_data_dir: The timewsync data directory.
+        db_data_dir: The data directory of the timewarrior database.
 
     Returns:
         A Tuple containing two lists of strings, holding the data for current and snapshot time intervals
         respectively, with each string containing the data for one month.
     """
-    return _read_intervals(), _read_snapshot(timewsync_data_dir)
+    return _read_intervals(db_data_dir), read_snapshot(timewsync_data_dir)
 
 
-def _read_intervals() -> Dict[str, str]:
+def _read_intervals(db_data_dir: str) -> Dict[str, str]:
     """Reads the monthly separated interval data from the timewarrior database.
 
     Reads from all files matching 'YYYY-MM.data' and creates a separate list entry per month.
 
+    Args:
+        db_data_dir: The data directory of the timewarrior database.
+
     Returns:
         A list of strings, each of which containing the data for one month.
     """
     monthly_data = {}
 
-    if os.path.exists(paths.DB_DATA_DIR):
+    if os.path.exists(db_data_dir):
 
         # Identify all data sources
-        file_list = [f for f in os.listdir(Path(paths.DB_DATA_DIR)) if (re.fullmatch(DATAFILE_REGEX, f))]
+        file_list = [f for f in os.listdir(Path(db_data_dir)) if (re.fullmatch(DATAFILE_REGEX, f))]
 
         # Read all file contents
         for file_name in file_list:
-            with open(os.path.join(paths.DB_DATA_DIR, file_name), "r") as file:
+            with open(os.path.join(db_data_dir, file_name), "r") as file:
                 monthly_data[file_name] = file.read()
 
     return monthly_data
 
 
-def _read_snapshot(timewsync_data_dir: str) -> Dict[str, str]:
+def read_snapshot(timewsync_data_dir: str) -> Dict[str, str]:
     """Reads the monthly separated interval data from the snapshot.
 
     Args:
@@ -95,6 +101,73 @@ def _read_snapshot(timewsync_data_dir: str) -> Dict[str, str]:
     return snapshot_data
 
 
+def read_etag(timewsync_data_dir: str) -> Optional[str]:
+    """Reads the version of the server's state the snapshot was taken from.
+
+    Args:
+        timewsync_data_dir: The timewsync data directory.
+
+    Returns:
+        The ETag sent by the server along with the snapshot's data, or None if there is none.
+    """
+    etag_path = os.path.join(timewsync_data_dir, "snapshot.etag")
+
+    if not os.path.exists(etag_path):
+        return None
+
+    with open(etag_path, "r") as file:
+        return file.read().strip() or None
+
+
+def read_endpoints(timewsync_data_dir: str) -> Dict[str, dict]:
+    """Reads the health and latency records of the configured servers.
+
+    The records only speed up the choice of a server, so unreadable records are ignored.
+
+    Args:
+        timewsync_data_dir: The timewsync data directory.
+
+    Returns:
+        A dictionary containing the records by base URL, empty if there are none.
+    """
+    endpoints_path = os.path.join(timewsync_data_dir, "endpoints.json")
+
+    if not os.path.exists(endpoints_path):
+        return {}
+
+    with open(endpoints_path, "r") as file:
+        try:
+            records = json.load(file)
+        except ValueError:
+            return {}
+    return records if isinstance(records, dict) else {}
+
+
+def read_token(timewsync_data_dir: str) -> Tuple[Optional[str], Optional[str]]:
+    """Reads the cached authentication token.
+
+    Args:
+        timewsync_data_dir: The timewsync data directory.
+
+    Returns:
+        A tuple containing the token and the digest of the private key it was signed with,
+        or None as both values if no token is cached.
+    """
+    token_path = os.path.join(timewsync_data_dir, "token.json")
+
+    if not os.path.exists(token_path):
+        return None, None
+
+    with open(token_path, "r") as file:
+        try:
+            cached = json.load(file)
+        except ValueError:
+            return None, None
+    if not isinstance(cached, dict):
+        return None, None
+    return cached.get("token"), cached.get("key")
+
+
 def read_keys(timewsync_data_dir: str) -> Tuple[Optional[bytes], Optional[bytes]]:
     """Reads the private and the public key of the user.
 
@@ -122,46 +195,59 @@ def read_keys(timewsync_data_dir: str) -> Tuple[Optional[bytes], Optional[bytes]
     return priv_pem, pub_pem
 
 
-def write_data(timewsync_data_dir: str, monthly_data: Dict[str, str], tags: str):
+def write_data(
+    timewsync_data_dir: str,
+    db_data_dir: str,
+    monthly_data: Dict[str, str],
+    tags: str,
+    changed_files: Optional[Set[str]] = None,
+):
     """Writes the monthly separated data to files in the timewarrior database.
 
     Args:
         timewsync_data_dir: The timewsync data directory.
+        db_data_dir: The data directory of the timewarrior database.
         monthly_data: A dictionary containing the file names and corresponding data for every month.
         tags: A string of tags and how often they have occurred, in the final format.
+        changed_files: (Optional) The names of the only files whose data changed. All files are rewritten if not set.
     """
-    _write_intervals(monthly_data)
-    _write_snapshot(timewsync_data_dir, monthly_data)
-    _write_tags(tags)
+    _write_intervals(db_data_dir, monthly_data, changed_files)
+    _write_snapshot(timewsync_data_dir, db_data_dir, monthly_data)
+    _write_tags(db_data_dir, tags)
 
 
-def _write_intervals(monthly_data: Dict[str, str]):
+def _write_intervals(db_data_dir: str, monthly_data: Dict[str, str], changed_files: Optional[Set[str]] = None):
     """Writes the monthly separated data to files, which are named accordingly.
 
     Args:
+        db_data_dir: The data directory of the timewarrior database.
         monthly_data: A dictionary containing the file names and corresponding data for every month.
+        changed_files: (Optional) The names of the only files to be rewritten or removed.
     """
     # Create data directory if not present
-    os.makedirs(paths.DB_DATA_DIR, exist_ok=True)
+    os.makedirs(db_data_dir, exist_ok=True)
 
     # Remove previous data
-    for file_name in os.listdir(Path(paths.DB_DATA_DIR)):
-        if re.fullmatch(DATAFILE_REGEX, file_name):
-            os.remove(os.path.join(paths.DB_DATA_DIR, file_name))
+    for file_name in os.listdir(Path(db_data_dir)):
+        if re.fullmatch(DATAFILE_REGEX, file_name) and (changed_files is None or file_name in changed_files):
+            os.remove(os.path.join(db_data_dir, file_name))
 
     # Write data to files
     for file_name, data in monthly_data.items():
-        with open(os.path.join(paths.DB_DATA_DIR, file_name), "w") as file:
+        if changed_files is not None and file_name not in changed_files:
+            continue
+        with open(os.path.join(db_data_dir, file_name), "w") as file:
             file.write(data)
 
 
-def _write_snapshot(timewsync_data_dir: str, monthly_data: Dict[str, str]) -> None:
+def _write_snapshot(timewsync_data_dir: str, db_data_dir: str, monthly_data: Dict[str, str]) -> None:
     """Creates a backup of the written files as a tar archive in gz compression.
 
     Takes the file name specified in the timewsync config, defaults to 'snapshot.tgz'.
 
     Args:
         timewsync_data_dir: The timewsync data directory.
+        db_data_dir: The data directory of the timewarrior database the files were written to.
         monthly_data: A dictionary containing the file names and corresponding data for every month.
     """
     # Find timewsync data directory, create if not present
@@ -172,10 +258,70 @@ def _write_snapshot(timewsync_data_dir: str, monthly_data: Dict[str, str]) -> No
     # Write data to files in snapshot
     with tarfile.open(snapshot_path, mode="w:gz") as snapshot:
         for file_name in monthly_data.keys():
-            snapshot.add(os.path.join(paths.DB_DATA_DIR, file_name), arcname=file_name)
+            snapshot.add(os.path.join(db_data_dir, file_name), arcname=file_name)
+
+
+def write_snapshot(timewsync_data_dir: str, monthly_data: Dict[str, str]) -> None:
+    """Replaces the snapshot with the given data, without touching the timewarrior database.
+
+    Used to record the progress of a sync whose changes were only partially sent to the server.
+    The new snapshot is written to a temporary file first, so an interruption never leaves a broken snapshot.
+    The snapshot no longer matches a version of the server's state, so its ETag is removed.
+
+    Args:
+        timewsync_data_dir: The timewsync data directory.
+        monthly_data: A dictionary containing the file names and corresponding data for every month.
+    """
+    os.makedirs(timewsync_data_dir, exist_ok=True)
+
+    snapshot_path = os.path.join(timewsync_data_dir, "snapshot.tgz")
+
+    fd, temp_path = tempfile.mkstemp(dir=timewsync_data_dir, suffix=".tgz")
+    try:
+        with os.fdopen(fd, "wb") as file, tarfile.open(fileobj=file, mode="w:gz") as snapshot:
+            for file_name, data in monthly_data.items():
+                encoded_data = data.encode("utf-8")
+                member = tarfile.TarInfo(file_name)
+                member.size = len(encoded_data)
+                snapshot.addfile(member, io.BytesIO(encoded_data))
+        os.replace(temp_path, snapshot_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    write_etag(timewsync_data_dir, None)
+
+
+def copy_snapshot(source_data_dir: str, target_data_dir: str) -> None:
+    """Replaces the snapshot with a copy of another one, so both hold the exact same file data.
+
+    The copy is written to a temporary file first, like write_snapshot. A missing snapshot is copied as an empty one.
+    The snapshot no longer matches a version of the server's state, so its ETag is removed.
 
+    Args:
+        source_data_dir: The directory holding the snapshot to copy.
+        target_data_dir: The directory whose snapshot is replaced.
+    """
+    source_path = os.path.join(source_data_dir, "snapshot.tgz")
+    if not os.path.exists(source_path):
+        write_snapshot(target_data_dir, {})
+        return
+
+    os.makedirs(target_data_dir, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=target_data_dir, suffix=".tgz")
+    try:
+        with os.fdopen(fd, "wb") as file, open(source_path, "rb") as source:
+            shutil.copyfileobj(source, file)
+        os.replace(temp_path, os.path.join(target_data_dir, "snapshot.tgz"))
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    write_etag(target_data_dir, None)
 
-def _write_tags(tags: str) -> None:
+
+def _write_tags(db_data_dir: str, tags: str) -> None:
     """Overrides tags.data.
 
     Gets one String in the correct format for tags.data and writes it to tags.data.
@@ -183,17 +329,73 @@ def _write_tags(tags: str) -> None:
     tags.data will be created if it has not been there before.
 
     Args:
+        db_data_dir: The data directory of the timewarrior database.
         tags: A string of tags and how often they have occurred, in the final format.
 
     Returns:
         Does not return; just writes into file.
     """
-    os.makedirs(paths.DB_DATA_DIR, exist_ok=True)
+    os.makedirs(db_data_dir, exist_ok=True)
 
-    with open(os.path.join(paths.DB_DATA_DIR, "tags.data"), "w") as file:
+    with open(os.path.join(db_data_dir, "tags.data"), "w") as file:
         file.write(tags)
 
 
+def write_etag(timewsync_data_dir: str, etag: Optional[str]) -> None:
+    """Overrides the version of the server's state the snapshot was taken from.
+
+    Args:
+        timewsync_data_dir: The timewsync data directory.
+        etag: The ETag sent by the server along with the snapshot's data. If None, a previous one is removed.
+    """
+    etag_path = os.path.join(timewsync_data_dir, "snapshot.etag")
+
+    if etag is None:
+        if os.path.isfile(etag_path):
+            os.remove(etag_path)
+        return
+
+    with open(etag_path, "w") as file:
+        file.write(etag)
+
+
+def write_endpoints(timewsync_data_dir: str, records: Dict[str, dict]) -> None:
+    """Overrides the health and latency records of the configured servers.
+
+    Args:
+        timewsync_data_dir: The timewsync data directory.
+        records: A dictionary containing the records by base URL.
+    """
+    endpoints_path = os.path.join(timewsync_data_dir, "endpoints.json")
+
+    with open(endpoints_path, "w") as file:
+        json.dump(records, file, indent=2, sort_keys=True)
+
+
+def write_token(timewsync_data_dir: str, token: Optional[str], key_digest: Optional[str] = None) -> None:
+    """Overrides the cached authentication token.
+
+    The file is only readable by its owner, as the token grants access to the server until it expires.
+
+    Args:
+        timewsync_data_dir: The timewsync data directory.
+        token: The token to cache. If None, a previous one is removed.
+        key_digest: The digest of the private key the token was signed with.
+    """
+    token_path = os.path.join(timewsync_data_dir, "token.json")
+
+    if token is None:
+        if os.path.isfile(token_path):
+            os.remove(token_path)
+        return
+
+    fd = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as file:
+        # The mode only applies to new files, an existing one may have broader permissions
+        os.chmod(token_path, 0o600)
+        json.dump({"token": token, "key": key_digest}, file)
+
+
 def write_keys(timewsync_data_dir: str, priv_pem: bytes, pub_pem: bytes) -> None:
     """Overrides the key files.
 
@@ -223,3 +425,4 @@ def delete_snapshot(timewsync_data_dir: str) -> None:
     # Delete snapshot
     if os.path.isfile(snapshot_path):
         os.remove(snapshot_path)
+    write_etag(timewsync_data_dir, None)
@@ -26,32 +26,158 @@
 
 
 from collections import defaultdict
-from typing import List, Tuple, Dict
+from json.encoder import encode_basestring_ascii
+from typing import List, Optional, Tuple, Dict, Iterable, Iterator
 import json
 
-from timewsync.interval import Interval
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+from timewsync.interval import Interval, format_datetime
 
-def to_json_request(user_id: int, diff: Tuple[List[Interval], List[Interval]]) -> str:
+# Name of the library used for encoding requests and decoding responses
+JSON_BACKEND = "orjson" if orjson else "json"
+
+
+def loads(json_str: str):
+    """Decode a complete JSON document, using orjson if it is installed.
+
+    Args:
+        json_str: The JSON document.
+
+    Returns:
+        The decoded document.
+
+    Raises:
+        ValueError: The document is not valid JSON
+    """
+    if orjson:
+        return orjson.loads(json_str)
+    return json.loads(json_str)
+
+
+def to_json_interval(interval: Interval) -> str:
+    """Write an Interval object directly as JSON object.
+
+    The result is the same as json.dumps(interval.asdict()), without building the dictionary first.
+
+    Args:
+        interval: The Interval object.
+
+    Returns:
+        A JSON string containing the interval.
+    """
+    return '{"start": "%s", "end": "%s", "tags": [%s], "annotation": %s}' % (
+        format_datetime(interval.start) if interval.start else "",
+        format_datetime(interval.end) if interval.end else "",
+        ", ".join(map(encode_basestring_ascii, interval.tags)),
+        encode_basestring_ascii(interval.annotation or ""),
+    )
+
+
+def to_json_request(
+    user_id: int, diff: Tuple[List[Interval], ...], month_digests: Optional[Dict[str, str]] = None
+) -> str:
     """Build and return a JSON string using the diff provided.
 
-    The diff must contain a list of added and a list of removed Interval objects.
+    The diff must contain a list of added and a list of removed Interval objects. It may contain
+    a third list of modified intervals, as pairs of their previous and current version, which is
+    only included if not empty. Servers not supporting the "modified" feature never receive it.
 
     Args:
         user_id: The identification number of the current user.
-        diff: A Tuple of added and removed Interval objects.
+        diff: A Tuple of added, removed and optionally modified Interval objects.
+        month_digests: (Optional) The digests of the client's intervals per month, see digest.month_digests.
 
     Returns:
-        A JSON string containing the user id and lists of added and removed Interval objects.
+        A JSON string containing the user id and lists of added, removed and modified Interval objects.
     """
-    added_dict = [interval.asdict() for interval in diff[0]]
-    removed_dict = [interval.asdict() for interval in diff[1]]
-    json_dict = {
-        "userID": user_id,
-        "added": added_dict,
-        "removed": removed_dict,
-    }
-    return json.dumps(json_dict)
+    if orjson:
+        request = {
+            "userID": user_id,
+            "added": [interval.asdict() for interval in diff[0]],
+            "removed": [interval.asdict() for interval in diff[1]],
+        }
+        modified = diff[2] if len(diff) > 2 else []
+        if modified:
+            request["modified"] = [_modification(old, new) for old, new in modified]
+        if month_digests:
+            request["monthDigests"] = month_digests
+        return orjson.dumps(request).decode("utf-8")
+
+    fields = [
+        '"userID": %s' % json.dumps(user_id),
+        '"added": [%s]' % ", ".join(map(to_json_interval, diff[0])),
+        '"removed": [%s]' % ", ".join(map(to_json_interval, diff[1])),
+    ]
+    modified = diff[2] if len(diff) > 2 else []
+    if modified:
+        fields.append('"modified": [%s]' % ", ".join(to_json_modification(old, new) for old, new in modified))
+    if month_digests:
+        fields.append('"monthDigests": %s' % json.dumps(month_digests))
+    return "{%s}" % ", ".join(fields)
+
+
+def to_json_modification(old: Interval, new: Interval) -> str:
+    """Convert a modification of an interval into a JSON string.
+
+    The previous version is identified by its start and end time. Only the fields
+    which differ in the current version are included.
+
+    Args:
+        old: The previous version of the interval.
+        new: The current version of the interval.
+
+    Returns:
+        A JSON object, e.g. {"start": "20210101T100000Z", "end": "20210101T110000Z", "changes": {"tags": ["foo"]}}
+    """
+    return json.dumps(_modification(old, new))
+
+
+def _modification(old: Interval, new: Interval) -> dict:
+    """Return a modification of an interval as dictionary, see to_json_modification."""
+    old_dict = old.asdict()
+    changes = {field: value for field, value in new.asdict().items() if old_dict[field] != value}
+    return {"start": old_dict["start"], "end": old_dict["end"], "changes": changes}
+
+
+def iter_ndjson_request(
+    user_id: int, diff: Tuple[List[Interval], ...], month_digests: Optional[Dict[str, str]] = None
+) -> Iterator[bytes]:
+    """Generate a newline delimited JSON request from the diff provided, one line at a time.
+
+    The first line holds the user id and the month digests, if any. Every following line holds one interval
+    and the operation ("added" or "removed") applied to it, or a modification
+    ("modified") in the format of to_json_modification.
+
+    Args:
+        user_id: The identification number of the current user.
+        diff: A Tuple of added, removed and optionally modified Interval objects.
+        month_digests: (Optional) The digests of the client's intervals per month, see digest.month_digests.
+
+    Returns:
+        An iterator over the UTF-8 encoded lines of the request.
+    """
+    header = {"userID": user_id}
+    if month_digests:
+        header["monthDigests"] = month_digests
+    if orjson:
+        yield orjson.dumps(header) + b"\n"
+        for op, intervals in (("added", diff[0]), ("removed", diff[1])):
+            for interval in intervals:
+                yield orjson.dumps({"op": op, **interval.asdict()}) + b"\n"
+        for old, new in diff[2] if len(diff) > 2 else []:
+            yield orjson.dumps({"op": "modified", **_modification(old, new)}) + b"\n"
+        return
+
+    yield (json.dumps(header) + "\n").encode("utf-8")
+    for op, intervals in (("added", diff[0]), ("removed", diff[1])):
+        for interval in intervals:
+            yield ('{"op": "%s", %s\n' % (op, to_json_interval(interval)[1:])).encode("utf-8")
+    for old, new in diff[2] if len(diff) > 2 else []:
+        yield ('{"op": "modified", %s\n' % to_json_modification(old, new)[1:]).encode("utf-8")
 
 
 def from_json_response(json_str: str) -> (List[Interval], bool):
@@ -63,12 +189,275 @@ def from_json_response(json_str: str) -> (List[Interval], bool):
     Returns:
         A list of Interval objects and a boolean flag indicating whether a conflict had been resolved.
     """
-    json_dict = json.loads(json_str)
+    json_dict = loads(json_str)
     intervals = [Interval.from_dict(**interval_dict) for interval_dict in json_dict["intervals"]]
     conflict_flag = json_dict["conflictsOccurred"]
     return intervals, conflict_flag
 
 
+def from_json_delta_response(json_str: str) -> (List[Interval], List[Interval], bool):
+    """Extract and return the changes from the given JSON delta response.
+
+    Args:
+        json_str: A JSON string containing lists of added and removed Interval objects.
+
+    Returns:
+        A list of added and a list of removed Interval objects
+        and a boolean flag indicating whether a conflict had been resolved.
+    """
+    json_dict = loads(json_str)
+    added = [Interval.from_dict(**interval_dict) for interval_dict in json_dict["added"]]
+    removed = [Interval.from_dict(**interval_dict) for interval_dict in json_dict["removed"]]
+    return added, removed, json_dict["conflictsOccurred"]
+
+
+def from_json_months_response(json_str: str) -> (Dict[str, List[Interval]], bool):
+    """Extract and return the intervals of the months listed in the given JSON months response.
+
+    Args:
+        json_str: A JSON string containing the intervals of every month whose digest differed.
+
+    Returns:
+        A dictionary containing the months (YYYY-MM) and their Interval objects
+        and a boolean flag indicating whether a conflict had been resolved.
+    """
+    json_dict = loads(json_str)
+    months = {
+        month: [Interval.from_dict(**interval_dict) for interval_dict in intervals]
+        for month, intervals in json_dict["months"].items()
+    }
+    return months, json_dict["conflictsOccurred"]
+
+
+def to_json_verify_request(user_id: int, buckets: List[str]) -> str:
+    """Build and return a JSON string requesting digests of the server's Merkle tree.
+
+    Args:
+        user_id: The identification number of the current user.
+        buckets: The names of the buckets whose contained buckets are requested, see digest.MerkleTree.
+
+    Returns:
+        A JSON string containing the user id and the bucket names.
+    """
+    return json.dumps({"userID": user_id, "buckets": buckets})
+
+
+def from_json_verify_response(json_str: str) -> (str, Dict[str, Dict[str, str]]):
+    """Extract and return the digests of the server's Merkle tree from the given JSON response.
+
+    Args:
+        json_str: A JSON string containing the root digest and the digests contained in the requested buckets.
+
+    Returns:
+        The digest of the root bucket and a dictionary containing the requested bucket names
+        and the digests of the buckets they contain, by bucket name.
+    """
+    json_dict = loads(json_str)
+    return json_dict["root"], json_dict["buckets"]
+
+
+class ResponseParser:
+    """Incrementally parses a JSON sync response while it is being received.
+
+    The response body is consumed chunk by chunk. Interval objects are yielded as soon as
+    they are complete, so neither the whole body nor a dictionary per interval has to be kept
+    in memory at once. With orjson, all intervals complete in the received part of the body
+    are decoded at once.
+
+    Attributes:
+        conflict_flag: Whether a conflict had been resolved. Only known once all intervals have been consumed.
+    """
+
+    def __init__(self, chunks: Iterable[str]):
+        self.conflict_flag: bool = False
+        self._chunks: Iterator[str] = iter(chunks)
+        self._decoder = json.JSONDecoder()
+        self._buffer: str = ""
+        self._pos: int = 0
+        self._exhausted: bool = False
+
+    def __iter__(self) -> Iterator[Interval]:
+        """Yield the Interval objects of the response in the order they are received.
+
+        Raises:
+            ValueError: The response is not a valid sync response
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            self._expect_end()
+            return
+
+        while True:
+            key = self._read_value()
+            self._expect(":")
+
+            if key == "intervals":
+                yield from self._read_intervals()
+            else:
+                value = self._read_value()
+                if key == "conflictsOccurred":
+                    self.conflict_flag = value
+
+            if self._read_char() == "}":
+                self._expect_end()
+                return
+            self._pos -= 1
+            self._expect(",")
+
+    def read_conflict_flag(self) -> bool:
+        """Read the response only as far as the conflict flag, without creating Interval objects.
+
+        Returns:
+            Whether a conflict had been resolved.
+
+        Raises:
+            ValueError: The response is not a valid sync response
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            return False
+
+        while True:
+            key = self._read_value()
+            self._expect(":")
+
+            if key == "conflictsOccurred":
+                self.conflict_flag = self._read_value()
+                return self.conflict_flag
+            if key == "intervals":
+                for _ in self._read_array():
+                    pass
+            else:
+                self._read_value()
+
+            if self._read_char() == "}":
+                return False
+            self._pos -= 1
+            self._expect(",")
+
+    def _read_intervals(self) -> Iterator[Interval]:
+        """Yield the Interval objects of a JSON array one at a time."""
+        if not orjson:
+            for value in self._read_array():
+                yield Interval.from_dict(**value)
+            return
+
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+
+        while True:
+            values = self._read_complete_values()
+            if values is None:
+                # The buffer holds part of a single value only
+                values = [self._read_value()]
+            for value in values:
+                yield Interval.from_dict(**value)
+            if self._read_char() == "]":
+                return
+            self._pos -= 1
+            self._expect(",")
+
+    def _read_complete_values(self) -> Optional[list]:
+        """Decode and consume the values of a JSON array of objects which are complete in the buffer, using orjson.
+
+        Returns:
+            The decoded values, or None if no complete object was found in the buffer.
+        """
+        end = len(self._buffer)
+        while True:
+            end = self._buffer.rfind("}", self._pos, end)
+            if end < 0:
+                return None
+            # An object is followed by the next one or the end of the array. Braces within strings
+            # may be mistaken for the end of an object, the slice then ends within a string and fails to decode.
+            following = self._buffer[end + 1 : end + 65].lstrip(" \t\n\r")[:1]
+            if following in (",", "]"):
+                try:
+                    values = orjson.loads("[%s]" % self._buffer[self._pos : end + 1])
+                except orjson.JSONDecodeError:
+                    return None
+                self._pos = end + 1
+                return values
+
+    def _read_array(self) -> Iterator:
+        """Yield the values of a JSON array one at a time."""
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+
+        while True:
+            yield self._read_value()
+            if self._read_char() == "]":
+                return
+            self._pos -= 1
+            self._expect(",")
+
+    def _fill(self) -> bool:
+        """Append the next chunk to the buffer, discarding everything already consumed.
+
+        Returns:
+            False if there are no more chunks to read.
+        """
+        for chunk in self._chunks:
+            self._buffer = self._buffer[self._pos :] + chunk
+            self._pos = 0
+            return True
+        self._exhausted = True
+        return False
+
+    def _peek(self) -> str:
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in " \t\n\r":
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("unexpected end of sync response")
+
+    def _expect_end(self) -> None:
+        """Consume the rest of the response, which may only contain whitespace."""
+        while True:
+            if self._buffer[self._pos :].strip(" \t\n\r"):
+                raise ValueError("unexpected data after end of sync response")
+            self._pos = len(self._buffer)
+            if not self._fill():
+                return
+
+    def _read_char(self) -> str:
+        """Consume and return the next non-whitespace character."""
+        char = self._peek()
+        self._pos += 1
+        return char
+
+    def _expect(self, char: str) -> None:
+        """Consume the next non-whitespace character, which has to be the one given."""
+        if self._read_char() != char:
+            raise ValueError("expected '%s' at position %d of sync response" % (char, self._pos - 1))
+
+    def _read_value(self):
+        """Decode and consume the next JSON value, reading more chunks until it is complete."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+
+            # A number at the end of the buffer might continue in the next chunk
+            if end == len(self._buffer) and not self._exhausted and self._fill():
+                continue
+
+            self._pos = end
+            return value
+
+
 def to_json_tags(tags: Dict[str, int]) -> str:
     """Converts a dictionary holding tags and occurrences into a single JSON string."""
     file_str = defaultdict(dict)
@@ -87,7 +476,7 @@ def from_json_error_response(json_str: str) -> (str, str):
     Returns:
         A tuple containing the error message and technical details
     """
-    json_dict = json.loads(json_str)
+    json_dict = loads(json_str)
     message = json_dict["message"]
     details = json_dict["details"]
 
@@ -0,0 +1,252 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+
+"""Converts sync requests and responses from and to the MessagePack wire format.
+
+The format is an optional, more compact alternative to JSON, negotiated with the server:
+- Timestamps are sent as integer seconds since the epoch.
+- Every message holds a tag dictionary. Intervals refer to their tags by the index in this dictionary.
+- Intervals are sorted by their start time. Each start time is sent as the difference to the
+  previous one, each end time as the duration of the interval.
+
+Messages are maps, which have to contain the tag dictionary before any intervals:
+    request:  {"userID": int, "tags": [str], "added": [interval], "removed": [interval], "modified": [modification],
+               "monthDigests": {str: str}}
+    response: {"conflictsOccurred": bool, "tags": [str], "intervals": [interval]}
+    interval: [start delta, duration, [tag id], annotation]
+    modification: [previous start, previous end, {changed field: value}]
+
+The "modified" list is only sent to servers supporting it, and only if it is not empty.
+The "monthDigests" map is only sent if the client accepts responses limited to divergent months.
+
+The msgpack package is an optional dependency. If it's not installed, JSON is used.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from timewsync.interval import Interval
+
+CONTENT_TYPE = "application/vnd.msgpack"
+EPOCH = datetime(1970, 1, 1)
+
+
+def is_available() -> bool:
+    """Returns whether the msgpack package is installed."""
+    return msgpack is not None
+
+
+def to_msgpack_request(
+    user_id: int, diff: Tuple[List[Interval], ...], month_digests: Optional[Dict[str, str]] = None
+) -> bytes:
+    """Build and return a MessagePack request using the diff provided.
+
+    Args:
+        user_id: The identification number of the current user.
+        diff: A Tuple of added, removed and optionally modified Interval objects.
+        month_digests: (Optional) The digests of the client's intervals per month, see digest.month_digests.
+
+    Returns:
+        The encoded request, containing the user id and lists of added, removed and modified Interval objects.
+    """
+    tag_ids = {}
+    request = {"userID": user_id, "tags": [], "added": encode_intervals(diff[0], tag_ids)}
+    request["removed"] = encode_intervals(diff[1], tag_ids)
+    modified = diff[2] if len(diff) > 2 else []
+    if modified:
+        request["modified"] = [encode_modification(old, new, tag_ids) for old, new in modified]
+    if month_digests:
+        request["monthDigests"] = month_digests
+    request["tags"] = list(tag_ids)
+    return msgpack.packb(request)
+
+
+def encode_modification(old: Interval, new: Interval, tag_ids: Dict[str, int]) -> list:
+    """Encode a modification of an interval for a MessagePack message.
+
+    Args:
+        old: The previous version of the interval.
+        new: The current version of the interval.
+        tag_ids: The tag dictionary of the message, mapping tags to their ids. New tags are added to it.
+
+    Returns:
+        The start and end time of the previous version in seconds since the epoch, followed by
+        a map of the changed fields. Times are encoded in seconds since the epoch and tags by their ids.
+    """
+    changes = {}
+    if new.start != old.start:
+        changes["start"] = _to_epoch(new.start)
+    if new.end != old.end:
+        changes["end"] = _to_epoch(new.end)
+    if new.tags != old.tags:
+        changes["tags"] = [tag_ids.setdefault(tag, len(tag_ids)) for tag in new.tags]
+    if (new.annotation or "") != (old.annotation or ""):
+        changes["annotation"] = new.annotation or None
+    return [_to_epoch(old.start), _to_epoch(old.end), changes]
+
+
+def to_msgpack_response(intervals: List[Interval], conflict_flag: bool) -> bytes:
+    """Build and return a MessagePack sync response, as the server would send it.
+
+    Args:
+        intervals: A list of Interval objects.
+        conflict_flag: Whether a conflict had been resolved.
+
+    Returns:
+        The encoded response.
+    """
+    tag_ids = {}
+    encoded = encode_intervals(intervals, tag_ids)
+    return msgpack.packb({"conflictsOccurred": conflict_flag, "tags": list(tag_ids), "intervals": encoded})
+
+
+def encode_intervals(intervals: List[Interval], tag_ids: Dict[str, int]) -> List[list]:
+    """Encode Interval objects for a MessagePack message.
+
+    Args:
+        intervals: A list of Interval objects.
+        tag_ids: The tag dictionary of the message, mapping tags to their ids. New tags are added to it.
+
+    Returns:
+        A list of encoded intervals, sorted by start time.
+    """
+    encoded = []
+    previous_start = 0
+    for interval in sorted(intervals, key=lambda i: (i.start is not None, i.start or EPOCH)):
+        start = delta = duration = None
+        if interval.start:
+            start = _to_epoch(interval.start)
+            delta = start - previous_start
+            previous_start = start
+            if interval.end:
+                duration = _to_epoch(interval.end) - start
+        tags = [tag_ids.setdefault(tag, len(tag_ids)) for tag in interval.tags]
+        encoded.append([delta, duration, tags, interval.annotation or None])
+    return encoded
+
+
+def decode_intervals(encoded: Iterable[list], tags: List[str]) -> Iterator[Interval]:
+    """Decode intervals of a MessagePack message into Interval objects.
+
+    Args:
+        encoded: The encoded intervals, in the order they were sent.
+        tags: The tag dictionary of the message.
+
+    Returns:
+        An iterator over the decoded Interval objects.
+    """
+    previous_start = 0
+    for delta, duration, tag_ids, annotation in encoded:
+        start = end = None
+        if delta is not None:
+            previous_start += delta
+            start = EPOCH + timedelta(seconds=previous_start)
+            if duration is not None:
+                end = start + timedelta(seconds=duration)
+        yield Interval(start=start, end=end, tags=[tags[i] for i in tag_ids], annotation=annotation or "")
+
+
+class ResponseParser:
+    """Incrementally parses a MessagePack sync response while it is being received.
+
+    Attributes:
+        conflict_flag: Whether a conflict had been resolved. Only known once all intervals have been consumed.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.conflict_flag: bool = False
+        self._chunks: Iterator[bytes] = iter(chunks)
+        self._unpacker = msgpack.Unpacker(raw=False)
+
+    def __iter__(self) -> Iterator[Interval]:
+        """Yield the Interval objects of the response in the order they are received.
+
+        Raises:
+            ValueError: The response is not a valid sync response
+        """
+        tags = []
+        for _ in range(self._read(self._unpacker.read_map_header)):
+            key = self._read(self._unpacker.unpack)
+            if key == "intervals":
+                count = self._read(self._unpacker.read_array_header)
+                yield from decode_intervals((self._read(self._unpacker.unpack) for _ in range(count)), tags)
+            else:
+                value = self._read(self._unpacker.unpack)
+                if key == "tags":
+                    tags = value
+                elif key == "conflictsOccurred":
+                    self.conflict_flag = value
+
+        for chunk in self._chunks:
+            self._unpacker.feed(chunk)
+        try:
+            self._unpacker.unpack()
+        except msgpack.OutOfData:
+            return
+        raise ValueError("unexpected data after end of sync response")
+
+    def read_conflict_flag(self) -> bool:
+        """Read the response only as far as the conflict flag, without creating Interval objects.
+
+        Returns:
+            Whether a conflict had been resolved.
+
+        Raises:
+            ValueError: The response is not a valid sync response
+        """
+        for _ in range(self._read(self._unpacker.read_map_header)):
+            key = self._read(self._unpacker.unpack)
+            if key == "conflictsOccurred":
+                self.conflict_flag = self._read(self._unpacker.unpack)
+                return self.conflict_flag
+            if key == "intervals":
+                for _ in range(self._read(self._unpacker.read_array_header)):
+                    self._read(self._unpacker.skip)
+            else:
+                self._read(self._unpacker.skip)
+        return False
+
+    def _read(self, read):
+        """Call the given read function of the unpacker, feeding it more chunks until it has enough data."""
+        while True:
+            try:
+                return read()
+            except msgpack.OutOfData:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    raise ValueError("unexpected end of sync response")
+                self._unpacker.feed(chunk)
+
+
+def _to_epoch(timestamp: datetime) -> int:
+    """Return the number of seconds since the epoch for a naive UTC datetime."""
+    return (timestamp - EPOCH) // timedelta(seconds=1)
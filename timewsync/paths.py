@@ -28,7 +28,9 @@
 """Provides file locations of timewarrior data and configuration.
 
 This module follows the same priority order timewarrior uses to provide the correct data and config locations.
-The final locations may be accessed using `paths.CONFIG_FILE`, `paths.DB_DATA_DIR` and `paths.EXTENSIONS_DIR`fields.
+The locations of a database are held by a `TimewarriorPaths` instance, which is passed to the client through the
+configuration. The locations given by the environment of the process may also be accessed using `paths.CONFIG_FILE`,
+`paths.DB_DATA_DIR` and `paths.EXTENSIONS_DIR`fields, which are resolved on first access.
 
 The priority order is as follows:
 1. `TIMEWARRIORDB` environment variable
@@ -41,25 +43,75 @@ https://github.com/GothenburgBitFactory/timewarrior/blob/develop/src/paths.cpp
 """
 
 
+import functools
 import os
 import sys
+from typing import Dict, Mapping, Optional
 
-_timewarriordb = os.getenv("TIMEWARRIORDB")
-_legacy_config_dir = "~/.timewarrior"
-
-_uses_legacy_config = os.path.isdir(os.path.expanduser(_legacy_config_dir))
-_unix_like = any(sys.platform.startswith(os_name) for os_name in {"darwin", "linux", "freebsd"})
-
-# Set config and database locations
-if _timewarriordb:
-    _config_dir = _db_dir = _timewarriordb
-elif _uses_legacy_config or not _unix_like:
-    _config_dir = _db_dir = _legacy_config_dir
-else:
-    _config_dir = os.getenv("XDG_CONFIG_HOME", "~/.config") + "/timewarrior"
-    _db_dir = os.getenv("XDG_DATA_HOME", "~/.local/share") + "/timewarrior"
-
-# Final paths
-CONFIG_FILE = os.path.expanduser(_config_dir + "/timewarrior.cfg")
-DB_DATA_DIR = os.path.expanduser(_db_dir + "/data")
-EXTENSIONS_DIR = os.path.expanduser(_config_dir + "/extensions")
+_LOCATIONS = {"CONFIG_FILE": "config_file", "DB_DATA_DIR": "db_data_dir", "EXTENSIONS_DIR": "extensions_dir"}
+
+
+class TimewarriorPaths:
+    """The locations of one timewarrior database and its configuration.
+
+    The locations are resolved on first access, so creating an instance doesn't touch the file system.
+    Every instance resolves its own locations, which lets one process sync several databases.
+
+    Attributes:
+        timewarriordb: The directory holding the database and its configuration, overriding the environment
+        environ: The environment variables the locations are resolved from, os.environ if None
+    """
+
+    def __init__(self, timewarriordb: Optional[str] = None, environ: Optional[Mapping[str, str]] = None):
+        self.timewarriordb: Optional[str] = timewarriordb
+        self.environ: Optional[Mapping[str, str]] = environ
+
+    @property
+    def config_file(self) -> str:
+        """The timewarrior configuration file."""
+        return self._locations["config_file"]
+
+    @property
+    def db_data_dir(self) -> str:
+        """The directory holding the interval and tag files of the database."""
+        return self._locations["db_data_dir"]
+
+    @property
+    def extensions_dir(self) -> str:
+        """The directory holding the timewarrior extensions."""
+        return self._locations["extensions_dir"]
+
+    @functools.cached_property
+    def _locations(self) -> Dict[str, str]:
+        """Resolves the config and database locations from the environment and the file system."""
+        environ = os.environ if self.environ is None else self.environ
+        timewarriordb = self.timewarriordb or environ.get("TIMEWARRIORDB")
+        legacy_config_dir = "~/.timewarrior"
+
+        uses_legacy_config = os.path.isdir(os.path.expanduser(legacy_config_dir))
+        unix_like = any(sys.platform.startswith(os_name) for os_name in {"darwin", "linux", "freebsd"})
+
+        # Set config and database locations
+        if timewarriordb:
+            config_dir = db_dir = timewarriordb
+        elif uses_legacy_config or not unix_like:
+            config_dir = db_dir = legacy_config_dir
+        else:
+            config_dir = environ.get("XDG_CONFIG_HOME", "~/.config") + "/timewarrior"
+            db_dir = environ.get("XDG_DATA_HOME", "~/.local/share") + "/timewarrior"
+
+        # Final paths
+        return {
+            "config_file": os.path.expanduser(config_dir + "/timewarrior.cfg"),
+            "db_data_dir": os.path.expanduser(db_dir + "/data"),
+            "extensions_dir": os.path.expanduser(config_dir + "/extensions"),
+        }
+
+
+def __getattr__(name):
+    """Resolves the module level locations on first access, from the environment of the process."""
+    if name in _LOCATIONS:
+        default_paths = TimewarriorPaths()
+        globals().update({location: getattr(default_paths, attribute) for location, attribute in _LOCATIONS.items()})
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,220 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+import logging
+import os
+from contextlib import nullcontext
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote
+
+from timewsync.config import Configuration
+from timewsync.deadline import Deadline, DeadlineExceededError
+from timewsync.dispatch import Delta, Dispatcher, ServerError, apply_diff, as_delta, generate_diff
+from timewsync.file_parser import as_file_strings, as_interval_list
+from timewsync.interval import Interval
+from timewsync.io_handler import copy_snapshot, read_etag, read_snapshot, write_etag, write_snapshot
+from timewsync.transport import TransportError
+
+REPLICAS_DIR = "replicas"
+
+
+class Replica:
+    """A server keeping its own copy of the data, synced along with the primary server.
+
+    Attributes:
+        base_url: The base URL of the server.
+        data_dir: The directory holding the snapshot and the ETag of the latest sync with the server.
+        snapshot_intervals: A list of all Interval objects found in the snapshot of the latest sync with the server.
+        changes: The added and removed Interval objects since the latest sync with the server.
+        etag: The version of the server's state after the latest sync, if any.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        data_dir: str,
+        snapshot_intervals: List[Interval],
+        changes: Tuple[List[Interval], List[Interval]],
+        etag: Optional[str] = None,
+    ):
+        self.base_url: str = base_url
+        self.data_dir: str = data_dir
+        self.snapshot_intervals: List[Interval] = snapshot_intervals
+        self.changes: Tuple[List[Interval], List[Interval]] = changes
+        self.etag: Optional[str] = etag
+
+
+class ReplicaResult(NamedTuple):
+    """The outcome of a sync with a replica.
+
+    Attributes:
+        delta: The changes of the replica's state relative to the client intervals.
+        etag: The version of the replica's state sent along with the sync response, if any.
+        conflict: Whether the replica resolved a conflict.
+    """
+
+    delta: Delta
+    etag: Optional[str]
+    conflict: bool
+
+
+def replica_data_dir(timewsync_data_dir: str, base_url: str) -> str:
+    """Returns the directory holding the snapshot of the latest sync with a replica."""
+    return os.path.join(timewsync_data_dir, REPLICAS_DIR, quote(base_url, safe=""))
+
+
+def load_replicas(
+    configuration: Configuration,
+    timew_intervals: List[Interval],
+    snapshot_data: Dict[str, str],
+    snapshot_intervals: List[Interval],
+    changes: Tuple[List[Interval], List[Interval]],
+) -> List[Replica]:
+    """Reads the snapshots of the configured replicas and computes the changes to send them.
+
+    Usually every replica was synced along with the primary server, so its snapshot is a copy
+    of the primary server's snapshot, see write_replica. Such replicas share the already parsed
+    snapshot and computed diff of the primary server, so the data is parsed and diffed only once.
+
+    Args:
+        configuration: The user's configuration.
+        timew_intervals: A list of all client Interval objects.
+        snapshot_data: The monthly data of the primary server's snapshot.
+        snapshot_intervals: A list of all Interval objects found in the primary server's snapshot.
+        changes: The added and removed Interval objects since the latest sync with the primary server.
+
+    Returns:
+        The configured replicas.
+    """
+    replicas = []
+    for base_url in configuration.replica_base_urls:
+        data_dir = replica_data_dir(configuration.data_dir, base_url)
+        replica_snapshot_data = read_snapshot(data_dir)
+        if replica_snapshot_data == snapshot_data:
+            replica = Replica(base_url, data_dir, snapshot_intervals, changes)
+        else:
+            replica_snapshot_intervals, _ = as_interval_list(replica_snapshot_data)
+            replica_changes = generate_diff(timew_intervals, replica_snapshot_intervals)
+            replica = Replica(base_url, data_dir, replica_snapshot_intervals, replica_changes)
+        replica.etag = read_etag(data_dir)
+        replicas.append(replica)
+    return replicas
+
+
+def sync_replica(
+    configuration: Configuration,
+    replica: Replica,
+    timew_intervals: List[Interval],
+    auth_token: str,
+    deadline: Deadline = None,
+    dispatcher: Dispatcher = None,
+) -> Optional[ReplicaResult]:
+    """Sends the changes to a replica, recording every acknowledged batch in the replica's snapshot.
+
+    A failed sync with a replica doesn't affect the sync with the primary server. The replica's
+    snapshot keeps the state of its latest sync, so the next sync sends the changes again.
+
+    Args:
+        configuration: The user's configuration.
+        replica: The replica to be synced.
+        timew_intervals: A list of all client Interval objects.
+        auth_token: A JWT used as authentication token.
+        deadline: (Optional) The time budget for the whole exchange with the replica.
+        dispatcher: (Optional) The dispatcher sending the requests to the replica, which is left open
+            for further syncs. Defaults to a new one closed after the sync.
+
+    Returns:
+        The outcome of the sync, or None if it failed.
+    """
+    log = logging.getLogger(__name__)
+
+    snapshot_intervals = replica.snapshot_intervals
+
+    def on_batch(batch):
+        nonlocal snapshot_intervals
+        snapshot_intervals = apply_diff(snapshot_intervals, batch)
+        write_snapshot(replica.data_dir, as_file_strings(snapshot_intervals)[0])
+
+    try:
+        if dispatcher is None:
+            dispatcher_context = Dispatcher(configuration, base_url=replica.base_url)
+        else:
+            dispatcher_context = nullcontext(dispatcher)
+        with dispatcher_context as dispatcher:
+            response, conflict_flag = dispatcher.dispatch(
+                timew_intervals,
+                replica.snapshot_intervals,
+                auth_token,
+                deadline,
+                on_batch,
+                accept_delta=True,
+                etag=replica.etag,
+                changes=replica.changes,
+            )
+            return ReplicaResult(as_delta(response, timew_intervals), dispatcher.etag, conflict_flag)
+    except DeadlineExceededError as e:
+        log.warning("Synchronization with replica %s did not finish within %g seconds.", replica.base_url, e.seconds)
+    except TransportError as e:
+        log.debug("Connection error: %s", e)
+        log.warning("Error connecting to replica %s.", replica.base_url)
+    except ServerError as e:
+        log.debug("Error details: %s", e.details)
+        log.warning('Replica %s responded with error message "%s".', replica.base_url, e.message)
+    except Exception as e:
+        log.debug("Unexpected Exception: %s", e)
+        log.warning("Unexpected error occurred during communication with replica %s.", replica.base_url)
+    return None
+
+
+def write_replica(
+    configuration: Configuration,
+    replica: Replica,
+    timew_intervals: List[Interval],
+    result: ReplicaResult,
+    primary_delta: Delta,
+) -> None:
+    """Records the replica's state after a sync as its snapshot.
+
+    The client intervals written after the sync include the changes of every server, so the
+    next sync sends each server the changes it is missing.
+
+    A replica whose state matches the primary server's gets a copy of the primary server's
+    snapshot, which has to be written already. The snapshots then hold the same file data,
+    so the next sync finds them equal without parsing the replica's snapshot.
+
+    Args:
+        configuration: The user's configuration.
+        replica: The synced replica.
+        timew_intervals: A list of all client Interval objects sent to the replica.
+        result: The outcome of the sync.
+        primary_delta: The changes of the primary server's state relative to the client intervals.
+    """
+    if result.delta == primary_delta:
+        copy_snapshot(configuration.data_dir, replica.data_dir)
+    else:
+        replica_intervals = apply_diff(timew_intervals, (result.delta.added, result.delta.removed, []))
+        write_snapshot(replica.data_dir, as_file_strings(replica_intervals)[0])
+    write_etag(replica.data_dir, result.etag)
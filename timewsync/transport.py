@@ -0,0 +1,661 @@
+###############################################################################
+#
+# Copyright 2020 - 2021, Jan Bormet, Anna-Felicitas Hausmann, Joachim Schmidt, Vincent Stollenwerk, Arne Turuc
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# https://www.opensource.org/licenses/mit-license.php
+#
+###############################################################################
+
+"""HTTP transports used for communicating with the synchronization server.
+
+A transport sends requests and returns responses whose bodies are read while they are being
+received. All transports raise the same exceptions, so the dispatcher doesn't depend on the
+HTTP library in use:
+
+- HTTPClientTransport uses http.client from the standard library. It is the lightest and
+  chosen by default. It also reaches servers listening on a Unix domain socket. Like requests,
+  it honours the proxies and the CA bundle set in the environment.
+- RequestsTransport uses a requests session. The requests library is only imported once
+  this transport is created.
+- FakeTransport passes requests to a handler in the same process, without any network
+  connection. It is meant for tests.
+"""
+
+import base64
+import http.client
+import importlib.util
+import io
+import os
+import socket
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+from urllib.parse import SplitResult, unquote, urlsplit, urlunsplit
+
+# A request body, either complete or as chunks sent with chunked transfer encoding
+Body = Union[bytes, Iterable[bytes], None]
+# The connect and read timeouts in seconds
+Timeout = Tuple[Optional[float], Optional[float]]
+
+# The maximum number of unread body bytes received before reusing a connection, larger bodies close it
+DRAIN_LIMIT = 64 * 1024
+
+
+class TransportError(Exception):
+    """A request failed because of a network problem"""
+
+    pass
+
+
+class ConnectionFailedError(TransportError):
+    """The connection to the server could not be established or was interrupted"""
+
+    pass
+
+
+class RequestTimeoutError(TransportError):
+    """The server did not accept the connection or send data in time"""
+
+    pass
+
+
+class Response:
+    """A response of the server whose body is read while it is being received.
+
+    Bodies sent with a content encoding are decompressed while reading them.
+    The response has to be closed after use, so its connection can be reused.
+
+    Attributes:
+        status_code: The HTTP status code
+        reason: The reason phrase sent along with the status code
+        headers: The response headers, case-insensitive
+        elapsed: The seconds from sending the request until the response headers arrived
+        bytes_received: The number of body bytes received so far, before decompression
+    """
+
+    def __init__(
+        self,
+        status_code: int,
+        reason: str,
+        headers: Mapping[str, str],
+        read: Callable[[int], bytes],
+        elapsed: float,
+        close: Callable[[], None] = None,
+    ):
+        self.status_code: int = status_code
+        self.reason: str = reason
+        self.headers: Mapping[str, str] = headers
+        self.elapsed: float = elapsed
+        self.bytes_received: int = 0
+        self._read = read
+        self._close = close
+        self._content: Optional[bytes] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        """Release the connection of the response."""
+        if self._close:
+            self._close()
+            self._close = None
+
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        """Read the body chunk by chunk.
+
+        Args:
+            chunk_size: The maximum number of bytes read from the connection at once.
+
+        Returns:
+            An iterator over the decompressed chunks of the body.
+
+        Raises:
+            TransportError: The body could not be received completely
+        """
+        encoding = self.headers.get("Content-Encoding")
+        # Detects both the gzip and the zlib header, as sent for "deflate"
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32) if encoding in ("gzip", "deflate") else None
+        while True:
+            chunk = self._read(chunk_size)
+            if not chunk:
+                break
+            self.bytes_received += len(chunk)
+            if decompressor:
+                chunk = decompressor.decompress(chunk)
+            if chunk:
+                yield chunk
+        if decompressor:
+            rest = decompressor.flush()
+            if rest:
+                yield rest
+
+    @property
+    def content(self) -> bytes:
+        """The complete decompressed body."""
+        if self._content is None:
+            self._content = b"".join(self.iter_content(64 * 1024))
+        return self._content
+
+    @property
+    def text(self) -> str:
+        """The complete body, decoded using the charset of the content type or UTF-8."""
+        content_type = self.headers.get("Content-Type", "")
+        charset = next(
+            (p.split("=", 1)[1].strip() for p in content_type.split(";")[1:] if p.strip().startswith("charset=")),
+            "utf-8",
+        )
+        return self.content.decode(charset, errors="replace")
+
+
+class Transport:
+    """Sends HTTP requests to the server.
+
+    Attributes:
+        name: The name of the transport, as used in the configuration
+        unix_sockets: Whether the transport can reach servers listening on a Unix domain socket
+    """
+
+    name: str = ""
+    unix_sockets: bool = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def request(
+        self, method: str, url: str, headers: Dict[str, str], body: Body = None, timeout: Timeout = (None, None)
+    ) -> Response:
+        """Send a request and return the response as soon as its headers arrived.
+
+        Args:
+            method: The HTTP method.
+            url: The absolute URL.
+            headers: The request headers.
+            body: (Optional) The request body. Iterables are sent with chunked transfer encoding.
+            timeout: (Optional) The seconds to wait for a connection and for data from the server.
+
+        Returns:
+            The response, whose body has not been read yet.
+
+        Raises:
+            ConnectionFailedError: The connection could not be established or was interrupted
+            RequestTimeoutError: The server did not answer in time
+        """
+        raise NotImplementedError
+
+    def connect(self, url: str, timeout: Optional[float] = None) -> None:
+        """Open a connection to the server ahead of the first request and keep it open for it.
+
+        The connection setup can then run while the caller is busy otherwise. Transports which
+        don't manage their connections themselves connect on the first request instead.
+
+        Args:
+            url: An absolute URL on the server.
+            timeout: (Optional) The seconds to wait for the connection.
+
+        Raises:
+            ConnectionFailedError: The connection could not be established
+            RequestTimeoutError: The server did not accept the connection in time
+        """
+        pass
+
+    def close(self) -> None:
+        """Close all connections kept open."""
+        pass
+
+
+class HTTPClientTransport(Transport):
+    """Sends requests using http.client, keeping connections open per server.
+
+    Requests go through the proxies set in the environment, e.g. HTTPS_PROXY, unless NO_PROXY
+    excludes the server. HTTPS requests are tunneled through the proxy. Servers are verified
+    with the CA bundle given by REQUESTS_CA_BUNDLE or CURL_CA_BUNDLE, else with the one of
+    certifi if it is installed, else with the system's certificates, the same way requests does.
+
+    Attributes:
+        pool_connections: The number of servers to keep idle connections for
+        pool_maxsize: The number of idle connections kept open per server
+        keep_alive: Whether connections are kept open between requests
+        unix_socket: The path of the Unix domain socket all requests are sent to, if any
+    """
+
+    name = "http.client"
+    unix_sockets = True
+
+    def __init__(
+        self, pool_connections: int = 1, pool_maxsize: int = 4, keep_alive: bool = True, unix_socket: str = None
+    ):
+        self.pool_connections: int = pool_connections
+        self.pool_maxsize: int = pool_maxsize
+        self.keep_alive: bool = keep_alive
+        self.unix_socket: Optional[str] = unix_socket
+        # The idle connections by server, the server used least recently first
+        self._idle: Dict[Tuple[str, str, int], List[http.client.HTTPConnection]] = OrderedDict()
+        # The proxy by server, None for servers connected to directly
+        self._proxies: Dict[Tuple[str, str, int], Optional[SplitResult]] = {}
+        self._ssl_context = None
+        self._lock = threading.Lock()
+
+    def request(
+        self, method: str, url: str, headers: Dict[str, str], body: Body = None, timeout: Timeout = (None, None)
+    ) -> Response:
+        parts = urlsplit(url)
+        key = self._pool_key(url)
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        headers = dict(headers)
+        proxy = self._proxy(key)
+        if proxy is not None and parts.scheme == "http":
+            # HTTPS requests are tunneled, plain HTTP ones are sent to the proxy with the absolute URL
+            target = urlunsplit((parts.scheme, parts.netloc, parts.path or "/", parts.query, ""))
+            headers.update(_proxy_headers(proxy))
+        if not self.keep_alive:
+            headers["Connection"] = "close"
+        if body is not None and not isinstance(body, bytes):
+            # An empty chunk would end the chunked body early
+            body = (chunk for chunk in body if chunk)
+
+        connection, reused = self._acquire(key)
+        start = time.monotonic()
+        try:
+            try:
+                server_response = self._send(connection, method, target, headers, body, timeout)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server may have closed an idle connection, which is only noticed when reusing it
+                if not reused or not (body is None or isinstance(body, bytes)):
+                    raise
+                connection.close()
+                connection = self._new_connection(key)
+                server_response = self._send(connection, method, target, headers, body, timeout)
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise _transport_error(e) from e
+        except BaseException:
+            connection.close()
+            raise
+        elapsed = time.monotonic() - start
+
+        def read(size: int) -> bytes:
+            try:
+                return server_response.read1(size)
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                raise _transport_error(e) from e
+
+        def close() -> None:
+            if self.keep_alive and not server_response.will_close and _drain(server_response):
+                self._release(key, connection)
+            else:
+                server_response.close()
+                connection.close()
+
+        return Response(server_response.status, server_response.reason, server_response.headers, read, elapsed, close)
+
+    def connect(self, url: str, timeout: Optional[float] = None) -> None:
+        key = self._pool_key(url)
+        with self._lock:
+            if self._idle.get(key):
+                return
+
+        connection = self._new_connection(key)
+        try:
+            self._connect(connection, timeout)
+        except OSError as e:
+            connection.close()
+            raise _transport_error(e) from e
+        self._release(key, connection)
+
+    def close(self) -> None:
+        with self._lock:
+            connections = [connection for idle in self._idle.values() for connection in idle]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
+
+    @staticmethod
+    def _send(
+        connection: http.client.HTTPConnection, method: str, target: str, headers: dict, body: Body, timeout: Timeout
+    ) -> http.client.HTTPResponse:
+        """Send a request over the connection, connecting first if necessary, and wait for the response."""
+        connect_timeout, read_timeout = timeout
+        if connection.sock is None:
+            HTTPClientTransport._connect(connection, connect_timeout)
+        connection.sock.settimeout(read_timeout)
+        connection.request(method, target, body=body, headers=headers)
+        return connection.getresponse()
+
+    @staticmethod
+    def _connect(connection: http.client.HTTPConnection, timeout: Optional[float]) -> None:
+        """Establish the connection, including the TLS handshake for HTTPS."""
+        connection.timeout = timeout
+        connection.connect()
+        if connection.sock.family in (socket.AF_INET, socket.AF_INET6):
+            # Small writes, e.g. chunks of a streamed body, are sent immediately instead of waiting for an ACK
+            connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    @staticmethod
+    def _pool_key(url: str) -> Tuple[str, str, int]:
+        """Return the scheme, host and port identifying the connections to the server of a URL."""
+        parts = urlsplit(url)
+        return parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80)
+
+    def _acquire(self, key: Tuple[str, str, int]) -> (http.client.HTTPConnection, bool):
+        """Return an idle connection to the server and True, or a new connection and False."""
+        with self._lock:
+            if self._idle.get(key):
+                return self._idle[key].pop(), True
+        return self._new_connection(key), False
+
+    def _release(self, key: Tuple[str, str, int], connection: http.client.HTTPConnection) -> None:
+        """Keep a connection open for the next request, unless enough connections are idle."""
+        evicted = []
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            self._idle.move_to_end(key)
+            if len(idle) < self.pool_maxsize:
+                idle.append(connection)
+            else:
+                evicted.append(connection)
+            while len(self._idle) > self.pool_connections:
+                evicted += self._idle.popitem(last=False)[1]
+        for connection in evicted:
+            connection.close()
+
+    def _proxy(self, key: Tuple[str, str, int]) -> Optional[SplitResult]:
+        """Return the URL of the proxy to send the requests to the server through, or None to connect directly."""
+        if self.unix_socket is not None:
+            return None
+        if key not in self._proxies:
+            self._proxies[key] = _find_proxy(*key)
+        return self._proxies[key]
+
+    def _new_connection(self, key: Tuple[str, str, int]) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        if self.unix_socket is not None:
+            return _UnixHTTPConnection(self.unix_socket)
+        proxy = self._proxy(key)
+        if scheme == "https":
+            if self._ssl_context is None:
+                self._ssl_context = _create_ssl_context()
+            if proxy is None:
+                return http.client.HTTPSConnection(host, port, context=self._ssl_context)
+            connection = http.client.HTTPSConnection(proxy.hostname, proxy.port or 80, context=self._ssl_context)
+            connection.set_tunnel(host, port, headers=_proxy_headers(proxy))
+            return connection
+        if proxy is not None:
+            return http.client.HTTPConnection(proxy.hostname, proxy.port or 80)
+        return http.client.HTTPConnection(host, port)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """An HTTP connection to a server listening on a Unix domain socket."""
+
+    def __init__(self, socket_path: str):
+        super().__init__("localhost")
+        self.socket_path: str = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except BaseException:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class RequestsTransport(Transport):
+    """Sends requests using a requests session, which keeps connections open per server.
+
+    Attributes:
+        session: The requests session holding the connection pools
+    """
+
+    name = "requests"
+
+    def __init__(self, pool_connections: int = 1, pool_maxsize: int = 4, keep_alive: bool = True):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self._requests = requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+
+    def request(
+        self, method: str, url: str, headers: Dict[str, str], body: Body = None, timeout: Timeout = (None, None)
+    ) -> Response:
+        requests = self._requests
+        try:
+            server_response = self.session.request(
+                method, url, data=body, headers=headers, timeout=timeout, stream=True
+            )
+        except requests.Timeout as e:
+            raise RequestTimeoutError(str(e)) from e
+        except requests.RequestException as e:
+            raise ConnectionFailedError(str(e)) from e
+
+        def read(size: int) -> bytes:
+            from urllib3.exceptions import HTTPError, ReadTimeoutError
+
+            try:
+                return server_response.raw.read(size, decode_content=False)
+            except ReadTimeoutError as e:
+                raise RequestTimeoutError(str(e)) from e
+            except (HTTPError, OSError) as e:
+                raise ConnectionFailedError(str(e)) from e
+
+        return Response(
+            server_response.status_code,
+            server_response.reason,
+            server_response.headers,
+            read,
+            server_response.elapsed.total_seconds(),
+            server_response.close,
+        )
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class FakeTransport(Transport):
+    """Passes requests to a handler in the same process, without any network connection.
+
+    Attributes:
+        handler: Called with the method, URL, headers and complete body of each request.
+                 Returns the status code, headers and body of the response.
+    """
+
+    name = "fake"
+
+    def __init__(self, handler: Callable[[str, str, Dict[str, str], bytes], Tuple[int, Dict[str, str], bytes]]):
+        self.handler = handler
+
+    def request(
+        self, method: str, url: str, headers: Dict[str, str], body: Body = None, timeout: Timeout = (None, None)
+    ) -> Response:
+        headers = dict(headers)
+        if body is None:
+            body = b""
+        elif not isinstance(body, bytes):
+            body = b"".join(body)
+            headers["Transfer-Encoding"] = "chunked"
+
+        start = time.monotonic()
+        status_code, response_headers, response_body = self.handler(method, url, headers, body)
+        message = http.client.HTTPMessage()
+        for name, value in response_headers.items():
+            message[name] = value
+        return Response(
+            status_code,
+            http.client.responses.get(status_code, ""),
+            message,
+            io.BytesIO(response_body).read,
+            time.monotonic() - start,
+        )
+
+
+# The transports which can be configured, lightest first
+TRANSPORTS = {
+    HTTPClientTransport.name: HTTPClientTransport,
+    RequestsTransport.name: RequestsTransport,
+}
+
+# The modules the transports depend on, besides the standard library
+TRANSPORT_REQUIREMENTS = {
+    RequestsTransport.name: "requests",
+}
+
+
+def is_available(name: str) -> bool:
+    """Return whether the transport of the given name can be used, i.e. its dependencies are installed."""
+    if name not in TRANSPORTS:
+        return False
+    requirement = TRANSPORT_REQUIREMENTS.get(name)
+    return requirement is None or importlib.util.find_spec(requirement) is not None
+
+
+def create_transport(
+    name: Optional[str] = None,
+    pool_connections: int = 1,
+    pool_maxsize: int = 4,
+    keep_alive: bool = True,
+    unix_socket: str = None,
+) -> Transport:
+    """Create a transport.
+
+    Args:
+        name: (Optional) The name of the transport. Defaults to the lightest available one.
+        pool_connections: (Optional) The number of servers to keep connection pools for.
+        pool_maxsize: (Optional) The number of connections kept open per server.
+        keep_alive: (Optional) Whether connections are kept open between requests.
+        unix_socket: (Optional) The path of the Unix domain socket to send all requests to.
+
+    Returns:
+        The transport.
+
+    Raises:
+        ValueError: The transport is unknown, its dependencies are not installed
+                    or it doesn't support Unix domain sockets if one is given
+    """
+    if name is None:
+        name = next(
+            name for name in TRANSPORTS if is_available(name) and (unix_socket is None or TRANSPORTS[name].unix_sockets)
+        )
+    if not is_available(name):
+        raise ValueError(f"Transport {name!r} is not available")
+    if unix_socket is None:
+        return TRANSPORTS[name](pool_connections, pool_maxsize, keep_alive)
+    if not TRANSPORTS[name].unix_sockets:
+        raise ValueError(f"Transport {name!r} doesn't support Unix domain sockets")
+    return TRANSPORTS[name](pool_connections, pool_maxsize, keep_alive, unix_socket)
+
+
+def split_unix_socket(base_url: str) -> (str, Optional[str]):
+    """Split the path of a Unix domain socket off the URL of a server listening on one.
+
+    Two forms are supported: unix:///run/timewsync.sock names the socket only, while
+    http+unix://%2Frun%2Ftimewsync.sock/base/path holds the percent-encoded path of the socket
+    as host name and may be followed by a path.
+
+    Args:
+        base_url: The base URL of the server.
+
+    Returns:
+        The HTTP URL of the server, with "localhost" as host name if it listens on a Unix domain socket,
+        and the path of the socket, or None for other servers.
+    """
+    parts = urlsplit(base_url)
+    if parts.scheme == "unix":
+        return "http://localhost/", parts.path
+    if parts.scheme == "http+unix":
+        return urlunsplit(("http", "localhost", parts.path or "/", parts.query, "")), unquote(parts.netloc)
+    return base_url, None
+
+
+def _find_proxy(scheme: str, host: str, port: int) -> Optional[SplitResult]:
+    """Return the URL of the proxy set in the environment for a server, or None if it is connected to directly.
+
+    The proxy itself is reached over plain HTTP, as with urllib.
+    """
+    import urllib.request
+
+    proxy = urllib.request.getproxies().get(scheme)
+    if not proxy or urllib.request.proxy_bypass(f"{host}:{port}"):
+        return None
+    if "://" not in proxy:
+        proxy = "http://" + proxy
+    return urlsplit(proxy)
+
+
+def _proxy_headers(proxy: SplitResult) -> Dict[str, str]:
+    """Return the headers authenticating with the proxy using the credentials of its URL, if any."""
+    if proxy.username is None:
+        return {}
+    credentials = f"{unquote(proxy.username)}:{unquote(proxy.password or '')}".encode()
+    return {"Proxy-Authorization": "Basic " + base64.b64encode(credentials).decode("ascii")}
+
+
+def _create_ssl_context():
+    """Create the TLS context verifying servers with the CA bundle requests would use."""
+    import ssl
+
+    ca_bundle = os.environ.get("REQUESTS_CA_BUNDLE") or os.environ.get("CURL_CA_BUNDLE")
+    if ca_bundle is None:
+        try:
+            import certifi
+
+            ca_bundle = certifi.where()
+        except ImportError:
+            return ssl.create_default_context()
+    if os.path.isdir(ca_bundle):
+        return ssl.create_default_context(capath=ca_bundle)
+    return ssl.create_default_context(cafile=ca_bundle)
+
+
+def _drain(server_response: http.client.HTTPResponse) -> bool:
+    """Read the rest of a response body, if it is small, so its connection can be reused.
+
+    Returns:
+        Whether the body was read completely.
+    """
+    try:
+        server_response.read(DRAIN_LIMIT)
+    except (OSError, http.client.HTTPException):
+        return False
+    return server_response.isclosed()
+
+
+def _transport_error(error: Union[OSError, http.client.HTTPException]) -> TransportError:
+    """Convert an exception raised by http.client or the socket into a TransportError."""
+    if isinstance(error, socket.timeout):
+        return RequestTimeoutError(str(error) or "timed out")
+    return ConnectionFailedError(str(error) or type(error).__name__)